@@ -0,0 +1,166 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+# ADVN_NORM modes, in the order of their traced index (see variants.py)
+ADVN_NORMS = ("OFF", "EMA_PERC", "MAX_EMA_PERC", "MEAN", "EMA_MEAN")
+
+# ADVN_NORM modes normalising with the running statistics in advn_stats
+EMA_ADVN_NORMS = ("EMA_PERC", "MAX_EMA_PERC", "EMA_MEAN")
+
+# standard normal 5% / 95% quantiles and the density at them, used to turn
+# the streaming estimator's rank error into a step in advantage units
+_Z_95 = 1.6448536
+_PHI_95 = float(np.exp(-0.5 * _Z_95**2) / np.sqrt(2 * np.pi))
+
+
+def advantage_stats(advantages):
+    """p5, p95, mean and std of a batch of advantages.
+
+    Both percentiles come from one sort of the batch and equal
+    ``jnp.percentile(x, 5)`` / ``jnp.percentile(x, 95)`` exactly.
+    """
+    x = advantages.reshape(-1)
+    per_5, per_95 = jnp.percentile(x, jnp.array([5.0, 95.0], dtype=x.dtype))
+    return {
+        "advn_per_5": per_5,
+        "advn_per_95": per_95,
+        "advn_mean": x.mean(),
+        "advn_std": x.std(),
+    }
+
+
+def streaming_advantage_stats(advantages, advn_stats):
+    """Sort-free estimate of the batch statistics around the running ones.
+
+    Each percentile is moved from its running value by one Newton step on the
+    batch's empirical CDF, with the density taken from a normal fit (mean,
+    std). This needs a single pass of comparisons instead of a sort. The first
+    batch starts from the normal-fit percentiles, mean -/+ 1.645 std.
+    """
+    x = advantages.reshape(-1)
+    mean = x.mean()
+    std = x.std()
+    scale = std / _PHI_95 + 1e-8
+
+    def _step(prev, q, z):
+        start = jnp.where(prev == 0.0, mean + z * std, prev)
+        return start + scale * (q - (x <= start).mean())
+
+    return {
+        "advn_per_5": _step(advn_stats["advn_per_5"], 0.05, -_Z_95),
+        "advn_per_95": _step(advn_stats["advn_per_95"], 0.95, _Z_95),
+        "advn_mean": mean,
+        "advn_std": std,
+    }
+
+
+def normalize_advantages(gae, advn_stats, mode, mean_std=True):
+    """Normalize a minibatch of advantages according to ``ADVN_NORM``.
+
+    ``mode`` is a mode name, or a traced index into ADVN_NORMS, in which case
+    the mode is picked with ``lax.switch``. ``mean_std=False`` only centres
+    the advantages in ``MEAN`` mode.
+    """
+
+    def _mean(gae):
+        if mean_std:
+            return (gae - gae.mean()) / (gae.std() + 1e-8)
+        return gae - gae.mean()
+
+    branches = {
+        "OFF": lambda gae: gae,
+        "MEAN": _mean,
+        "EMA_MEAN": lambda gae: (gae - advn_stats["advn_mean"])
+        / (advn_stats["advn_std"] + 1e-8),
+        "EMA_PERC": lambda gae: gae
+        / (advn_stats["advn_per_95"] - advn_stats["advn_per_5"] + 1e-8),
+        "MAX_EMA_PERC": lambda gae: gae
+        / jnp.maximum(1.0, advn_stats["advn_per_95"] - advn_stats["advn_per_5"]),
+    }
+    if isinstance(mode, str):
+        return branches[mode](gae)
+    return jax.lax.switch(mode, [branches[name] for name in ADVN_NORMS], gae)
+
+
+def update_advantage_stats(advn_stats, advantages, ema_rate, method="SORT"):
+    """EMA update of ``advn_stats`` with the statistics of ``advantages``.
+
+    A statistic that is still exactly zero is initialised with the batch
+    value. ``method`` is ``"SORT"`` (exact percentiles) or ``"STREAMING"``
+    (see streaming_advantage_stats). All four statistics are computed
+    unconditionally and selected with ``jnp.where``, so nothing is duplicated
+    when the update is vmapped.
+    """
+    if method == "SORT":
+        batch = advantage_stats(advantages)
+    elif method == "STREAMING":
+        batch = streaming_advantage_stats(advantages, advn_stats)
+    else:
+        raise ValueError(f"unknown advantage statistics method {method}")
+
+    return {
+        key: jnp.where(
+            advn_stats[key] == 0.0,
+            batch[key],
+            ema_rate * batch[key] + (1 - ema_rate) * advn_stats[key],
+        )
+        for key in advn_stats
+    }
+
+
+def calculate_gae(rewards, values, dones, last_val, gamma, gae_lambda, method="SCAN"):
+    """GAE advantages of a [NUM_STEPS, ...] rollout.
+
+    ``method`` is ``"SCAN"``, a sequential reverse ``lax.scan``, or
+    ``"ASSOCIATIVE"``, which writes the done-masked recurrence
+    ``gae_t = delta_t + gamma * lambda * (1 - done_t) * gae_{t+1}`` as a
+    composition of affine maps and evaluates it with ``lax.associative_scan``
+    in O(log NUM_STEPS) depth. Both agree up to float rounding.
+    """
+    if method == "SCAN":
+
+        def _get_advantages(gae_and_next_value, transition):
+            gae, next_value = gae_and_next_value
+            done, value, reward = transition
+            delta = reward + gamma * next_value * (1 - done) - value
+            gae = delta + gamma * gae_lambda * (1 - done) * gae
+            return (gae, value), gae
+
+        _, advantages = jax.lax.scan(
+            _get_advantages,
+            (jnp.zeros_like(last_val), last_val),
+            (dones, values, rewards),
+            reverse=True,
+            unroll=16,
+        )
+        return advantages
+
+    if method != "ASSOCIATIVE":
+        raise ValueError(f"unknown GAE method {method}")
+
+    next_values = jnp.concatenate([values[1:], last_val[None]], axis=0)
+    deltas = rewards + gamma * next_values * (1 - dones) - values
+    decays = gamma * gae_lambda * (1 - dones)
+
+    # gae_t = f_t(gae_{t+1}) with f_t(x) = delta_t + decay_t * x. Scanning the
+    # time-reversed maps, (decay, delta) pairs compose as below.
+    def _compose(earlier, later):
+        decay_1, delta_1 = earlier
+        decay_2, delta_2 = later
+        return decay_1 * decay_2, delta_2 + decay_2 * delta_1
+
+    _, advantages = jax.lax.associative_scan(
+        _compose, (decays[::-1], deltas[::-1]), axis=0
+    )
+    return advantages[::-1]
+
+
+def monte_carlo_returns(rewards, dones, discount, method="SCAN"):
+    """Discounted reward-to-go of a [NUM_STEPS, ...] rollout.
+
+    Returns are cut at episode ends and at the end of the rollout (nothing is
+    bootstrapped). This is calculate_gae with all values at zero.
+    """
+    zeros = jnp.zeros_like(rewards)
+    return calculate_gae(rewards, zeros, dones, zeros[0], 1.0, discount, method)
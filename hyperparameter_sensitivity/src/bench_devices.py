@@ -0,0 +1,109 @@
+"""Throughput of ppo_continuous_action with the seeds sharded over CPU devices.
+
+Each device count runs in a fresh process, since the number of host devices
+is fixed once JAX has initialised its backend. Example:
+
+python bench_devices.py --env_name hopper --num_seeds 16 --device_counts 1,2,4,8
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+
+def run_worker(args):
+    import jax
+    from devices import set_host_device_count
+
+    # before ppo_continuous_action, whose imports initialise the backend
+    if args.worker > 1:
+        set_host_device_count(args.worker)
+    from ppo_continuous_action import build_config, batched_train_fn
+    from sweep import config_hypers
+
+    hypers = dict(
+        alg_type="lambda_ac",
+        env_name=args.env_name,
+        gae_lambda=0.9,
+        ent_coef=0.01,
+        actor_lr=3e-4,
+        critic_lr=3e-4,
+    )
+    config = build_config(hypers)
+    config.update(
+        DEBUG=False,
+        NUM_DEVICES=args.worker,
+        NUM_ENVS=args.num_envs,
+        TOTAL_TIMESTEPS=args.total_timesteps,
+    )
+    rngs = jax.random.split(jax.random.PRNGKey(0), args.num_seeds)
+    traced = config_hypers(hypers)
+
+    start = time.perf_counter()
+    train = jax.jit(batched_train_fn(config)).lower(rngs, traced).compile()
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    jax.block_until_ready(train(rngs, traced))
+    run_time = time.perf_counter() - start
+
+    env_steps = (
+        config["NUM_UPDATES"]
+        * config["NUM_STEPS"]
+        * config["NUM_ENVS"]
+        * config["ACTION_REPEAT"]
+        * args.num_seeds
+    )
+    print(
+        json.dumps(
+            {
+                "devices": args.worker,
+                "compile_s": compile_time,
+                "run_s": run_time,
+                "env_steps_per_s": env_steps / run_time,
+                "env_steps_per_s_per_device": env_steps / run_time / args.worker,
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--env_name", action="store", default="hopper", type=str)
+    parser.add_argument("--num_seeds", action="store", default=16, type=int)
+    parser.add_argument("--num_envs", action="store", default=128, type=int)
+    parser.add_argument("--total_timesteps", action="store", default=1e5, type=float)
+    parser.add_argument("--device_counts", action="store", default="1,2,4,8", type=str)
+    parser.add_argument("--output", action="store", default=None, type=str)
+    parser.add_argument("--worker", action="store", default=0, type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = []
+    for count in [int(c) for c in args.device_counts.split(",")]:
+        cmd = [sys.executable, __file__, "--worker", str(count)] + [
+            f"--{name}={getattr(args, name)}"
+            for name in ("env_name", "num_seeds", "num_envs", "total_timesteps")
+        ]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, check=True)
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    base = results[0]["env_steps_per_s"]
+    print("devices  compile_s  run_s  env_steps/s  per_device  speedup")
+    for r in results:
+        print(
+            f"{r['devices']:7d}  {r['compile_s']:9.1f}  {r['run_s']:5.1f}  "
+            f"{r['env_steps_per_s']:11.0f}  {r['env_steps_per_s_per_device']:10.0f}  "
+            f"{r['env_steps_per_s'] / base:7.2f}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Reset/step throughput of the Brax backends and of each layer of the wrapper stack.
+
+For every env and backend the training stack is built up one wrapper at a
+time (BraxGymnaxWrapper, then LogWrapper, ClipAction, VecEnv and
+NormalizeVecObservation). Each stack is timed on a vmapped reset and on a
+jitted rollout of --num_steps steps with uniform random actions. Stacks below
+VecEnv are vmapped by hand. Backends an env does not support (or mjx without
+mujoco's mjx) are reported and skipped. --reset_pool compares Brax's
+AutoResetWrapper (0) with wrappers.ResetPoolWrapper of the given sizes.
+
+--backend_table writes the fastest backend per env on the training stack
+(without observation normalization) as JSON. The training scripts accept that
+file as their --backend value. The backends differ in their physics,
+so returns are only comparable between runs on the same backend.
+
+python bench_envs.py --env_name hopper,swimmer --num_envs 128 --backend_table backends.json
+"""
+import argparse
+import json
+import time
+import jax
+
+from wrappers import (
+    BraxGymnaxWrapper,
+    LogWrapper,
+    ClipAction,
+    VecEnv,
+    NormalizeVecObservation,
+    default_backend,
+)
+
+ENV_NAMES = ("hopper", "swimmer", "halfcheetah", "walker2d", "ant")
+BACKENDS = ("positional", "generalized", "spring", "mjx")
+
+# wrappers in the order make_train_fns stacks them
+LAYERS = (
+    ("log", LogWrapper),
+    ("clip", ClipAction),
+    ("vec", VecEnv),
+    ("normalize", NormalizeVecObservation),
+)
+# the stack the backend table is chosen on
+TRAINING_STACK = "vec"
+
+
+def build_stacks(env_name, backend, reset_pool=0):
+    """Yield ``(name, env, vectorized)`` for each prefix of the wrapper stack."""
+    env = BraxGymnaxWrapper(env_name, backend=backend, reset_pool=reset_pool)
+    vectorized = False
+    yield "brax", env, vectorized
+    for name, wrapper in LAYERS:
+        env = wrapper(env)
+        vectorized |= wrapper is VecEnv
+        yield name, env, vectorized
+
+
+def time_fn(fn, args, repeats):
+    start = time.perf_counter()
+    jax.block_until_ready(fn(*args))
+    compile_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeats):
+        jax.block_until_ready(fn(*args))
+    return compile_s, (time.perf_counter() - start) / repeats
+
+
+def bench_stack(env, vectorized, num_envs, num_steps, repeats):
+    reset = env.reset if vectorized else jax.vmap(env.reset, in_axes=(0, None))
+    step = env.step if vectorized else jax.vmap(env.step, in_axes=(0, 0, 0, None))
+    action_size = env.action_space(None).shape[0]
+    # below VecEnv, the reset pool is drawn here and passed to step as params
+    pooled = not vectorized and env.reset_pool
+
+    @jax.jit
+    def reset_fn(rng):
+        params = env.make_reset_pool(rng) if pooled else None
+        _, state = reset(jax.random.split(rng, num_envs), None)
+        return state, params
+
+    @jax.jit
+    def rollout_fn(rng, state, params):
+        def _step(carry, unused):
+            state, rng = carry
+            rng, rng_action, rng_step = jax.random.split(rng, 3)
+            action = jax.random.uniform(
+                rng_action, (num_envs, action_size), minval=-1.0, maxval=1.0
+            )
+            _, state, reward, _, _ = step(
+                jax.random.split(rng_step, num_envs), state, action, params
+            )
+            return (state, rng), reward
+
+        (state, _), rewards = jax.lax.scan(_step, (state, rng), None, num_steps)
+        return state, rewards
+
+    rng = jax.random.PRNGKey(0)
+    reset_compile_s, reset_s = time_fn(reset_fn, (rng,), repeats)
+    state, params = reset_fn(rng)
+    step_compile_s, rollout_s = time_fn(rollout_fn, (rng, state, params), repeats)
+    return {
+        "reset_compile_s": reset_compile_s,
+        "step_compile_s": step_compile_s,
+        "resets_per_s": num_envs / reset_s,
+        "env_steps_per_s": num_envs * num_steps / rollout_s,
+    }
+
+
+def fastest_backends(results, reset_pool=0):
+    """env -> backend with the highest step throughput on TRAINING_STACK."""
+    table = {}
+    for env_name in dict.fromkeys(r["env_name"] for r in results):
+        candidates = [
+            r for r in results
+            if r["env_name"] == env_name
+            and r["stack"] == TRAINING_STACK
+            and r["reset_pool"] == reset_pool
+        ]
+        if candidates:
+            best = max(candidates, key=lambda r: r["env_steps_per_s"])
+            table[env_name] = best["backend"]
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--env_name", action="store", default=",".join(ENV_NAMES), type=str)
+    parser.add_argument("--backend", action="store", default=",".join(BACKENDS), type=str)
+    parser.add_argument("--num_envs", action="store", default=128, type=int)
+    parser.add_argument("--num_steps", action="store", default=100, type=int)
+    parser.add_argument("--repeats", action="store", default=5, type=int)
+    # reset pool sizes to compare (0: Brax's AutoResetWrapper)
+    parser.add_argument("--reset_pool", action="store", default="0", type=str)
+    parser.add_argument("--output", action="store", default="bench_envs.json", type=str)
+    parser.add_argument("--backend_table", action="store", default=None, type=str)
+    args = parser.parse_args()
+
+    reset_pools = [int(n) for n in args.reset_pool.split(",")]
+    results, skipped = [], []
+    for env_name in args.env_name.split(","):
+        for backend in args.backend.split(","):
+            for reset_pool in reset_pools:
+                try:
+                    stacks = list(build_stacks(env_name, backend, reset_pool))
+                except Exception as e:  # unsupported env/backend pair or missing mjx
+                    skipped.append({"env_name": env_name, "backend": backend, "error": repr(e)})
+                    print(f"skipping {env_name}/{backend}: {e!r}")
+                    break
+                for stack, env, vectorized in stacks:
+                    result = dict(
+                        env_name=env_name,
+                        backend=backend,
+                        reset_pool=reset_pool,
+                        stack=stack,
+                        **bench_stack(
+                            env, vectorized, args.num_envs, args.num_steps, args.repeats
+                        ),
+                    )
+                    results.append(result)
+                    print(
+                        f"{env_name:>12} {backend:>12} pool {reset_pool:>4} {'+' + stack:>11}: "
+                        f"{result['resets_per_s']:10.0f} resets/s "
+                        f"{result['env_steps_per_s']:10.0f} steps/s"
+                    )
+
+    table = fastest_backends(results, reset_pools[0])
+    for env_name, backend in table.items():
+        print(f"fastest backend for {env_name}: {backend} (default {default_backend(env_name)})")
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "num_envs": args.num_envs,
+                "num_steps": args.num_steps,
+                "results": results,
+                "skipped": skipped,
+                "fastest": table,
+            },
+            f,
+            indent=2,
+        )
+    if args.backend_table:
+        with open(args.backend_table, "w") as f:
+            json.dump(table, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Sequential vs associative-scan GAE (advantage.calculate_gae) across NUM_STEPS.
+
+python bench_gae.py --num_steps 10,100,1000 --num_envs 128 --num_seeds 10
+"""
+import argparse
+import time
+import jax
+import jax.numpy as jnp
+
+from advantage import calculate_gae
+
+METHODS = ("SCAN", "ASSOCIATIVE")
+
+
+def make_rollout(rng, num_seeds, num_steps, num_envs, done_prob=0.01):
+    shape = (num_seeds, num_steps, num_envs)
+    rng_r, rng_v, rng_d, rng_l = jax.random.split(rng, 4)
+    rewards = jax.random.normal(rng_r, shape)
+    values = jax.random.normal(rng_v, shape)
+    dones = jax.random.bernoulli(rng_d, done_prob, shape).astype(jnp.float32)
+    last_val = jax.random.normal(rng_l, (num_seeds, num_envs))
+    return rewards, values, dones, last_val
+
+
+def time_fn(fn, args, repeats):
+    jax.block_until_ready(fn(*args))
+    start = time.perf_counter()
+    for _ in range(repeats):
+        jax.block_until_ready(fn(*args))
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_steps", action="store", default="10,100,1000", type=str)
+    parser.add_argument("--num_envs", action="store", default=128, type=int)
+    parser.add_argument("--num_seeds", action="store", default=10, type=int)
+    parser.add_argument("--repeats", action="store", default=50, type=int)
+    args = parser.parse_args()
+
+    fns = {
+        method: jax.jit(
+            jax.vmap(
+                lambda r, v, d, l, method=method: calculate_gae(
+                    r, v, d, l, 0.99, 0.95, method
+                )
+            )
+        )
+        for method in METHODS
+    }
+
+    print("num_steps  " + "  ".join(f"{m.lower():>14}" for m in METHODS) + "  max_abs_diff")
+    for num_steps in [int(n) for n in args.num_steps.split(",")]:
+        rollout = make_rollout(
+            jax.random.PRNGKey(0), args.num_seeds, num_steps, args.num_envs
+        )
+        times = [time_fn(fns[m], rollout, args.repeats) for m in METHODS]
+        diff = jnp.abs(fns["SCAN"](*rollout) - fns["ASSOCIATIVE"](*rollout)).max()
+        print(
+            f"{num_steps:9d}  "
+            + "  ".join(f"{t * 1e3:11.3f} ms" for t in times)
+            + f"  {float(diff):12.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""End-to-end throughput of ppo_continuous_action over a grid of run settings.
+
+Every combination of the comma-separated lists is compiled and trained for
+--num_updates updates (twice: a warm-up run, then a timed run). The compile
+time, steady-state env steps/s, time per update and the executable's peak
+memory are recorded. Results go to --output as JSON, rewritten after every
+setting; settings that fail (e.g. an env the backend does not support) are
+reported and listed as skipped. With --baseline they
+are compared against a stored results file, matched on the grid settings, and
+the script exits with status 1 if any setting is slower by more than
+--tolerance. --update_baseline writes the results to --baseline instead.
+
+python bench_train.py --env_name hopper,ant --num_envs 64,128,256 --num_minibatches 32 \\
+    --num_seeds 1,8 --output bench_train.json --baseline ../benchmarks/train_baseline.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import jax
+
+from ppo_continuous_action import build_config, batched_train_fn
+from sweep import config_hypers
+from wrappers import default_backend
+
+GRID_KEYS = ("env_name", "backend", "num_envs", "num_steps", "num_minibatches", "num_seeds")
+ENV_NAMES = ("hopper", "swimmer", "halfcheetah", "walker2d", "ant")
+
+# settings of the training run that stay fixed across the grid
+HYPERS = dict(
+    alg_type="lambda_ac",
+    gae_lambda=0.9,
+    ent_coef=0.01,
+    actor_lr=3e-4,
+    critic_lr=3e-4,
+)
+
+
+def machine_info():
+    devices = jax.devices()
+    return {
+        "jax": jax.__version__,
+        "platform": jax.default_backend(),
+        "device_kind": devices[0].device_kind,
+        "device_count": len(devices),
+        "cpu_count": os.cpu_count(),
+        "processor": platform.processor() or platform.machine(),
+        "python": sys.version.split()[0],
+    }
+
+
+def peak_memory_bytes(compiled):
+    """Peak device memory of one call of ``compiled``, from XLA's buffer assignment.
+
+    Unlike the allocator's peak_bytes_in_use this is per executable, so the
+    settings of one benchmark process do not mask each other.
+    """
+    analysis = compiled.memory_analysis()
+    if analysis is None:
+        return None
+    return int(
+        analysis.temp_size_in_bytes
+        + analysis.argument_size_in_bytes
+        + analysis.output_size_in_bytes
+        - analysis.alias_size_in_bytes
+    )
+
+
+def bench_setting(setting, num_updates):
+    hypers = dict(HYPERS, env_name=setting["env_name"])
+    config = build_config(hypers)
+    config.update(
+        DEBUG=False,
+        BACKEND=setting["backend"],
+        NUM_ENVS=setting["num_envs"],
+        NUM_STEPS=setting["num_steps"],
+        NUM_MINIBATCHES=setting["num_minibatches"],
+        TOTAL_TIMESTEPS=num_updates * setting["num_steps"] * setting["num_envs"],
+    )
+    rngs = jax.random.split(jax.random.PRNGKey(0), setting["num_seeds"])
+    traced = config_hypers(hypers)
+
+    start = time.perf_counter()
+    train = jax.jit(batched_train_fn(config)).lower(rngs, traced).compile()
+    compile_s = time.perf_counter() - start
+
+    jax.block_until_ready(train(rngs, traced))
+    start = time.perf_counter()
+    jax.block_until_ready(train(rngs, traced))
+    run_s = time.perf_counter() - start
+
+    env_steps = num_updates * setting["num_steps"] * setting["num_envs"] * setting["num_seeds"]
+    return {
+        "compile_s": compile_s,
+        "env_steps_per_s": env_steps / run_s,
+        "ms_per_update": run_s / num_updates * 1e3,
+        "peak_memory_bytes": peak_memory_bytes(train),
+    }
+
+
+def grid(args):
+    lists = {
+        "env_name": args.env_name.split(","),
+        "backend": args.backend.split(","),
+        "num_envs": [int(n) for n in args.num_envs.split(",")],
+        "num_steps": [int(n) for n in args.num_steps.split(",")],
+        "num_minibatches": [int(n) for n in args.num_minibatches.split(",")],
+        "num_seeds": [int(n) for n in args.num_seeds.split(",")],
+    }
+    for values in itertools.product(*(lists[key] for key in GRID_KEYS)):
+        setting = dict(zip(GRID_KEYS, values))
+        if setting["backend"] == "default":
+            setting["backend"] = default_backend(setting["env_name"])
+        if setting["num_envs"] * setting["num_steps"] % setting["num_minibatches"]:
+            print(f"skipping {setting}: NUM_ENVS * NUM_STEPS not divisible by NUM_MINIBATCHES")
+            continue
+        yield setting
+
+
+def write_report(path, report):
+    with open(path + ".tmp", "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def setting_key(result):
+    return tuple(result[key] for key in GRID_KEYS)
+
+
+def compare(results, baseline, tolerance):
+    """Print throughput and compile time relative to ``baseline``; True if none regressed."""
+    reference = {setting_key(r): r for r in baseline["results"]}
+    ok = True
+    print("\n" + "  ".join(f"{key:>15}" for key in GRID_KEYS) + "  throughput  compile")
+    for result in results:
+        base = reference.get(setting_key(result))
+        if base is None:
+            continue
+        speed = result["env_steps_per_s"] / base["env_steps_per_s"]
+        compile_ratio = result["compile_s"] / base["compile_s"]
+        regressed = speed < 1.0 - tolerance
+        ok &= not regressed
+        print(
+            "  ".join(f"{str(v):>15}" for v in setting_key(result))
+            + f"  {speed:9.2f}x  {compile_ratio:6.2f}x"
+            + ("  REGRESSION" if regressed else "")
+        )
+    if baseline.get("machine") != machine_info():
+        print("note: the baseline was recorded on a different machine or JAX version")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--env_name", action="store", default=",".join(ENV_NAMES), type=str)
+    # Brax pipelines; "default" is the one training uses for each env
+    parser.add_argument("--backend", action="store", default="default", type=str)
+    parser.add_argument("--num_envs", action="store", default="128", type=str)
+    parser.add_argument("--num_steps", action="store", default="10", type=str)
+    parser.add_argument("--num_minibatches", action="store", default="32", type=str)
+    parser.add_argument("--num_seeds", action="store", default="1", type=str)
+    parser.add_argument("--num_updates", action="store", default=20, type=int)
+    parser.add_argument("--output", action="store", default="bench_train.json", type=str)
+    parser.add_argument("--baseline", action="store", default=None, type=str)
+    parser.add_argument("--update_baseline", action="store_true")
+    # allowed relative drop in env steps/s before a setting counts as a regression
+    parser.add_argument("--tolerance", action="store", default=0.1, type=float)
+    args = parser.parse_args()
+
+    results, skipped = [], []
+    report = {
+        "machine": machine_info(),
+        "num_updates": args.num_updates,
+        "results": results,
+        "skipped": skipped,
+    }
+    for setting in grid(args):
+        try:
+            result = dict(setting, **bench_setting(setting, args.num_updates))
+        except Exception as e:  # unsupported env/backend pair or missing mjx
+            skipped.append(dict(setting, error=repr(e)))
+            print(f"skipping {setting}: {e!r}")
+        else:
+            results.append(result)
+            print(
+                f"{setting}: compile {result['compile_s']:.1f} s, "
+                f"{result['env_steps_per_s']:.0f} env steps/s, {result['ms_per_update']:.2f} ms/update"
+            )
+        # written after every setting so an interrupted grid keeps its results
+        write_report(args.output, report)
+
+    if args.baseline and args.update_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        write_report(args.baseline, report)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
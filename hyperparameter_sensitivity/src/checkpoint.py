@@ -0,0 +1,147 @@
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+import jax
+from flax import serialization
+
+CHECKPOINT_FILE = "runner_state.msgpack"
+
+
+def _atomic_write(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def checkpoint_key(config, *args):
+    """Identifies a run by its config and its inputs (e.g. the rngs and hypers)."""
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode())
+    for leaf in jax.tree_util.tree_leaves(args):
+        leaf = np.asarray(leaf)
+        digest.update(f"{leaf.shape}:{leaf.dtype}".encode())
+        digest.update(leaf.tobytes())
+    return digest.hexdigest()[:20]
+
+
+def save_checkpoint(checkpoint_dir, runner_state, num_updates, key=None):
+    """Write the full runner state after ``num_updates`` updates.
+
+    ``key`` (see checkpoint_key) is stored with it and checked on load.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    state = {
+        "num_updates": num_updates,
+        "runner_state": serialization.to_state_dict(jax.device_get(runner_state)),
+    }
+    if key is not None:
+        state["key"] = key
+    _atomic_write(
+        os.path.join(checkpoint_dir, CHECKPOINT_FILE), serialization.msgpack_serialize(state)
+    )
+
+
+def load_checkpoint(checkpoint_dir, template, key=None):
+    """Restore ``(runner_state, num_updates)``, or ``(None, 0)`` without a checkpoint.
+
+    ``template`` only provides the pytree structure and static fields (e.g.
+    the result of ``jax.eval_shape`` on the init function). With ``key`` a
+    checkpoint saved under another key is refused.
+    """
+    path = os.path.join(checkpoint_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return None, 0
+    with open(path, "rb") as f:
+        state = serialization.msgpack_restore(f.read())
+    if key is not None and state.get("key") != key:
+        raise ValueError(
+            f"{path} belongs to a different config, hypers or seeds; "
+            "remove it or use another checkpoint directory"
+        )
+    runner_state = serialization.from_state_dict(template, state["runner_state"])
+    return runner_state, int(state["num_updates"])
+
+
+def _metrics_path(checkpoint_dir, start):
+    return os.path.join(checkpoint_dir, f"metrics_{start:08d}.npz")
+
+
+def _metric_chunks(checkpoint_dir):
+    return sorted(glob.glob(os.path.join(checkpoint_dir, "metrics_*.npz")))
+
+
+def save_metrics_chunk(checkpoint_dir, start, metrics):
+    if metrics is None:
+        return
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = _metrics_path(checkpoint_dir, start)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, **jax.device_get(metrics))
+    os.replace(path + ".tmp", path)
+
+
+def load_metrics(checkpoint_dir, num_updates, axis=1):
+    """Concatenate the metric chunks covering the first ``num_updates`` updates."""
+    chunks = []
+    for path in _metric_chunks(checkpoint_dir):
+        start = int(os.path.basename(path)[len("metrics_") : -len(".npz")])
+        if start < num_updates:
+            chunks.append(dict(np.load(path)))
+    if not chunks:
+        return None
+    return {
+        key: np.concatenate([chunk[key] for chunk in chunks], axis=axis)
+        for key in chunks[0]
+    }
+
+
+def clear_checkpoint(checkpoint_dir):
+    """Delete the checkpoints and metric chunks in ``checkpoint_dir`` and its subdirectories.
+
+    Called once a run's outputs are saved; directories left empty are removed.
+    """
+    if checkpoint_dir is None or not os.path.isdir(checkpoint_dir):
+        return
+    for root, _, files in os.walk(checkpoint_dir, topdown=False):
+        for path in _metric_chunks(root):
+            os.remove(path)
+        if CHECKPOINT_FILE in files:
+            os.remove(os.path.join(root, CHECKPOINT_FILE))
+        if not os.listdir(root):
+            os.rmdir(root)
+
+
+def train_chunked(
+    init_fn, update_fn, num_updates, chunk_updates, checkpoint_dir, update_axis=1, key=None
+):
+    """Run ``num_updates`` updates in jitted chunks, checkpointing after each.
+
+    ``init_fn()`` returns a fresh (batched) runner state and
+    ``update_fn(runner_state, n)`` runs ``n`` updates and returns
+    ``(runner_state, metrics)`` with the update axis at ``update_axis``. If
+    ``checkpoint_dir`` holds a checkpoint, training resumes from it; since the
+    runner state includes the rng, the result is identical to an
+    uninterrupted run. A checkpoint saved under another ``key`` is refused
+    (see load_checkpoint). Each chunk's metrics are written next to the
+    checkpoint as soon as they are available.
+    """
+    runner_state, start = load_checkpoint(checkpoint_dir, jax.eval_shape(init_fn), key)
+    if runner_state is None:
+        # metric chunks without a checkpoint are left over from an unfinished first chunk
+        for path in _metric_chunks(checkpoint_dir):
+            os.remove(path)
+        runner_state = init_fn()
+    else:
+        print(f"resuming from {checkpoint_dir} at update {start}")
+
+    while start < num_updates:
+        n = min(chunk_updates, num_updates - start)
+        runner_state, metrics = update_fn(runner_state, n)
+        # metrics go first so a checkpoint never points past its metrics
+        save_metrics_chunk(checkpoint_dir, start, metrics)
+        start += n
+        save_checkpoint(checkpoint_dir, runner_state, start, key)
+
+    return runner_state, load_metrics(checkpoint_dir, num_updates, axis=update_axis)
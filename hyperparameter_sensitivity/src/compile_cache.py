@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import jax
+import jaxlib
+import numpy as np
+from jax.experimental import serialize_executable
+
+from sweep import HYPER_KEYS, ALG_KEY, GRAPH_KEYS
+
+
+def enable_compilation_cache(cache_dir):
+    """Turn on JAX's persistent on-disk compilation cache.
+
+    Every jitted function (including the chunked update steps) is then
+    compiled at most once per machine for a given graph.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    jax.config.update("jax_compilation_cache_dir", cache_dir)
+    # the training graphs take minutes to build, so cache every executable
+    jax.config.update("jax_persistent_cache_min_compile_time_secs", 0.0)
+
+
+def graph_key(name, config, args):
+    """Cache key of the executable ``name`` compiled for ``config`` and ``args``.
+
+    Every config field except the traced hyperparameters is baked into the
+    graph, so all of them are part of the key, together with the argument
+    shapes, the JAX/jaxlib versions and the device setup.
+    """
+    traced = list(HYPER_KEYS.values()) + [ALG_KEY]
+    fields = {key: value for key, value in config.items() if key not in traced}
+    shapes = jax.tree_util.tree_map(
+        lambda x: f"{np.shape(x)}:{jax.numpy.result_type(x)}", args
+    )
+    payload = json.dumps(
+        {
+            "name": name,
+            "jax": jax.__version__,
+            "jaxlib": jaxlib.__version__,
+            "backend": jax.default_backend(),
+            "devices": jax.device_count(),
+            "config": fields,
+            "args": str(shapes),
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()[:20]
+
+
+def _aot_path(cache_dir, key):
+    return os.path.join(cache_dir, "aot", key + ".bin")
+
+
+def compile_aot(fn, args, cache_dir, name, config):
+    """Lower, compile and serialize ``fn`` for ``args``; returns the executable."""
+    compiled = jax.jit(fn).lower(*args).compile()
+    payload, _, _ = serialize_executable.serialize(compiled)
+    path = _aot_path(cache_dir, graph_key(name, config, args))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(payload)
+    os.replace(path + ".tmp", path)
+    print(f"compiled {name} ({config['ENV_NAME']}) to {path}")
+    return compiled
+
+
+def load_aot(fn, args, cache_dir, name, config):
+    """Load a serialized executable of ``fn`` for ``args``, or None if missing."""
+    path = _aot_path(cache_dir, graph_key(name, config, args))
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        payload = f.read()
+    # the pytree structures hold the static parts of the train state (e.g.
+    # the optimizer), so they are rebuilt by lowering instead of being stored.
+    # Lowering also registers the CPU custom calls the executable links
+    # against; loading without it crashes the process.
+    lowered = jax.jit(fn).lower(*args)
+    return serialize_executable.deserialize_and_load(
+        payload, lowered.in_tree, lowered.out_tree
+    )
+
+
+def load_or_compile(fn, args, cache_dir, name, config):
+    compiled = load_aot(fn, args, cache_dir, name, config)
+    if compiled is None:
+        compiled = compile_aot(fn, args, cache_dir, name, config)
+    return compiled
+
+
+def graph_representatives(exp, keys=GRAPH_KEYS):
+    """One sweep index per distinct graph-defining permutation of ``exp``."""
+    seen = {}
+    for idx in range(exp.numPermutations()):
+        hypers = exp.getPermutation(idx)["metaParameters"]
+        seen.setdefault(tuple(hypers.get(k) for k in keys), idx)
+    return list(seen.values())
@@ -0,0 +1,59 @@
+import argparse
+import jax
+import numpy as np
+from jax.experimental.shard_map import shard_map
+from jax.sharding import Mesh, PartitionSpec as P
+
+BATCH_AXIS = "batch"
+
+
+def set_host_device_count(num_devices):
+    """Split the host CPU into ``num_devices`` XLA devices.
+
+    Must be called before JAX creates its backends, i.e. before the first
+    computation or device query.
+    """
+    jax.config.update("jax_num_cpu_devices", num_devices)
+
+
+def set_host_device_count_from_argv(argv=None):
+    """Apply a ``--num_devices`` command line flag ahead of the full parse.
+
+    Importing gymnax already initialises the backends, so scripts call this
+    before importing the wrappers.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--num_devices", action="store", default=1, type=int)
+    args, _ = parser.parse_known_args(argv)
+    if args.num_devices > 1:
+        set_host_device_count(args.num_devices)
+
+
+def batch_mesh(num_devices=None):
+    """1-D mesh over the first ``num_devices`` devices (all by default)."""
+    devices = jax.devices()
+    if num_devices:
+        assert num_devices <= len(devices), (
+            f"{num_devices} devices requested but only {len(devices)} available"
+        )
+        devices = devices[:num_devices]
+    return Mesh(np.array(devices), (BATCH_AXIS,))
+
+
+def shard_leading_axis(fn, mesh, in_specs):
+    """Run ``fn`` independently on a slice of the leading batch axis per device.
+
+    ``in_specs`` gives, per positional argument, whether its leading axis is
+    the batch axis (True) or the argument is replicated (False). Every output
+    must carry the batch axis first. The lanes of a vmapped train never
+    communicate, so each device simply runs its own slice.
+    """
+    specs = tuple(P(BATCH_AXIS) if sharded else P() for sharded in in_specs)
+    return shard_map(fn, mesh, in_specs=specs, out_specs=P(BATCH_AXIS), check_rep=False)
+
+
+def check_divisible(size, mesh, name):
+    num_devices = mesh.devices.size
+    assert size % num_devices == 0, (
+        f"{name} ({size}) must be a multiple of the device count ({num_devices})"
+    )
@@ -0,0 +1,116 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+from sweep import pack_lane_id
+
+# one record per finished episode, appended to the binary log. ``run`` is
+# the id EpisodeLogger.new_run handed to the train and ``lane`` the lane's
+# sweep.lane_id, so the records of concurrent runs, configs and seeds that
+# share the log can be told apart.
+EPISODE_DTYPE = np.dtype(
+    [
+        ("run", np.uint32),
+        ("lane", np.uint64),
+        ("global_step", np.int32),
+        ("env", np.int32),
+        ("length", np.int32),
+        ("return", np.float32),
+    ]
+)
+
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+
+class EpisodeLogger:
+    """Appends finished episodes to a binary log from a background thread.
+
+    ``push`` is meant to be the target of ``jax.debug.callback``: it only
+    slices the compacted per-update arrays (see episodes.compact_episodes) and
+    puts them on a bounded queue, so the training loop never waits on file IO
+    or string formatting. The writer thread drains everything queued, writes
+    it with one ``write`` call, and every ``summary_seconds`` (0 disables)
+    logs a one-line text summary through ``logging``.
+
+    Each train takes a run id from ``new_run``, which also writes the id and
+    the train's description to the text log.
+    """
+
+    def __init__(self, path, max_queue=256, summary_seconds=60.0):
+        self.path = path
+        self.summary_seconds = summary_seconds
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._file = open(path, "ab")
+        self._num_episodes = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def new_run(self, description):
+        """A random id for the episodes of one train, logged with ``description``."""
+        run = int.from_bytes(os.urandom(4), "little")
+        logging.info(f"episode log {self.path} run {run}: pid {os.getpid()}, {description}")
+        return run
+
+    def push(self, run, lane, episodes):
+        count = int(episodes["count"])
+        if count == 0:
+            return
+        records = np.empty(count, dtype=EPISODE_DTYPE)
+        records["run"] = run
+        records["lane"] = pack_lane_id(lane)
+        for name in EPISODE_DTYPE.names[2:]:
+            records[name] = np.asarray(episodes[name])[:count]
+        # blocks when the writer falls behind instead of dropping episodes
+        self._queue.put(records)
+
+    def _run(self):
+        last_summary = time.monotonic()
+        closing = False
+        while not closing:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = any(records is None for records in batch)
+            batch = [records for records in batch if records is not None]
+            if batch:
+                records = np.concatenate(batch)
+                self._file.write(records.tobytes())
+                self._file.flush()
+                self._num_episodes += len(records)
+
+                now = time.monotonic()
+                if self.summary_seconds and now - last_summary >= self.summary_seconds:
+                    last_summary = now
+                    logging.info(
+                        f"episodes={self._num_episodes}, "
+                        f"global step={int(records['global_step'][-1])}, "
+                        f"mean episodic return={float(records['return'].mean()):.2f}"
+                    )
+        self._file.close()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+def get_episode_logger(path, summary_seconds=60.0):
+    """Process-wide logger for ``path``, flushed and closed at exit."""
+    with _loggers_lock:
+        if path not in _loggers:
+            logger = EpisodeLogger(path, summary_seconds=summary_seconds)
+            atexit.register(logger.close)
+            _loggers[path] = logger
+        return _loggers[path]
+
+
+def read_episode_log(path):
+    """Load a binary episode log as a structured numpy array."""
+    return np.fromfile(path, dtype=EPISODE_DTYPE)
@@ -0,0 +1,132 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+from flax import struct
+
+
+@struct.dataclass
+class EpisodeBuffer:
+    """Fixed-capacity ring buffer of completed episodes, kept on device.
+
+    Only finished episodes are written, so the buffer replaces the dense
+    [NUM_UPDATES, NUM_STEPS, NUM_ENVS] info tensors. ``count`` is the total
+    number of episodes seen; once it exceeds the capacity the oldest rows are
+    overwritten.
+    """
+
+    returns: jnp.ndarray
+    lengths: jnp.ndarray
+    global_step: jnp.ndarray
+    env_idx: jnp.ndarray
+    count: jnp.ndarray
+
+
+def init_episode_buffer(capacity):
+    return EpisodeBuffer(
+        returns=jnp.zeros((capacity,), dtype=jnp.float32),
+        lengths=jnp.zeros((capacity,), dtype=jnp.int32),
+        global_step=jnp.zeros((capacity,), dtype=jnp.int32),
+        env_idx=jnp.zeros((capacity,), dtype=jnp.int32),
+        count=jnp.zeros((), dtype=jnp.int32),
+    )
+
+
+def _episode_columns(info, num_envs):
+    """Flatten a rollout's LogWrapper info into time-major episode columns."""
+    env_idx = jnp.broadcast_to(
+        jnp.arange(num_envs, dtype=jnp.int32), info["returned_episode"].shape
+    )
+    return {
+        "return": info["returned_episode_returns"].reshape(-1).astype(jnp.float32),
+        "length": info["returned_episode_lengths"].reshape(-1).astype(jnp.int32),
+        "global_step": (info["timestep"] * num_envs).reshape(-1).astype(jnp.int32),
+        "env": env_idx.reshape(-1),
+    }
+
+
+def record_episodes(buffer, info, num_envs):
+    """Append the episodes finished during one rollout.
+
+    ``info`` is the LogWrapper info of a rollout with shape [NUM_STEPS, NUM_ENVS].
+    Episodes are appended in time-major order; the global step of an episode is
+    the number of env steps taken across all envs when it finished.
+    """
+    capacity = buffer.returns.shape[0]
+    done = info["returned_episode"].reshape(-1)
+    columns = _episode_columns(info, num_envs)
+
+    pos = buffer.count + jnp.cumsum(done, dtype=jnp.int32) - 1
+    new_count = buffer.count + done.sum(dtype=jnp.int32)
+    # rows overwritten again within this same rollout are dropped so every slot
+    # receives at most one write
+    keep = done & (pos >= new_count - capacity)
+    idx = jnp.where(keep, pos % capacity, capacity)
+
+    def _write(column, values):
+        return column.at[idx].set(values, mode="drop")
+
+    return EpisodeBuffer(
+        returns=_write(buffer.returns, columns["return"]),
+        lengths=_write(buffer.lengths, columns["length"]),
+        global_step=_write(buffer.global_step, columns["global_step"]),
+        env_idx=_write(buffer.env_idx, columns["env"]),
+        count=new_count,
+    )
+
+
+def compact_episodes(info, num_envs):
+    """Move the episodes finished during one rollout to the front.
+
+    Returns ``count`` and fixed-size [NUM_STEPS * NUM_ENVS] columns whose
+    first ``count`` rows are the finished episodes in time-major order, so the
+    host only has to slice them.
+    """
+    done = info["returned_episode"].reshape(-1)
+    idx = jnp.where(done, jnp.cumsum(done, dtype=jnp.int32) - 1, done.shape[0])
+    compact = {
+        key: jnp.zeros_like(values).at[idx].set(values, mode="drop")
+        for key, values in _episode_columns(info, num_envs).items()
+    }
+    compact["count"] = done.sum(dtype=jnp.int32)
+    return compact
+
+
+def episode_table(buffer):
+    """Flatten a (seed-batched) EpisodeBuffer into a host-side table.
+
+    Returns a dict of equal-length numpy columns ``seed``, ``return``,
+    ``length``, ``global_step`` and ``env`` in chronological order per seed.
+    If a seed finished more episodes than the capacity only the most recent
+    ones are kept.
+    """
+    buffer = jax.device_get(buffer)
+    returns = np.atleast_2d(buffer.returns)
+    lengths = np.atleast_2d(buffer.lengths)
+    global_step = np.atleast_2d(buffer.global_step)
+    env_idx = np.atleast_2d(buffer.env_idx)
+    counts = np.atleast_1d(buffer.count)
+    capacity = returns.shape[1]
+
+    columns = {"seed": [], "return": [], "length": [], "global_step": [], "env": []}
+    for seed, count in enumerate(counts):
+        n = min(int(count), capacity)
+        order = (np.arange(n) + max(int(count) - capacity, 0)) % capacity
+        columns["seed"].append(np.full(n, seed, dtype=np.int32))
+        columns["return"].append(returns[seed, order])
+        columns["length"].append(lengths[seed, order])
+        columns["global_step"].append(global_step[seed, order])
+        columns["env"].append(env_idx[seed, order])
+    return {key: np.concatenate(value) for key, value in columns.items()}
+
+
+def save_episode_table(path, buffer):
+    np.savez(path, **episode_table(buffer))
+
+
+def load_episode_returns(path):
+    """Per-seed lists of episodic returns from a saved episode table."""
+    table = np.load(path)
+    return [
+        table["return"][table["seed"] == seed].tolist()
+        for seed in np.unique(table["seed"])
+    ]
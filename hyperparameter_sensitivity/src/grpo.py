@@ -16,13 +16,43 @@ import os
 from threading import Lock
 import logging
 
+if __name__ == "__main__":
+    # the host device count must be set before gymnax (imported by wrappers)
+    # initialises the JAX backend
+    from devices import set_host_device_count_from_argv
+
+    set_host_device_count_from_argv()
+
 from wrappers import (
     LogWrapper,
     BraxGymnaxWrapper,
     VecEnv,
     NormalizeVecObservation,
     ClipAction,
+    resolve_backend,
+    load_backend,
+)
+from episodes import (
+    init_episode_buffer,
+    record_episodes,
+    save_episode_table,
+)
+from devices import batch_mesh, shard_leading_axis, check_divisible
+from advantage import (
+    EMA_ADVN_NORMS,
+    update_advantage_stats,
+    calculate_gae,
+    monte_carlo_returns,
 )
+from sweep import HYPER_KEYS, config_hypers
+from variants import variant_config
+from compile_cache import (
+    enable_compilation_cache,
+    compile_aot,
+    load_or_compile,
+    graph_representatives,
+)
+from profiling import profile_train, phase_output
 
 logging.basicConfig(
     filename='/hyperparameter_sensitivity/returns/episodic_returns_timestep.txt',  
@@ -30,10 +60,9 @@ logging.basicConfig(
     format="%(asctime)s - %(message)s",  
     datefmt="%Y-%m-%d %H:%M:%S"  
 )
+EXP_PATH = "../experiments/ppo_variants_brax.json"
 
 # jax.config.update("jax_enable_x64", True)
-last_save_timestep = 0
-cumulative_data = []
 
 class ActorTrainState(TrainState):
     advn_stats: dict[float, float]
@@ -97,24 +126,38 @@ class Transition(NamedTuple):
     obs: jnp.ndarray
     info: jnp.ndarray
 
+
+class RunnerState(NamedTuple):
+    actor_train_state: TrainState
+    critic_train_state: TrainState
+    env_state: Any
+    last_obs: jnp.ndarray
+    rng: jnp.ndarray
+    episodes: Any = None
+
 def make_train(config):
-    config["NUM_UPDATES"] = (
-        config["TOTAL_TIMESTEPS"] // config["NUM_STEPS"] // config["NUM_ENVS"]
+    # TOTAL_TIMESTEPS counts physics steps, ACTION_REPEAT of them per agent step
+    config["NUM_UPDATES"] = int(
+        config["TOTAL_TIMESTEPS"]
+        // config["NUM_STEPS"]
+        // config["NUM_ENVS"]
+        // config.get("ACTION_REPEAT", 1)
     )
     config["MINIBATCH_SIZE"] = (
         config["NUM_ENVS"] * config["NUM_STEPS"] // config["NUM_MINIBATCHES"]
     )
-    if config["ENV_NAME"] == "swimmer":
-        env, env_params = (
-            BraxGymnaxWrapper(config["ENV_NAME"], backend="generalized"),
-            None,
-        )
-    else:
-        env, env_params = (
-            BraxGymnaxWrapper(config["ENV_NAME"], backend="positional"),
-            None,
-        )
-    env = LogWrapper(env)
+    backend = resolve_backend(config["ENV_NAME"], config.get("BACKEND"))
+    env, env_params = (
+        BraxGymnaxWrapper(
+            config["ENV_NAME"],
+            backend=backend,
+            reset_pool=config.get("RESET_POOL", 0),
+            episode_length=config.get("EPISODE_LENGTH", 1000),
+            action_repeat=config.get("ACTION_REPEAT", 1),
+        ),
+        None,
+    )
+    env = LogWrapper(env, action_repeat=config.get("ACTION_REPEAT", 1))
     env = ClipAction(env)
     env = VecEnv(env)
     if config["NORMALIZE_OBS"]:
@@ -128,7 +171,12 @@ def make_train(config):
         )
         return config["LR"] * frac
 
-    def train(rng):
+    def train(rng, hypers=None):
+        # hypers holds the traced scalar hyperparameters (see sweep.HYPER_KEYS),
+        # so one compiled train serves any point of the numeric grid.
+        if hypers is None:
+            hypers = {key: config[key] for key in HYPER_KEYS.values()}
+
         # INIT NETWORK
         actor_network = Actor(
             env.action_space(env_params).shape[0], activation=config["ACTIVATION"]
@@ -141,7 +189,8 @@ def make_train(config):
         init_x = jnp.zeros(env.observation_space(env_params).shape)
         actor_network_params = actor_network.init(_rng, init_x)
         rng, _rng = jax.random.split(rng)
-        critic_network_params = critic_network.init(_rng, init_x)
+        if not config.get("CRITIC_FREE"):
+            critic_network_params = critic_network.init(_rng, init_x)
 
         if config["ANNEAL_LR"]:
             actor_tx = optax.chain(
@@ -155,11 +204,15 @@ def make_train(config):
         else:
             actor_tx = optax.chain(
                 optax.clip_by_global_norm(config["MAX_GRAD_NORM"]),
-                optax.adam(config["ACTOR_LR"], eps=1e-5),
+                optax.inject_hyperparams(optax.adam)(
+                    learning_rate=hypers["ACTOR_LR"], eps=1e-5
+                ),
             )
             critic_tx = optax.chain(
                 optax.clip_by_global_norm(config["MAX_GRAD_NORM"]),
-                optax.adam(config["CRITIC_LR"], eps=1e-5),
+                optax.inject_hyperparams(optax.adam)(
+                    learning_rate=hypers["CRITIC_LR"], eps=1e-5
+                ),
             )
         actor_train_state = ActorTrainState.create(
             apply_fn=actor_network.apply,
@@ -172,11 +225,15 @@ def make_train(config):
                 "advn_std": 0.0,
             },
         )
-        critic_train_state = TrainState.create(
-            apply_fn=critic_network.apply,
-            params=critic_network_params,
-            tx=critic_tx,
-        )
+        # CRITIC_FREE: no critic is built, evaluated or trained; the policy
+        # is updated from Monte-Carlo returns alone
+        critic_train_state = None
+        if not config.get("CRITIC_FREE"):
+            critic_train_state = TrainState.create(
+                apply_fn=critic_network.apply,
+                params=critic_network_params,
+                tx=critic_tx,
+            )
         # INIT ENV
         rng, _rng = jax.random.split(rng)
         reset_rng = jax.random.split(_rng, config["NUM_ENVS"])
@@ -193,16 +250,19 @@ def make_train(config):
                     env_state,
                     last_obs,
                     rng,
-                ) = runner_state
+                ) = runner_state[:5]
 
                 # SELECT ACTION
                 rng, _rng = jax.random.split(rng)
                 pi = actor_network.apply(actor_train_state.params, last_obs)
-                value = critic_network.apply(critic_train_state.params, last_obs)
+                if config.get("CRITIC_FREE"):
+                    value = jnp.zeros(last_obs.shape[:1])
+                else:
+                    value = critic_network.apply(critic_train_state.params, last_obs)
 
-                if config["SYMLOG_CRITIC_TARGETS"]:
-                    symexp = lambda x: jnp.sign(x) * (jnp.exp(jnp.abs(x)) - 1)
-                    value = symexp(value)
+                    if config["SYMLOG_CRITIC_TARGETS"]:
+                        symexp = lambda x: jnp.sign(x) * (jnp.exp(jnp.abs(x)) - 1)
+                        value = symexp(value)
 
                 action = pi.sample(seed=_rng)
                 log_prob = pi.log_prob(action)
@@ -222,18 +282,17 @@ def make_train(config):
                 transition = Transition(
                     done, action, value, reward, log_prob, last_obs, info
                 )
-                runner_state = (
-                    actor_train_state,
-                    critic_train_state,
-                    env_state,
-                    obsv,
-                    rng,
+                runner_state = runner_state._replace(
+                    env_state=env_state, last_obs=obsv, rng=rng
                 )
                 return runner_state, transition
 
-            runner_state, traj_batch = jax.lax.scan(
-                _env_step, runner_state, None, config["NUM_STEPS"]
-            )
+            with jax.named_scope("env_rollout"):
+                runner_state, traj_batch = jax.lax.scan(
+                    _env_step, runner_state, None, config["NUM_STEPS"]
+                )
+            if config.get("STOP_AFTER_PHASE") == "env_rollout":
+                return runner_state, phase_output(traj_batch)
 
             # CALCULATE ADVANTAGE
             (
@@ -242,84 +301,63 @@ def make_train(config):
                 env_state,
                 last_obs,
                 rng,
-            ) = runner_state
-            last_val = critic_network.apply(critic_train_state.params, last_obs)
-            if config["SYMLOG_CRITIC_TARGETS"]:
-                symexp = lambda x: jnp.sign(x) * (jnp.exp(jnp.abs(x)) - 1)
-                last_val = symexp(last_val)
+            ) = runner_state[:5]
 
             def _calculate_gae(traj_batch, last_val):
-                def _get_advantages(gae_and_next_value, transition):
-                    gae, next_value = gae_and_next_value
-                    done, value, reward = (
-                        transition.done,
-                        transition.value,
-                        transition.reward,
-                    )
-                    delta = reward + config["GAMMA"] * 0 * next_value * (1 - done) - 0 * value
-                    # jax.debug.print("delta = {}", delta)
-                    gae = (
-                        delta
-                        + config["GAMMA"] * config["GAE_LAMBDA"] * (1 - done) * gae
-                    )
-                    return (gae, value), gae
-
-                _, advantages = jax.lax.scan(
-                    _get_advantages,
-                    (jnp.zeros_like(last_val), last_val),
-                    traj_batch,
-                    reverse=True,
-                    unroll=16,
+                # the critic is not used: delta_t is the reward alone
+                advantages = calculate_gae(
+                    traj_batch.reward,
+                    0 * traj_batch.value,
+                    traj_batch.done,
+                    0 * last_val,
+                    config["GAMMA"],
+                    hypers["GAE_LAMBDA"],
+                    config.get("GAE_METHOD", "SCAN"),
                 )
-                # Qs = advantages + traj_batch.value
-                # jax.debug.print("traj_batch.value = {}", traj_batch.value.size)
-                # jax.debug.print("traj_batch.done = {}", traj_batch.done)
-                # print(traj_batch.done)
-                # jax.debug.print("advantages = {}", advantages)
-                # jax.debug.print("Qs = {}", Qs)
-                # return 0 * Qs, 0 * Qs
                 return advantages, advantages
                 # return advantages, advantages + traj_batch.value
 
-            advantages, targets = _calculate_gae(traj_batch, last_val)
-
-            actor_train_state.advn_stats["advn_per_5"] = jax.lax.cond(
-                actor_train_state.advn_stats["advn_per_5"] == 0.0,
-                lambda x: jnp.percentile(x, 5),
-                lambda x: config["EMA_RATE"] * jnp.percentile(x, 5)
-                + (1 - config["EMA_RATE"]) * actor_train_state.advn_stats["advn_per_5"],
-                advantages,
-            )
-
-            actor_train_state.advn_stats["advn_per_95"] = jax.lax.cond(
-                actor_train_state.advn_stats["advn_per_95"] == 0.0,
-                lambda x: jnp.percentile(x, 95),
-                lambda x: config["EMA_RATE"] * jnp.percentile(x, 95)
-                + (1 - config["EMA_RATE"])
-                * actor_train_state.advn_stats["advn_per_95"],
-                advantages,
-            )
-
-            actor_train_state.advn_stats["advn_mean"] = jax.lax.cond(
-                actor_train_state.advn_stats["advn_mean"] == 0.0,
-                lambda x: x.mean(),
-                lambda x: config["EMA_RATE"] * x.mean()
-                + (1 - config["EMA_RATE"]) * actor_train_state.advn_stats["advn_mean"],
-                advantages,
-            )
-
-            actor_train_state.advn_stats["advn_std"] = jax.lax.cond(
-                actor_train_state.advn_stats["advn_std"] == 0.0,
-                lambda x: x.std(),
-                lambda x: config["EMA_RATE"] * x.std()
-                + (1 - config["EMA_RATE"]) * actor_train_state.advn_stats["advn_std"],
-                advantages,
-            )
+            if config.get("CRITIC_FREE"):
+                with jax.named_scope("gae"):
+                    advantages = monte_carlo_returns(
+                        traj_batch.reward,
+                        traj_batch.done,
+                        config["GAMMA"] * hypers["GAE_LAMBDA"],
+                        config.get("GAE_METHOD", "SCAN"),
+                    )
+                targets = None
+            else:
+                last_val = critic_network.apply(critic_train_state.params, last_obs)
+                if config["SYMLOG_CRITIC_TARGETS"]:
+                    symexp = lambda x: jnp.sign(x) * (jnp.exp(jnp.abs(x)) - 1)
+                    last_val = symexp(last_val)
+                with jax.named_scope("gae"):
+                    advantages, targets = _calculate_gae(traj_batch, last_val)
+            if config.get("STOP_AFTER_PHASE") == "gae":
+                return runner_state, phase_output(advantages, targets)
+
+            if config["ADVN_NORM"] in EMA_ADVN_NORMS:
+                with jax.named_scope("advantage_stats"):
+                    actor_train_state = actor_train_state.replace(
+                        advn_stats=update_advantage_stats(
+                            actor_train_state.advn_stats,
+                            advantages,
+                            config["EMA_RATE"],
+                            config.get("ADVN_STATS", "SORT"),
+                        )
+                    )
+            if config.get("STOP_AFTER_PHASE") == "advantage_stats":
+                return runner_state, phase_output(
+                    advantages, targets, actor_train_state.advn_stats
+                )
 
             # UPDATE NETWORK
             def _update_epoch(update_state, unused):
-                def _update_minbatch(train_state, batch_info):
-                    traj_batch, advantages, targets = batch_info
+                def _update_minbatch(train_state, minibatch_idx):
+                    # gather this minibatch's rows from the flat rollout in place
+                    traj_batch, advantages, targets = jax.tree_util.tree_map(
+                        lambda x: jnp.take(x, minibatch_idx, axis=0), batch
+                    )
                     actor_train_state, critic_train_state = train_state
 
                     def _critic_loss_fn(critic_params, traj_batch, gae, targets):
@@ -385,26 +423,29 @@ def make_train(config):
                         loss_actor = loss_actor.mean()
                         entropy = pi.entropy().mean()
 
-                        total_loss = loss_actor - config["ENT_COEF"] * entropy
+                        total_loss = loss_actor - hypers["ENT_COEF"] * entropy
 
                         return total_loss, (loss_actor, entropy)
 
                     actor_grad_fn = jax.value_and_grad(_actor_loss_fn, has_aux=True)
                     critic_grad_fn = jax.value_and_grad(_critic_loss_fn, has_aux=True)
 
-                    critic_loss, critic_grads = critic_grad_fn(
-                        critic_train_state.params, traj_batch, advantages, targets
-                    )
-
                     actor_loss, actor_grads = actor_grad_fn(
                         actor_train_state.params, traj_batch, advantages, targets
                     )
 
-                    total_loss = actor_loss + critic_loss
+                    if config.get("CRITIC_FREE"):
+                        total_loss = actor_loss
+                    else:
+                        critic_loss, critic_grads = critic_grad_fn(
+                            critic_train_state.params, traj_batch, advantages, targets
+                        )
 
-                    critic_train_state = critic_train_state.apply_gradients(
-                        grads=critic_grads
-                    )
+                        total_loss = actor_loss + critic_loss
+
+                        critic_train_state = critic_train_state.apply_gradients(
+                            grads=critic_grads
+                        )
 
                     actor_train_state = actor_train_state.apply_gradients(
                         grads=actor_grads
@@ -413,99 +454,144 @@ def make_train(config):
                     train_state = (actor_train_state, critic_train_state)
                     return train_state, total_loss
 
-                (
-                    actor_train_state,
-                    critic_train_state,
-                    traj_batch,
-                    advantages,
-                    targets,
-                    rng,
-                ) = update_state
+                actor_train_state, critic_train_state, batch, rng = update_state
                 rng, _rng = jax.random.split(rng)
-                batch_size = config["MINIBATCH_SIZE"] * config["NUM_MINIBATCHES"]
-                assert (
-                    batch_size == config["NUM_STEPS"] * config["NUM_ENVS"]
-                ), "batch size must be equal to number of steps * number of envs"
+                # only the indices are shuffled; _update_minbatch gathers the rows
                 permutation = jax.random.permutation(_rng, batch_size)
-                batch = (traj_batch, advantages, targets)
-                batch = jax.tree_util.tree_map(
-                    lambda x: x.reshape((batch_size,) + x.shape[2:]), batch
-                )
-                shuffled_batch = jax.tree_util.tree_map(
-                    lambda x: jnp.take(x, permutation, axis=0), batch
-                )
-                minibatches = jax.tree_util.tree_map(
-                    lambda x: jnp.reshape(
-                        x, [config["NUM_MINIBATCHES"], -1] + list(x.shape[1:])
-                    ),
-                    shuffled_batch,
-                )
+                minibatch_indices = permutation.reshape((config["NUM_MINIBATCHES"], -1))
                 train_state = (actor_train_state, critic_train_state)
                 train_state, total_loss = jax.lax.scan(
-                    _update_minbatch, train_state, minibatches
+                    _update_minbatch, train_state, minibatch_indices
                 )
                 actor_train_state, critic_train_state = train_state
-                update_state = (
-                    actor_train_state,
-                    critic_train_state,
-                    traj_batch,
-                    advantages,
-                    targets,
-                    rng,
-                )
+                update_state = (actor_train_state, critic_train_state, batch, rng)
                 return update_state, total_loss
 
-            update_state = (
-                actor_train_state,
-                critic_train_state,
-                traj_batch,
-                advantages,
-                targets,
-                rng,
-            )
-            update_state, loss_info = jax.lax.scan(
-                _update_epoch, update_state, None, config["UPDATE_EPOCHS"]
+            # flatten the rollout once per update; info is not needed for training
+            batch_size = config["MINIBATCH_SIZE"] * config["NUM_MINIBATCHES"]
+            assert (
+                batch_size == config["NUM_STEPS"] * config["NUM_ENVS"]
+            ), "batch size must be equal to number of steps * number of envs"
+            batch = (traj_batch._replace(info=None), advantages, targets)
+            batch = jax.tree_util.tree_map(
+                lambda x: x.reshape((batch_size,) + x.shape[2:]), batch
             )
+            update_state = (actor_train_state, critic_train_state, batch, rng)
+            with jax.named_scope("update_epochs"):
+                update_state, loss_info = jax.lax.scan(
+                    _update_epoch, update_state, None, config["UPDATE_EPOCHS"]
+                )
             actor_train_state = update_state[0]
             critic_train_state = update_state[1]
             metric = traj_batch.info
             rng = update_state[-1]
 
-            if config.get("DEBUG"):
-                
-                def callback(info):
-                    global cumulative_data, last_save_timestep
-                    return_values = info["returned_episode_returns"][
-                        info["returned_episode"]
-                    ]
-                    true_indices = np.argwhere(info["returned_episode"])
-                    mapped_timesteps = info["timestep"][true_indices[:, 0], true_indices[:, 1]]
-                    timesteps = list(zip(mapped_timesteps, true_indices[:, 1]))
-                    
-                    # for t in range(len(timesteps)):
-                    #     logging.info(f"global step={timesteps[t]}, episodic return={return_values}")
-                        
-                jax.debug.callback(callback, traj_batch.info)
-                # jax.debug.callback(callback, metric)
-                
-            runner_state = (
+            episodes = runner_state.episodes
+            if config.get("EPISODE_BUFFER_SIZE"):
+                # keep only finished episodes instead of the dense info tensors
+                episodes = record_episodes(episodes, metric, config["NUM_ENVS"])
+                metric = None
+
+            runner_state = RunnerState(
                 actor_train_state,
                 critic_train_state,
                 env_state,
                 last_obs,
                 rng,
+                episodes,
             )
-            return runner_state, traj_batch.info
+            return runner_state, metric
 
         rng, _rng = jax.random.split(rng)
-        runner_state = (actor_train_state, critic_train_state, env_state, obsv, _rng)
+        episodes = None
+        if config.get("EPISODE_BUFFER_SIZE"):
+            episodes = init_episode_buffer(config["EPISODE_BUFFER_SIZE"])
+        runner_state = RunnerState(
+            actor_train_state, critic_train_state, env_state, obsv, _rng, episodes
+        )
         runner_state, metric = jax.lax.scan(
             _update_step, runner_state, None, config["NUM_UPDATES"]
         )
-        return {"runner_state": runner_state, "metrics": metric}
+        out = {"runner_state": runner_state, "metrics": metric}
+        if config.get("EPISODE_BUFFER_SIZE"):
+            out["episodes"] = runner_state.episodes
+        return out
+
+    return train
+
 
+def batched_train_fn(config):
+    """train vmapped over seeds, split across ``config["NUM_DEVICES"]`` devices."""
+    train = jax.vmap(make_train(config), in_axes=(0, None))
+    if config.get("NUM_DEVICES", 1) > 1:
+        train = shard_leading_axis(train, batch_mesh(config["NUM_DEVICES"]), (True, False))
     return train
 
+
+def build_config(hypers):
+    config = {
+        "ACTOR_LR": hypers["actor_lr"],
+        "CRITIC_LR": hypers["critic_lr"],
+        "NUM_ENVS": 128,
+        "NUM_STEPS": 100,
+        "TOTAL_TIMESTEPS": 3e6,
+        "UPDATE_EPOCHS": 4,
+        "NUM_MINIBATCHES": 320,
+        "GAMMA": 0.99,
+        "GAE_LAMBDA": hypers["gae_lambda"],
+        "CLIP_EPS": 0.2,
+        "ENT_COEF": hypers["ent_coef"],
+        "MAX_GRAD_NORM": 0.5,
+        "ACTIVATION": "tanh",
+        "ENV_NAME": hypers["env_name"],
+        # optional sweep JSON entries; both count physics steps
+        "ACTION_REPEAT": int(hypers.get("action_repeat", 1)),
+        "EPISODE_LENGTH": int(hypers.get("episode_length", 1000)),
+        "ANNEAL_LR": False,
+        "DEBUG": True,
+        "EMA_RATE": 0.02,
+        "ADVN_NORM": "OFF",
+        "SYMLOG_CRITIC_TARGETS": False,
+        "NORMALIZE_OBS": False,
+        "SYMLOG_OBS": False,
+        "EPISODE_BUFFER_SIZE": 0,
+        "ADVN_STATS": "SORT",
+        "NUM_DEVICES": 1,
+        "GAE_METHOD": "SCAN",
+        "CRITIC_FREE": True,
+        # Brax pipeline, or a dict env -> pipeline; see wrappers.resolve_backend
+        "BACKEND": None,
+        # > 0 restarts episodes from a pool of this many reset states per env
+        "RESET_POOL": 0,
+    }
+
+    config.update(variant_config(hypers["alg_type"]))
+
+    return config
+
+
+def apply_run_args(config, args):
+    config["EPISODE_BUFFER_SIZE"] = args.episode_buffer
+    config["ADVN_STATS"] = args.advn_stats
+    config["NUM_DEVICES"] = args.num_devices
+    config["GAE_METHOD"] = args.gae_method
+    config["BACKEND"] = load_backend(args.backend)
+    config["RESET_POOL"] = args.reset_pool
+    config["CRITIC_FREE"] = not args.with_critic
+    return config
+
+
+def aot_compile_experiment(args, rngs):
+    """Compile and serialize one executable per graph shape in the sweep JSON."""
+    with open(EXP_PATH, "r") as f:
+        exp = ExperimentDescription(json.load(f))
+    for idx in graph_representatives(exp):
+        hypers = exp.getPermutation(idx)["metaParameters"]
+        config = apply_run_args(build_config(hypers), args)
+        fn = batched_train_fn(config)
+        compile_aot(fn, (rngs, config_hypers(hypers)), args.compile_cache, "grpo", config)
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
@@ -519,10 +605,51 @@ if __name__ == "__main__":
     parser.add_argument("--gae_lambda", action="store", default=0.9, type=float)
     parser.add_argument("--env_name", action="store", default="swimmer", type=str)
     parser.add_argument("--alg_type", action="store", default="lambda_ac", type=str)
+    # physics steps per agent step, and per episode (used without --sweep_idx)
+    parser.add_argument("--action_repeat", action="store", default=1, type=int)
+    parser.add_argument("--episode_length", action="store", default=1000, type=int)
     parser.add_argument("--output", action="store", default="returns", type=str)
+    # > 0 saves a compact table of finished episodes instead of dense per-step metrics
+    parser.add_argument("--episode_buffer", action="store", default=0, type=int)
+    # SORT: exact percentiles for the EMA advantage norms; STREAMING: sort-free estimate
+    parser.add_argument("--advn_stats", action="store", default="SORT", choices=["SORT", "STREAMING"])
+    # SCAN: sequential reverse scan; ASSOCIATIVE: parallel-in-time associative scan
+    parser.add_argument("--gae_method", action="store", default="SCAN", choices=["SCAN", "ASSOCIATIVE"])
+    # keep the (zeroed-out) critic network instead of the critic-free path
+    parser.add_argument("--with_critic", action="store_true")
+    # on-disk compilation cache; also holds the --aot_compile executables
+    parser.add_argument("--compile_cache", action="store", default=None, type=str)
+    # compile every graph shape of the sweep JSON into --compile_cache and exit
+    parser.add_argument("--aot_compile", "--aot-compile", action="store_true")
+    # > 1 splits the host CPU into this many XLA devices and shards the seeds across them
+    parser.add_argument("--num_devices", action="store", default=1, type=int)
+    # Brax pipeline (positional, generalized, spring, mjx), or a JSON table of
+    # env -> pipeline as written by bench_envs.py; defaults to wrappers.default_backend
+    parser.add_argument("--backend", action="store", default=None, type=str)
+    # > 0 auto-resets each env to one of a per-seed pool of this many reset
+    # states (wrappers.ResetPoolWrapper) instead of always its first one
+    parser.add_argument("--reset_pool", action="store", default=0, type=int)
+    # trace --profile_updates updates with the JAX profiler into this directory,
+    # write profile_summary.json and exit without training
+    parser.add_argument("--profile", action="store", default=None, type=str)
+    parser.add_argument("--profile_updates", action="store", default=20, type=int)
 
     args = parser.parse_args()
 
+    if args.num_devices > 1:
+        check_divisible(args.num_seeds, batch_mesh(args.num_devices), "num_seeds")
+
+    rng = jax.random.PRNGKey(args.start_seed)
+    rngs = jax.random.split(rng, args.num_seeds)
+
+    if args.compile_cache:
+        enable_compilation_cache(args.compile_cache)
+
+    if args.aot_compile:
+        assert args.compile_cache, "--aot_compile requires --compile_cache"
+        aot_compile_experiment(args, rngs)
+        raise SystemExit(0)
+
     if args.sweep_idx == -1:
         hypers = dict(
             alg_type=args.alg_type,
@@ -531,61 +658,49 @@ if __name__ == "__main__":
             ent_coef=args.ent_coef,
             actor_lr=args.actor_lr,
             critic_lr=args.critic_lr,
+            action_repeat=args.action_repeat,
+            episode_length=args.episode_length,
         )
     else:
-        exp_path = "../experiments/ppo_variants_brax.json"
-        with open(exp_path, "r") as f:
+        with open(EXP_PATH, "r") as f:
             d = json.load(f)
         exp = ExperimentDescription(d)
         hypers = exp.getPermutation(args.sweep_idx)["metaParameters"]
 
-    config = {
-        "ACTOR_LR": hypers["actor_lr"],
-        "CRITIC_LR": hypers["critic_lr"],
-        "NUM_ENVS": 128,
-        "NUM_STEPS": 100,
-        "TOTAL_TIMESTEPS": 3e6,
-        "UPDATE_EPOCHS": 4,
-        "NUM_MINIBATCHES": 320,
-        "GAMMA": 0.99,
-        "GAE_LAMBDA": hypers["gae_lambda"],
-        "CLIP_EPS": 0.2,
-        "ENT_COEF": hypers["ent_coef"],
-        "MAX_GRAD_NORM": 0.5,
-        "ACTIVATION": "tanh",
-        "ENV_NAME": hypers["env_name"],
-        "ANNEAL_LR": False,
-        "DEBUG": True,
-        "EMA_RATE": 0.02,
-        "ADVN_NORM": "OFF",
-        "SYMLOG_CRITIC_TARGETS": False,
-        "NORMALIZE_OBS": False,
-        "SYMLOG_OBS": False,
-    }
-
-    if hypers["alg_type"] == "advn_norm_ema":
-        config["ADVN_NORM"] = "EMA_PERC"
-    elif hypers["alg_type"] == "advn_norm_max_ema":
-        config["ADVN_NORM"] = "MAX_EMA_PERC"
-    elif hypers["alg_type"] == "advn_norm_mean":
-        config["ADVN_NORM"] = "MEAN"
-    elif hypers["alg_type"] == "symlog_critic_targets":
-        config["SYMLOG_CRITIC_TARGETS"] = True
-    elif hypers["alg_type"]:
-        config["SYMLOG_OBS"] = True
-    elif hypers["alg_type"] == "norm_obs":
-        config["NORMALIZE_OBS"] = True
+    config = apply_run_args(build_config(hypers), args)
 
-    rng = jax.random.PRNGKey(args.start_seed)
-    rngs = jax.random.split(rng, args.num_seeds)
+    if args.profile:
+        profile_train(
+            batched_train_fn,
+            config,
+            (rngs, config_hypers(hypers)),
+            args.profile,
+            args.profile_updates,
+        )
+        raise SystemExit(0)
 
-    train = make_train(config)
-    train_jit = jax.jit(jax.vmap(train))
-    out = train_jit(rngs)
+    train = batched_train_fn(config)
+    if args.compile_cache:
+        train_jit = load_or_compile(
+            train, (rngs, config_hypers(hypers)), args.compile_cache, "grpo", config
+        )
+    else:
+        train_jit = jax.jit(train)
+    out = train_jit(rngs, config_hypers(hypers))
 
     filename = f"actorlr_{args.actor_lr}_criticlr_{args.critic_lr}_entcoef_{args.ent_coef}_gaelambda_{args.gae_lambda}_env_{args.env_name}_alg_{args.alg_type}.npy"
 
-    if args.sweep_idx == -1:
+    if "episodes" in out:
+        if args.sweep_idx == -1:
+            save_path = f"/path/reward/{filename[:-len('.npy')]}.npz"
+        else:
+            file_context = exp.buildSaveContext(args.sweep_idx)
+            file_context.ensureExists()
+            save_path = file_context.resolve("episodes.npz")
+        print("saving file to: " + save_path)
+        save_episode_table(save_path, out["episodes"])
+
+    elif args.sweep_idx == -1:
         returns = out["metrics"]["returned_episode_returns"]
         save_path = f"/path/reward/{filename}"
         jnp.save(save_path, returns)
@@ -0,0 +1,140 @@
+import numpy as np
+import jax
+import jax.numpy as jnp
+
+# value of ``diverged.npy`` for lanes that stayed finite for the whole run
+HEALTHY = -1
+
+
+def init_health():
+    """Per-lane health carried in RunnerState.health."""
+    return {
+        "diverged_update": jnp.int32(HEALTHY),
+        "num_updates": jnp.int32(0),
+    }
+
+
+def all_finite(*trees):
+    """True if every floating point leaf of ``trees`` is finite."""
+    finite = jnp.bool_(True)
+    for leaf in jax.tree_util.tree_leaves(trees):
+        if jnp.issubdtype(leaf.dtype, jnp.floating):
+            finite &= jnp.all(jnp.isfinite(leaf))
+    return finite
+
+
+def update_health(health, finite):
+    """Record the first update after which a lane stopped being finite."""
+    diverged = (health["diverged_update"] == HEALTHY) & ~finite
+    return {
+        "diverged_update": jnp.where(
+            diverged, health["num_updates"], health["diverged_update"]
+        ),
+        "num_updates": health["num_updates"] + 1,
+    }
+
+
+def is_healthy(health):
+    return health["diverged_update"] == HEALTHY
+
+
+def lane_bucket(num_lanes, max_lanes, multiple=1):
+    """Batch size the surviving lanes are repacked into.
+
+    Rounding up to a power of two bounds the number of distinct shapes (and so
+    compiles) to log2 of the initial batch; ``multiple`` keeps the batch
+    divisible by the device count.
+    """
+    size = 1 << max(num_lanes - 1, 0).bit_length()
+    size = -(-max(size, multiple) // multiple) * multiple
+    return min(size, max_lanes)
+
+
+def _fill_value(dtype):
+    if np.issubdtype(dtype, np.floating):
+        return np.nan
+    if dtype == np.bool_:
+        return False
+    return HEALTHY
+
+
+def train_dropping_diverged(
+    init_fn, update_fn, num_updates, chunk_updates, batch_ndim=1, multiple=1
+):
+    """Run ``num_updates`` updates in chunks, dropping lanes that diverged.
+
+    ``init_fn()`` returns the batched runner state with ``batch_ndim`` leading
+    batch axes (seeds, or configs x seeds). These are flattened into one lane
+    axis, and ``update_fn(runner_state, n)`` must map over that single axis.
+    After each chunk the lanes whose health check failed are removed and the
+    survivors repacked into a smaller batch (see lane_bucket); the freed
+    slots are padded with copies of a surviving lane.
+
+    Returns ``(runner_state, metrics, diverged_update)`` with the original
+    batch axes. A dropped lane keeps its runner state from the chunk in which
+    it diverged, and its metrics are NaN (-1 for the integer and False for the
+    boolean fields) from then on, so analysis code sees it as a failed run.
+    """
+    runner_state = init_fn()
+    batch_shape = jax.tree_util.tree_leaves(runner_state.health)[0].shape[:batch_ndim]
+    num_lanes = int(np.prod(batch_shape))
+    flatten = lambda x: x.reshape((num_lanes,) + x.shape[batch_ndim:])
+    runner_state = jax.tree_util.tree_map(flatten, runner_state)
+
+    # every lane's runner state from the chunk in which it stopped
+    final_state = None
+    # original lane held by each slot of the current batch; only the first
+    # num_live slots are real, the rest are padding
+    lanes = np.arange(num_lanes)
+    num_live = num_lanes
+    chunks = []
+    start = 0
+    while start < num_updates and num_live:
+        n = min(chunk_updates, num_updates - start)
+        runner_state, metrics = update_fn(runner_state, n)
+        metrics = jax.device_get(metrics)
+        chunks.append((start, n, lanes[:num_live], metrics))
+        start += n
+
+        alive = np.asarray(is_healthy(runner_state.health))[:num_live]
+        if alive.all() and start < num_updates:
+            continue
+        # keep the final runner state of every lane that stops here
+        stopped = np.nonzero(~alive)[0] if start < num_updates else np.arange(num_live)
+        host_state = jax.device_get(runner_state)
+        if final_state is None:
+            # weakly typed init leaves may be promoted by the first update
+            final_state = jax.tree_util.tree_map(
+                lambda x: np.zeros((num_lanes,) + x.shape[1:], x.dtype), host_state
+            )
+        for final, current in zip(
+            jax.tree_util.tree_leaves(final_state), jax.tree_util.tree_leaves(host_state)
+        ):
+            final[lanes[stopped]] = current[stopped]
+        if start >= num_updates:
+            break
+
+        keep = np.nonzero(alive)[0]
+        num_live = len(keep)
+        print(f"update {start}: dropped {len(stopped)} diverged lanes, {num_live} left")
+        if not num_live:
+            break
+        slots = np.resize(keep, lane_bucket(num_live, num_lanes, multiple))
+        runner_state = jax.tree_util.tree_map(lambda x: x[slots], runner_state)
+        lanes = lanes[slots]
+
+    metrics = None
+    if chunks[0][3] is not None:
+        metrics = {}
+        for key, value in chunks[0][3].items():
+            shape = (num_lanes, num_updates) + value.shape[2:]
+            metrics[key] = np.full(shape, _fill_value(value.dtype), value.dtype)
+        for chunk_start, n, chunk_lanes, chunk_metrics in chunks:
+            for key, value in chunk_metrics.items():
+                metrics[key][chunk_lanes, chunk_start : chunk_start + n] = value[
+                    : len(chunk_lanes)
+                ]
+
+    unflatten = lambda x: x.reshape(batch_shape + x.shape[1:])
+    runner_state, metrics = jax.tree_util.tree_map(unflatten, (final_state, metrics))
+    return runner_state, metrics, runner_state.health["diverged_update"]
@@ -0,0 +1,287 @@
+"""Successive halving over one graph slice of the sweep.
+
+All permutations sharing --sweep_idx's (alg_type, env_name) start together.
+Each rung trains every surviving config up to that rung's number of updates,
+ranks the configs by their normalized AUC so far and keeps the top 1/eta.
+Rung budgets grow by eta from --min_updates up to the full NUM_UPDATES.
+
+Each config's metrics, and its runner state after each rung, are checkpointed
+in its own directory. The schedule (rungs, survivors, scores, the updates each
+config has finished and the env steps used) is kept in ``schedule.json``,
+which is written after each batch of configs and is what a restarted run
+continues from. After every
+rung, each config that ran writes the usual returns/timestep/lengths/completed
+files with the updates trained so far to ``configs/<idx>/rung_<rung>`` of the
+schedule directory, so the sec5 analysis can also run on partial-fidelity
+results. Only configs trained for all NUM_UPDATES write to their save context
+of the sweep, which sweep.is_complete (and so worker.py and launcher.py) then
+counts as finished.
+
+The updates run in jitted calls of --chunk_updates (default --min_updates), so
+every rung reuses the same executable; only a shorter last call of a rung
+compiles a second one.
+
+Hyperband is successive halving repeated with a few values of --min_updates
+(one --schedule_dir each).
+
+python hyperband.py --sweep_idx 0 --min_updates 50 --eta 3 --num_seeds 5
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import shutil
+import numpy as np
+import jax
+from PyExpUtils.models.ExperimentDescription import ExperimentDescription
+from PyExpUtils.FileSystemContext import FileSystemContext
+
+from ppo_continuous_action import EXP_PATH, build_config, make_train_fns, save_outputs
+from sweep import config_hypers, stack_hypers, slice_indices, batched
+from checkpoint import (
+    _atomic_write,
+    save_checkpoint,
+    load_checkpoint,
+    save_metrics_chunk,
+    load_metrics,
+)
+
+SCHEDULE_FILE = "schedule.json"
+
+
+def rung_budgets(min_updates, eta, num_updates):
+    """Cumulative updates trained by the end of each rung."""
+    budgets = []
+    updates = min_updates
+    while updates < num_updates:
+        budgets.append(updates)
+        updates *= eta
+    budgets.append(num_updates)
+    return budgets
+
+
+def read_quantiles(folder, env_name):
+    """p5/p95 of ``global_quantiles_{env}.csv`` (see sec5), or None."""
+    path = os.path.join(folder or "", f"global_quantiles_{env_name}.csv")
+    if not folder or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        row = next(csv.DictReader(f))
+    return float(row["p5"]), float(row["p95"])
+
+
+def normalized_auc(metrics, p5, p95):
+    """Sum of (r - p5) / (p95 - p5) over finished episodes, averaged over seeds."""
+    returns = np.asarray(metrics["returned_episode_returns"], dtype=np.float64)
+    done = np.asarray(metrics["returned_episode"])
+    norm = np.where(done, (returns - p5) / (p95 - p5), 0.0)
+    per_seed = norm.reshape(norm.shape[0], -1).sum(axis=1)
+    return float(per_seed.mean())
+
+
+def load_schedule(schedule_dir, indices):
+    path = os.path.join(schedule_dir, SCHEDULE_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {
+        "rung": 0,
+        "survivors": list(indices),
+        "rungs": [],
+        # str(idx) -> updates trained, counted in env_steps
+        "updates": {},
+        "env_steps": 0,
+    }
+
+
+def save_schedule(schedule_dir, schedule):
+    os.makedirs(schedule_dir, exist_ok=True)
+    _atomic_write(
+        os.path.join(schedule_dir, SCHEDULE_FILE),
+        json.dumps(schedule, indent=2).encode(),
+    )
+
+
+def config_dir(schedule_dir, idx):
+    return os.path.join(schedule_dir, "configs", str(idx))
+
+
+def state_dir(schedule_dir, idx, updates):
+    """Checkpoint of a config's runner state after ``updates`` updates.
+
+    Each rung writes a new one, so the state a rung starts from stays intact
+    until the schedule records the rung's updates.
+    """
+    return os.path.join(config_dir(schedule_dir, idx), f"updates_{updates}")
+
+
+def rung_context(schedule_dir, idx, rung):
+    """Where a config's outputs after a partial-fidelity rung are saved."""
+    return FileSystemContext(f"rung_{rung}", config_dir(schedule_dir, idx))
+
+
+def advance(update_jit, runner_state, num_updates, chunk_updates):
+    """Run ``num_updates`` updates in calls of at most ``chunk_updates``.
+
+    Returns the runner state and the host metrics, concatenated along the
+    update axis of the [configs, seeds, updates] batch.
+    """
+    chunks = []
+    while num_updates > 0:
+        n = min(chunk_updates, num_updates)
+        runner_state, metrics = update_jit(runner_state, n)
+        chunks.append(jax.device_get(metrics))
+        num_updates -= n
+    metrics = jax.tree_util.tree_map(lambda *xs: np.concatenate(xs, axis=2), *chunks)
+    return runner_state, metrics
+
+
+def run_successive_halving(exp, indices, config, rngs, args):
+    schedule_dir = args.schedule_dir
+    init, update = make_train_fns(config)
+    budgets = rung_budgets(args.min_updates, args.eta, config["NUM_UPDATES"])
+    schedule = load_schedule(schedule_dir, indices)
+    steps_per_update = (
+        config["NUM_STEPS"] * config["NUM_ENVS"] * config["ACTION_REPEAT"] * len(rngs)
+    )
+
+    quantiles = read_quantiles(args.quantiles, config["ENV_NAME"])
+    if quantiles is None:
+        print("no global quantiles found, ranking by the raw return AUC")
+        quantiles = (0.0, 1.0)
+
+    single_init = jax.vmap(init, in_axes=(0, None))
+    init_jit = jax.jit(jax.vmap(single_init, in_axes=(None, 0)))
+    update_jit = jax.jit(
+        jax.vmap(jax.vmap(update, in_axes=(0, None)), in_axes=(0, None)),
+        static_argnums=1,
+    )
+
+    def traced(idx):
+        return config_hypers(exp.getPermutation(idx)["metaParameters"])
+
+    template = jax.eval_shape(single_init, rngs, traced(indices[0]))
+
+    while schedule["rung"] < len(budgets):
+        rung = schedule["rung"]
+        start = budgets[rung - 1] if rung else 0
+        budget = budgets[rung]
+        survivors = schedule["survivors"]
+
+        # configs already trained to this rung's budget before a restart
+        done_updates = schedule["updates"]
+        pending = [idx for idx in survivors if done_updates.get(str(idx), 0) < budget]
+        print(
+            f"rung {rung}: {len(survivors)} configs, updates {start}->{budget}, "
+            f"{len(pending)} pending"
+        )
+
+        for batch, num_valid in batched(pending, args.config_batch):
+            if start == 0:
+                runner_state = init_jit(rngs, stack_hypers([traced(i) for i in batch]))
+            else:
+                states = [
+                    load_checkpoint(state_dir(schedule_dir, i, start), template)[0]
+                    for i in batch
+                ]
+                runner_state = jax.tree_util.tree_map(
+                    lambda *xs: np.stack(xs), *states
+                )
+            runner_state, metrics = advance(
+                update_jit, runner_state, budget - start, args.chunk_updates
+            )
+            runner_state = jax.device_get(runner_state)
+
+            for j, idx in enumerate(batch[:num_valid]):
+                state_j, metrics_j = jax.tree_util.tree_map(
+                    lambda x: x[j], (runner_state, metrics)
+                )
+                path = config_dir(schedule_dir, idx)
+                save_metrics_chunk(path, start, metrics_j)
+                save_checkpoint(state_dir(schedule_dir, idx, budget), state_j, budget)
+                out = {"metrics": load_metrics(path, budget)}
+                if budget == config["NUM_UPDATES"]:
+                    save_outputs(exp.buildSaveContext(idx), out)
+                else:
+                    save_outputs(rung_context(schedule_dir, idx, rung), out)
+
+            # one write records the batch's updates and the env steps they took;
+            # a crash before it retrains the batch from its start states
+            for idx in batch[:num_valid]:
+                done_updates[str(idx)] = budget
+            schedule["env_steps"] += num_valid * (budget - start) * steps_per_update
+            save_schedule(schedule_dir, schedule)
+            for idx in batch[:num_valid]:
+                shutil.rmtree(state_dir(schedule_dir, idx, start), ignore_errors=True)
+
+        scores = {
+            idx: normalized_auc(
+                load_metrics(config_dir(schedule_dir, idx), budget), *quantiles
+            )
+            for idx in survivors
+        }
+        ranked = sorted(survivors, key=lambda idx: scores[idx], reverse=True)
+        keep = ranked[: max(1, math.ceil(len(ranked) / args.eta))]
+        if rung == len(budgets) - 1:
+            keep = ranked[:1]
+        schedule["rungs"].append(
+            {
+                "rung": rung,
+                "updates": budget,
+                "scores": {str(idx): scores[idx] for idx in ranked},
+                "survivors": keep,
+            }
+        )
+        # the runner states of eliminated configs are no longer needed
+        for idx in set(survivors) - set(keep):
+            shutil.rmtree(state_dir(schedule_dir, idx, budget), ignore_errors=True)
+        schedule["rung"] = rung + 1
+        schedule["survivors"] = keep
+        save_schedule(schedule_dir, schedule)
+
+    full_grid = len(indices) * config["NUM_UPDATES"] * steps_per_update
+    schedule["full_grid_env_steps"] = full_grid
+    save_schedule(schedule_dir, schedule)
+    print(
+        f"best config {schedule['survivors'][0]}, env steps used "
+        f"{schedule['env_steps']} ({schedule['env_steps'] / full_grid:.1%} of the full grid)"
+    )
+    return schedule
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sweep_idx", action="store", default=0, type=int)
+    parser.add_argument("--num_seeds", action="store", default=1, type=int)
+    parser.add_argument("--start_seed", action="store", default=42, type=int)
+    parser.add_argument("--config_batch", action="store", default=25, type=int)
+    parser.add_argument("--min_updates", action="store", default=50, type=int)
+    parser.add_argument("--eta", action="store", default=3, type=int)
+    # updates per jitted call; defaults to --min_updates
+    parser.add_argument("--chunk_updates", action="store", default=0, type=int)
+    # folder holding global_quantiles_{env}.csv for the AUC normalization
+    parser.add_argument("--quantiles", action="store", default=None, type=str)
+    parser.add_argument("--schedule_dir", action="store", default=None, type=str)
+    # drop any existing schedule state and start over
+    parser.add_argument("--restart", action="store_true")
+    args = parser.parse_args()
+    args.chunk_updates = args.chunk_updates or args.min_updates
+
+    with open(EXP_PATH, "r") as f:
+        exp = ExperimentDescription(json.load(f))
+    hypers = exp.getPermutation(args.sweep_idx)["metaParameters"]
+    config = build_config(hypers)
+    # ranking needs the dense per-update metrics, not the episode log
+    config["DEBUG"] = False
+    config["EPISODE_BUFFER_SIZE"] = 0
+
+    indices = slice_indices(exp, args.sweep_idx)
+    if args.schedule_dir is None:
+        args.schedule_dir = exp.buildSaveContext(indices[0]).resolve("hyperband")
+    if args.restart and os.path.exists(args.schedule_dir):
+        shutil.rmtree(args.schedule_dir)
+
+    rngs = jax.random.split(jax.random.PRNGKey(args.start_seed), args.num_seeds)
+    run_successive_halving(exp, indices, config, rngs, args)
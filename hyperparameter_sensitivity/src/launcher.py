@@ -0,0 +1,348 @@
+"""Local sweep launcher: runs the unfinished permutations of the sweep JSON.
+
+The permutations of ``ppo_variants_brax.json`` without returns.npy and
+completed.npy in their save context (sweep.is_complete) are grouped by graph
+shape and split into queue files of --task_size indices. These go to
+--queue_dir, from which a pool of worker.py processes claims them (see
+worker.py). Each worker compiles once per graph shape.
+
+The pool size is limited by --max_workers (default: the CPU count) and by a
+memory budget (--memory_gb, default 80% of the host memory). Each worker's
+memory is estimated from the build_config of the pending permutations:
+NUM_ENVS x NUM_STEPS x seeds for the rollout of one update, plus the dense
+per-step metrics of the whole run and a fixed per-process overhead;
+--worker_memory_gb replaces the estimate. The CPUs are split between the
+worker slots and each worker is pinned to its share (where the OS supports
+CPU affinity), which also sizes XLA's thread pool, so the workers do not
+oversubscribe the host. When a worker fails, the queue file it was working on
+is put back, up to --max_retries times, and then renamed to ``*.failed``; a
+new worker takes the free slot. After --max_failed_starts workers in a row
+exit with an error before claiming anything (e.g. a bad flag), the launcher
+stops. Every
+--report_every seconds the launcher prints the completed configs, configs per
+hour and the ETA. Worker output goes to --queue_dir/logs. Since completion is
+read from the dense returns, runs with --episode_buffer or --summary_only are
+never counted as complete.
+
+Flags the launcher does not know are passed to every worker, e.g.
+
+python launcher.py --num_seeds 5 --compile_cache ../compile_cache --gae_method ASSOCIATIVE
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from PyExpUtils.models.ExperimentDescription import ExperimentDescription
+
+from ppo_continuous_action import EXP_PATH, build_config
+from sweep import GRAPH_KEYS, SWITCH_GRAPH_KEYS, is_complete
+
+WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+
+QUEUE_SUFFIX = ".queue"
+FAILED_SUFFIX = ".failed"
+LOG_DIR = "logs"
+
+# device bytes per env step of one update's rollout: the transition (obs,
+# action, value, reward, log_prob, done, info) and the GAE and minibatch buffers
+ROLLOUT_BYTES_PER_STEP = 1024
+# the four dense per-step metrics, on device and again on the host
+METRIC_BYTES_PER_STEP = 2 * 4 * 4
+# Python, JAX and Brax and the compiled executables of one worker
+WORKER_OVERHEAD_BYTES = 2 * 2**30
+
+
+def estimate_worker_memory(config, lanes):
+    """Rough peak memory in bytes of a worker training ``lanes`` runs of ``config`` at once."""
+    rollout = config["NUM_ENVS"] * config["NUM_STEPS"] * lanes * ROLLOUT_BYTES_PER_STEP
+    # the dense metrics have one entry per agent step
+    agent_steps = config["TOTAL_TIMESTEPS"] // config["ACTION_REPEAT"]
+    metrics = agent_steps * lanes * METRIC_BYTES_PER_STEP
+    return int(WORKER_OVERHEAD_BYTES + rollout + metrics)
+
+
+def host_memory_bytes():
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def cpu_slots(num_workers):
+    """Disjoint CPU sets for ``num_workers`` workers; None entries without CPU affinity.
+
+    With more workers than CPUs, the sets wrap around and are shared.
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return [None] * num_workers
+    cpus = sorted(os.sched_getaffinity(0))
+    per_worker = max(1, len(cpus) // num_workers)
+    return [
+        set(cpus[(slot * per_worker) % len(cpus) :][:per_worker])
+        for slot in range(num_workers)
+    ]
+
+
+def pending_indices(exp):
+    """Indices of the sweep permutations that are not complete yet."""
+    return [
+        idx
+        for idx in range(exp.numPermutations())
+        if not is_complete(exp.buildSaveContext(idx))
+    ]
+
+
+def claim_alive(name):
+    """Whether the worker that claimed queue file ``name`` may still be running.
+
+    Claims from other hosts are assumed to be alive.
+    """
+    host, _, pid = name.split(QUEUE_SUFFIX + ".", 1)[1].rpartition("-")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def write_queue(queue_dir, exp, indices, keys, task_size):
+    """Write ``indices`` as queue files of at most ``task_size`` indices of one graph shape.
+
+    Queue files left over from an earlier launch are removed first, including
+    the claims of workers that are gone. Claims of running workers stop the
+    launch, as their indices are pending too and would be trained twice.
+    """
+    os.makedirs(os.path.join(queue_dir, LOG_DIR), exist_ok=True)
+    claimed = [
+        name
+        for name in os.listdir(queue_dir)
+        if QUEUE_SUFFIX + "." in name and claim_alive(name)
+    ]
+    if claimed:
+        raise SystemExit(
+            f"workers are still running on {', '.join(sorted(claimed))} in {queue_dir}; "
+            "wait for them or stop them first"
+        )
+    for name in os.listdir(queue_dir):
+        if QUEUE_SUFFIX in name or name.endswith((".done", FAILED_SUFFIX)):
+            os.remove(os.path.join(queue_dir, name))
+    groups = {}
+    for idx in indices:
+        hypers = exp.getPermutation(idx)["metaParameters"]
+        groups.setdefault(tuple(hypers.get(k) for k in keys), []).append(idx)
+    names = []
+    for group_id, group in enumerate(groups.values()):
+        for start in range(0, len(group), task_size):
+            name = f"{group_id:04d}-{start // task_size:05d}{QUEUE_SUFFIX}"
+            with open(os.path.join(queue_dir, name), "w") as f:
+                f.write(" ".join(str(idx) for idx in group[start : start + task_size]))
+            names.append(name)
+    return names
+
+
+def queued(queue_dir):
+    return [name for name in os.listdir(queue_dir) if name.endswith(QUEUE_SUFFIX)]
+
+
+def release_claims(queue_dir, pid, retries, max_retries):
+    """Requeue the files claimed by dead worker ``pid``, or fail them after ``max_retries``.
+
+    Returns the number of files the worker had claimed.
+    """
+    suffix = f"{QUEUE_SUFFIX}.{socket.gethostname()}-{pid}"
+    released = 0
+    for name in os.listdir(queue_dir):
+        if not name.endswith(suffix):
+            continue
+        base = name[: -len(suffix)]
+        retries[base] = retries.get(base, 0) + 1
+        if retries[base] > max_retries:
+            target, status = base + FAILED_SUFFIX, "failed"
+        else:
+            target, status = base + QUEUE_SUFFIX, f"retry {retries[base]}"
+        os.replace(os.path.join(queue_dir, name), os.path.join(queue_dir, target))
+        print(f"worker {pid} died on {base}: {status}")
+        released += 1
+    return released
+
+
+def format_duration(seconds):
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}"
+
+
+class Launcher:
+    """Keeps ``num_workers`` worker.py processes running on a queue directory."""
+
+    def __init__(self, queue_dir, num_workers, worker_args, max_retries, max_failed_starts):
+        self.queue_dir = queue_dir
+        self.num_workers = num_workers
+        self.worker_args = worker_args
+        self.max_retries = max_retries
+        self.max_failed_starts = max_failed_starts
+        self.retries = {}
+        self.slots = cpu_slots(num_workers)
+        # proc -> (slot, log path)
+        self.procs = {}
+        self.started = 0
+        self.failed_starts = 0
+
+    def _start_worker(self, slot):
+        log_path = os.path.join(self.queue_dir, LOG_DIR, f"worker-{self.started:04d}.log")
+        self.started += 1
+        cpus = self.slots[slot]
+        env = dict(os.environ)
+        if cpus is not None:
+            env["OMP_NUM_THREADS"] = str(len(cpus))
+        with open(log_path, "w") as log:
+            proc = subprocess.Popen(
+                [sys.executable, WORKER, "--queue", self.queue_dir, *self.worker_args],
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                env=env,
+            )
+        if cpus is not None:
+            # not a preexec_fn: forking the (multithreaded) JAX process is unsafe;
+            # the worker's threads start long after this, during its imports
+            os.sched_setaffinity(proc.pid, cpus)
+        self.procs[proc] = (slot, log_path)
+
+    def step(self):
+        """Reap finished workers and refill free slots; False once everything is done."""
+        for proc in [p for p in self.procs if p.poll() is not None]:
+            _, log_path = self.procs.pop(proc)
+            if proc.returncode == 0:
+                self.failed_starts = 0
+                continue
+            if release_claims(self.queue_dir, proc.pid, self.retries, self.max_retries):
+                self.failed_starts = 0
+                continue
+            # died before claiming a queue file, e.g. on a bad flag or import
+            self.failed_starts += 1
+            if self.failed_starts >= self.max_failed_starts:
+                raise SystemExit(
+                    f"{self.failed_starts} workers in a row failed before claiming "
+                    f"a queue file; see {log_path}"
+                )
+        pending = len(queued(self.queue_dir))
+        free = sorted(set(range(self.num_workers)) - {slot for slot, _ in self.procs.values()})
+        for slot in free[:pending]:
+            self._start_worker(slot)
+        return bool(self.procs)
+
+    def stop(self):
+        for proc in self.procs:
+            proc.terminate()
+        for proc in self.procs:
+            proc.wait()
+            release_claims(self.queue_dir, proc.pid, self.retries, self.max_retries)
+
+
+class Progress:
+    """Completed configs, configs/hour and ETA of the launched indices."""
+
+    def __init__(self, exp, indices):
+        self.exp = exp
+        self.remaining = list(indices)
+        self.total = len(indices)
+        self.start = time.time()
+
+    def report(self):
+        self.remaining = [
+            idx for idx in self.remaining if not is_complete(self.exp.buildSaveContext(idx))
+        ]
+        done = self.total - len(self.remaining)
+        elapsed = time.time() - self.start
+        rate = done / elapsed * 3600 if elapsed > 0 else 0.0
+        eta = format_duration(len(self.remaining) / rate * 3600) if rate > 0 else "?"
+        print(
+            f"[{format_duration(elapsed)}] {done}/{self.total} configs, "
+            f"{rate:.1f} configs/hour, ETA {eta}",
+            flush=True,
+        )
+        return done
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queue_dir", action="store", default="./sweep_queue", type=str)
+    parser.add_argument("--task_size", action="store", default=25, type=int)
+    parser.add_argument("--max_workers", action="store", default=os.cpu_count(), type=int)
+    # memory the workers may use together; default 80% of the host memory
+    parser.add_argument("--memory_gb", action="store", default=None, type=float)
+    # per-worker memory instead of the estimate
+    parser.add_argument("--worker_memory_gb", action="store", default=None, type=float)
+    parser.add_argument("--max_retries", action="store", default=2, type=int)
+    # workers in a row that may fail before claiming a queue file
+    parser.add_argument("--max_failed_starts", action="store", default=3, type=int)
+    parser.add_argument("--report_every", action="store", default=60.0, type=float)
+    # worker flags that also enter the memory estimate; passed on to the workers
+    parser.add_argument("--num_seeds", action="store", default=1, type=int)
+    parser.add_argument("--seed_batch", action="store", default=0, type=int)
+    parser.add_argument("--sweep_slice", action="store_true")
+    parser.add_argument("--config_batch", action="store", default=25, type=int)
+    parser.add_argument("--alg_switch", action="store_true")
+    args, worker_args = parser.parse_known_args()
+
+    worker_args += ["--num_seeds", str(args.num_seeds), "--seed_batch", str(args.seed_batch)]
+    worker_args += ["--config_batch", str(args.config_batch)]
+    worker_args += [
+        flag
+        for flag, on in (("--sweep_slice", args.sweep_slice), ("--alg_switch", args.alg_switch))
+        if on
+    ]
+
+    with open(EXP_PATH, "r") as f:
+        exp = ExperimentDescription(json.load(f))
+    indices = pending_indices(exp)
+    print(f"{exp.numPermutations() - len(indices)} of {exp.numPermutations()} configs complete")
+    if not indices:
+        raise SystemExit(0)
+
+    keys = SWITCH_GRAPH_KEYS if args.alg_switch else GRAPH_KEYS
+    tasks = write_queue(args.queue_dir, exp, indices, keys, args.task_size)
+
+    lanes = args.seed_batch or args.num_seeds
+    if args.sweep_slice:
+        lanes *= args.config_batch
+    if args.worker_memory_gb:
+        worker_memory = args.worker_memory_gb * 2**30
+    else:
+        worker_memory = max(
+            estimate_worker_memory(build_config(exp.getPermutation(idx)["metaParameters"]), lanes)
+            for idx in indices
+        )
+    budget = args.memory_gb * 2**30 if args.memory_gb else 0.8 * host_memory_bytes()
+    num_workers = int(min(args.max_workers, len(tasks), budget // worker_memory))
+    if num_workers < 1:
+        print("warning: one worker exceeds the memory budget; running a single worker")
+        num_workers = 1
+    print(
+        f"{len(indices)} configs in {len(tasks)} queue files, {num_workers} workers "
+        f"of ~{worker_memory / 2**30:.1f} GB (budget {budget / 2**30:.1f} GB)"
+    )
+
+    launcher = Launcher(
+        args.queue_dir, num_workers, worker_args, args.max_retries, args.max_failed_starts
+    )
+    progress = Progress(exp, indices)
+    last_report = time.time()
+    try:
+        while launcher.step():
+            time.sleep(1.0)
+            if time.time() - last_report >= args.report_every:
+                progress.report()
+                last_report = time.time()
+    finally:
+        launcher.stop()
+    done = progress.report()
+    failed = [name for name in os.listdir(args.queue_dir) if name.endswith(FAILED_SUFFIX)]
+    if failed:
+        print(f"{len(failed)} queue files failed after {args.max_retries} retries: {sorted(failed)}")
+    if failed or done < len(indices):
+        raise SystemExit(1)
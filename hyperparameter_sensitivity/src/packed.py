@@ -0,0 +1,194 @@
+"""Several Brax envs trained side by side in one vmapped batch.
+
+ppo_continuous_action compiles one train per env because observation and
+action sizes differ between the envs. Here the observations of every env are
+zero-padded to the largest observation size and the actions to the largest
+action size (wrappers.PadEnv). With equal shapes the networks and optimizer
+states of all lanes stack into one batch, so a single vmapped PPO update
+(make_agent_fns' act and learn) serves every env while each lane keeps its own
+parameters. Only the env steps run per env: each env's lanes are stepped by
+that env's own vmapped wrapper stack. Padded action dims are masked in the
+actor (Actor's action_mask), so they neither reach the env nor get gradients;
+they only add a constant to the logged entropy.
+
+All permutations of the sweep JSON that differ from --sweep_idx only in
+env_name run as one job, --num_seeds lanes per env, and each writes the usual
+files to its own save context. The cross-env analysis (cross-env tuned
+performance in analysis/) reads them as usual. Because of the padded
+inputs, runs are not bitwise equal to the unpacked runs of the same seeds.
+
+python packed.py --sweep_idx 0 --num_seeds 5
+"""
+import argparse
+import json
+import numpy as np
+import jax
+import jax.numpy as jnp
+from PyExpUtils.models.ExperimentDescription import ExperimentDescription
+
+from ppo_continuous_action import (
+    EXP_PATH,
+    Transition,
+    build_config,
+    make_agent_fns,
+    train_outputs,
+    save_outputs,
+)
+from sweep import config_hypers, stack_hypers, slice_indices
+from wrappers import (
+    BraxGymnaxWrapper,
+    LogWrapper,
+    ClipAction,
+    PadEnv,
+    VecEnv,
+    NormalizeVecObservation,
+    resolve_backend,
+    load_backend,
+)
+
+
+def make_packed_envs(config, env_names):
+    """One padded, vectorized wrapper stack per env, as in make_train_fns."""
+    envs = [
+        BraxGymnaxWrapper(
+            env_name,
+            backend=resolve_backend(env_name, config.get("BACKEND")),
+            reset_pool=config.get("RESET_POOL", 0),
+            episode_length=config.get("EPISODE_LENGTH", 1000),
+            action_repeat=config.get("ACTION_REPEAT", 1),
+        )
+        for env_name in env_names
+    ]
+    observation_size = max(env.observation_space(None).shape[0] for env in envs)
+    action_size = max(env.action_space(None).shape[0] for env in envs)
+    stacks = []
+    for env in envs:
+        env = LogWrapper(env, action_repeat=config.get("ACTION_REPEAT", 1))
+        env = ClipAction(env)
+        env = PadEnv(env, observation_size, action_size)
+        env = VecEnv(env)
+        if config["NORMALIZE_OBS"]:
+            env = NormalizeVecObservation(env)
+        stacks.append(env)
+    return stacks, observation_size, action_size
+
+
+def make_packed_train(config, env_names):
+    """``train(rngs, hypers)`` over every env of ``env_names`` x seeds.
+
+    ``rngs`` has shape [seeds, 2] and ``hypers`` holds arrays of shape
+    [len(env_names)], one hyperparameter point per env. The outputs have the
+    leading axes [envs, seeds], like make_sweep_train's [configs, seeds].
+    """
+    assert not config.get("ALG_SWITCH"), "packed runs take one alg_type"
+    assert not config.get("DEBUG"), "the episode log does not know the lane's env"
+    assert not config.get("SUMMARY_CONSTANTS"), "the summary constants are per env"
+    envs, observation_size, action_size = make_packed_envs(config, env_names)
+    init_agent, act, observe, learn, _ = make_agent_fns(
+        config, (observation_size,), action_size
+    )
+    action_masks = np.stack([env.action_mask for env in envs])
+    vmap_step = lambda env: jax.vmap(env.step, in_axes=(0, 0, 0, None))
+    concat = lambda *xs: jnp.concatenate(xs)
+
+    def init_lane(rng, hypers, action_mask):
+        # the rng order of make_train_fns' init
+        rng, runner_state = init_agent(rng, hypers, action_mask)
+        rng, _rng = jax.random.split(rng)
+        reset_rng = jax.random.split(_rng, config["NUM_ENVS"])
+        rng, _rng = jax.random.split(rng)
+        return runner_state._replace(rng=_rng), reset_rng
+
+    def train(rngs, hypers):
+        num_envs, num_seeds = len(envs), rngs.shape[0]
+        groups = [slice(i * num_seeds, (i + 1) * num_seeds) for i in range(num_envs)]
+        # lanes are [envs, seeds] flattened, env by env
+        lane_rngs = jnp.tile(rngs, (num_envs, 1))
+        lane_hypers = jax.tree_util.tree_map(lambda x: jnp.repeat(x, num_seeds), hypers)
+        lane_masks = jnp.asarray(np.repeat(action_masks, num_seeds, axis=0))
+
+        # INIT
+        lanes, reset_rngs = jax.vmap(init_lane)(lane_rngs, lane_hypers, lane_masks)
+        obsv, env_states = zip(
+            *[
+                jax.vmap(env.reset, in_axes=(0, None))(reset_rngs[group], None)
+                for env, group in zip(envs, groups)
+            ]
+        )
+        lanes = lanes._replace(last_obs=concat(*obsv))
+
+        def _env_step(carry, unused):
+            lanes, env_states = carry
+            lanes, (action, value, log_prob, rng_step) = jax.vmap(act)(lanes)
+            steps = [
+                vmap_step(env)(rng_step[group], env_state, action[group], None)
+                for env, env_state, group in zip(envs, env_states, groups)
+            ]
+            obsv, env_states, reward, done, info = zip(*steps)
+            obsv, reward, done, info = (
+                jax.tree_util.tree_map(concat, *x) for x in (obsv, reward, done, info)
+            )
+            obsv = jax.vmap(observe)(lanes.hypers, obsv)
+            transition = Transition(
+                done, action, value, reward, log_prob, lanes.last_obs, info
+            )
+            return (lanes._replace(last_obs=obsv), env_states), transition
+
+        def _update_step(carry, unused):
+            with jax.named_scope("env_rollout"):
+                (lanes, env_states), traj_batch = jax.lax.scan(
+                    _env_step, carry, None, config["NUM_STEPS"]
+                )
+            # traj_batch is [NUM_STEPS, lanes, ...]; every lane learns on its own
+            lanes, metric = jax.vmap(learn, in_axes=(0, 1))(lanes, traj_batch)
+            return (lanes, env_states), metric
+
+        (lanes, _), metrics = jax.lax.scan(
+            _update_step, (lanes, env_states), None, config["NUM_UPDATES"]
+        )
+        # [updates, lanes, ...] -> [lanes, updates, ...] as in the seed vmap
+        metrics = jax.tree_util.tree_map(lambda x: jnp.swapaxes(x, 0, 1), metrics)
+        out = train_outputs(config, lanes, metrics)
+        return jax.tree_util.tree_map(
+            lambda x: x.reshape((num_envs, num_seeds) + x.shape[1:]), out
+        )
+
+    return train
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sweep_idx", action="store", default=0, type=int)
+    parser.add_argument("--num_seeds", action="store", default=1, type=int)
+    parser.add_argument("--start_seed", action="store", default=42, type=int)
+    # Brax pipeline or JSON table of env -> pipeline, as in ppo_continuous_action
+    parser.add_argument("--backend", action="store", default=None, type=str)
+    parser.add_argument("--reset_pool", action="store", default=0, type=int)
+    parser.add_argument("--episode_buffer", action="store", default=0, type=int)
+    args = parser.parse_args()
+
+    with open(EXP_PATH, "r") as f:
+        exp = ExperimentDescription(json.load(f))
+    ref = exp.getPermutation(args.sweep_idx)["metaParameters"]
+    # every permutation that differs from --sweep_idx only in its env
+    indices = slice_indices(exp, args.sweep_idx, [k for k in ref if k != "env_name"])
+    permutations = [exp.getPermutation(idx)["metaParameters"] for idx in indices]
+    env_names = [hypers["env_name"] for hypers in permutations]
+
+    config = build_config(ref)
+    config.update(
+        DEBUG=False,
+        BACKEND=load_backend(args.backend),
+        RESET_POOL=args.reset_pool,
+        EPISODE_BUFFER_SIZE=args.episode_buffer,
+    )
+    rngs = jax.random.split(jax.random.PRNGKey(args.start_seed), args.num_seeds)
+    hypers = stack_hypers([config_hypers(hypers) for hypers in permutations])
+
+    print(f"packing {', '.join(env_names)} ({len(env_names) * args.num_seeds} lanes)")
+    out = jax.jit(make_packed_train(config, env_names))(rngs, hypers)
+    for i, idx in enumerate(indices):
+        save_outputs(
+            exp.buildSaveContext(idx), jax.tree_util.tree_map(lambda x: x[i], out)
+        )
@@ -0,0 +1,228 @@
+"""Population-based training on the vmapped population of ppo_continuous_action.
+
+Every member of the population is one lane of the usual seed vmap with its own
+traced hyperparameters (RunnerState.hypers). The whole run is one jitted
+``lax.scan`` over chunks of --pbt_interval updates. At the end of each chunk
+but the last, the members are ranked by the mean return of the episodes they
+finished in that chunk. Each of the bottom --pbt_fraction then copies the actor and critic train
+states (parameters, optimizer state and advantage statistics) of a random
+member of the top --pbt_fraction. It also takes that member's hyperparameters,
+each multiplied by a random perturbation factor. The copied learning rates are
+written into the optimizer states, where the update reads them. Environment
+states and rngs stay with their lane.
+
+The initial population is drawn from the value lists of the sweep JSON, for
+--sweep_idx's alg_type and env_name.
+
+python pbt.py --sweep_idx 0 --population 16 --pbt_interval 50
+"""
+import argparse
+import json
+import os
+import numpy as np
+import jax
+import jax.numpy as jnp
+from PyExpUtils.models.ExperimentDescription import ExperimentDescription
+
+from ppo_continuous_action import EXP_PATH, build_config, make_train_fns
+from sweep import HYPER_KEYS, stack_hypers
+
+PERTURB_FACTORS = (0.8, 1.25)
+
+# hyperparameters kept in range after perturbation
+HYPER_BOUNDS = {"GAE_LAMBDA": (0.0, 1.0)}
+
+
+def sample_population(exp, population, seed):
+    """Initial hypers of each member, drawn from the sweep JSON's value lists."""
+    meta = exp.permutable()["metaParameters"]
+    rng = np.random.default_rng(seed)
+    members = [
+        {key: float(rng.choice(meta[name])) for name, key in HYPER_KEYS.items()}
+        for _ in range(population)
+    ]
+    return stack_hypers(members)
+
+
+def set_learning_rate(train_state, learning_rate):
+    """Write ``learning_rate`` into the injected hyperparameters of the optimizer."""
+    is_injected = lambda state: hasattr(state, "hyperparams")
+
+    def _set(state):
+        if not is_injected(state):
+            return state
+        hyperparams = dict(state.hyperparams, learning_rate=learning_rate)
+        return state._replace(hyperparams=hyperparams)
+
+    opt_state = jax.tree_util.tree_map(
+        _set, train_state.opt_state, is_leaf=is_injected
+    )
+    return train_state.replace(opt_state=opt_state)
+
+
+def chunk_scores(metrics):
+    """Mean return of the episodes each member finished; -inf without any."""
+    done = metrics["returned_episode"]
+    axes = tuple(range(1, done.ndim))
+    total = jnp.where(done, metrics["returned_episode_returns"], 0.0).sum(axis=axes)
+    count = done.sum(axis=axes)
+    score = jnp.where(count > 0, total / jnp.maximum(count, 1), -jnp.inf)
+    # diverged members rank last
+    return jnp.where(jnp.isnan(score), -jnp.inf, score)
+
+
+def exploit_and_explore(rng, runner_state, scores, fraction):
+    """Replace the worst members by perturbed copies of the best ones."""
+    population = scores.shape[0]
+    num_replaced = max(1, int(population * fraction))
+    order = jnp.argsort(-scores)
+    top, bottom = order[:num_replaced], order[-num_replaced:]
+
+    rng_pick, rng_perturb = jax.random.split(rng)
+    sources = top[jax.random.randint(rng_pick, (num_replaced,), 0, num_replaced)]
+    src = jnp.arange(population).at[bottom].set(sources)
+    replaced = jnp.zeros(population, dtype=bool).at[bottom].set(True)
+
+    take = lambda tree: jax.tree_util.tree_map(lambda x: x[src], tree)
+    hypers = take(runner_state.hypers)
+    for i, key in enumerate(HYPER_KEYS.values()):
+        factors = jax.random.choice(
+            jax.random.fold_in(rng_perturb, i),
+            jnp.asarray(PERTURB_FACTORS),
+            (population,),
+        )
+        value = jnp.where(replaced, hypers[key] * factors, hypers[key])
+        if key in HYPER_BOUNDS:
+            value = jnp.clip(value, *HYPER_BOUNDS[key])
+        hypers[key] = value
+
+    actor_train_state = set_learning_rate(
+        take(runner_state.actor_train_state), hypers["ACTOR_LR"]
+    )
+    critic_train_state = set_learning_rate(
+        take(runner_state.critic_train_state), hypers["CRITIC_LR"]
+    )
+    return runner_state._replace(
+        actor_train_state=actor_train_state,
+        critic_train_state=critic_train_state,
+        hypers=hypers,
+    )
+
+
+def make_pbt_train(config, interval, fraction):
+    """``train(rngs, hypers, rng)`` running PBT over a [population] batch.
+
+    Returns the final runner state, the metrics with the usual
+    [population, NUM_UPDATES, ...] layout and the hypers of every member at
+    the end of each chunk, [chunks, population]. The last chunk takes the
+    remainder of NUM_UPDATES (or a full interval) and is not followed by
+    exploit/explore, so the last hypers are those the final policies trained with.
+    """
+    assert not config["ANNEAL_LR"], "PBT perturbs the injected (constant) learning rates"
+    assert not config.get("EPISODE_BUFFER_SIZE"), "PBT ranks members by the dense metrics"
+    init, update = make_train_fns(config)
+    num_chunks, rest = divmod(config["NUM_UPDATES"], interval)
+    # every chunk but the one that ends training is followed by exploit/explore;
+    # a remainder of NUM_UPDATES runs as a shorter last chunk
+    num_exploits = num_chunks if rest else num_chunks - 1
+    last_updates = rest if rest else interval
+    batch_init = jax.vmap(init, in_axes=(0, 0))
+    batch_update = jax.vmap(update, in_axes=(0, None))
+
+    def train(rngs, hypers, rng):
+        runner_state = batch_init(rngs, hypers)
+
+        def _chunk(carry, unused):
+            runner_state, rng = carry
+            runner_state, metrics = batch_update(runner_state, interval)
+            rng, _rng = jax.random.split(rng)
+            runner_state = exploit_and_explore(
+                _rng, runner_state, chunk_scores(metrics), fraction
+            )
+            return (runner_state, rng), (metrics, runner_state.hypers)
+
+        (runner_state, _), (metrics, hypers_history) = jax.lax.scan(
+            _chunk, (runner_state, rng), None, num_exploits
+        )
+        runner_state, last_metrics = batch_update(runner_state, last_updates)
+        # [chunks, population, interval, ...] -> [population, chunks * interval, ...]
+        metrics = jax.tree_util.tree_map(
+            lambda x, last: jnp.concatenate(
+                [
+                    jnp.swapaxes(x, 0, 1).reshape(
+                        (x.shape[1], num_exploits * interval) + x.shape[3:]
+                    ),
+                    last,
+                ],
+                axis=1,
+            ),
+            metrics,
+            last_metrics,
+        )
+        hypers_history = jax.tree_util.tree_map(
+            lambda x, last: jnp.concatenate([x, last[None]]),
+            hypers_history,
+            runner_state.hypers,
+        )
+        return {
+            "runner_state": runner_state,
+            "metrics": metrics,
+            "hypers": hypers_history,
+        }
+
+    return train
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sweep_idx", action="store", default=0, type=int)
+    parser.add_argument("--population", action="store", default=16, type=int)
+    parser.add_argument("--start_seed", action="store", default=42, type=int)
+    parser.add_argument("--pbt_interval", action="store", default=50, type=int)
+    parser.add_argument("--pbt_fraction", action="store", default=0.25, type=float)
+    parser.add_argument("--output_dir", action="store", default="./pbt", type=str)
+    args = parser.parse_args()
+
+    with open(EXP_PATH, "r") as f:
+        exp = ExperimentDescription(json.load(f))
+    config = build_config(exp.getPermutation(args.sweep_idx)["metaParameters"])
+    config["DEBUG"] = False
+
+    rng = jax.random.PRNGKey(args.start_seed)
+    rng, _rng = jax.random.split(rng)
+    rngs = jax.random.split(_rng, args.population)
+    hypers = sample_population(exp, args.population, args.start_seed)
+
+    train = make_pbt_train(config, args.pbt_interval, args.pbt_fraction)
+    out = jax.jit(train)(rngs, hypers, rng)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    metrics = out["metrics"]
+    for name, key in (
+        ("returns", "returned_episode_returns"),
+        ("timestep", "timestep"),
+        ("lengths", "returned_episode_lengths"),
+        ("completed", "returned_episode"),
+    ):
+        jnp.save(os.path.join(args.output_dir, f"{name}.npy"), metrics[key])
+    np.savez(
+        os.path.join(args.output_dir, "hypers.npz"),
+        **jax.device_get(out["hypers"]),
+    )
+    env_steps = (
+        args.population * metrics["returned_episode"].shape[1]
+        * config["NUM_STEPS"] * config["NUM_ENVS"] * config["ACTION_REPEAT"]
+    )
+    with open(os.path.join(args.output_dir, "summary.json"), "w") as f:
+        json.dump(
+            {
+                "sweep_idx": args.sweep_idx,
+                "population": args.population,
+                "pbt_interval": args.pbt_interval,
+                "env_steps": int(env_steps),
+            },
+            f,
+            indent=2,
+        )
+    print(f"saved PBT run to {args.output_dir} ({env_steps} env steps)")
@@ -11,17 +11,88 @@ from typing import Sequence, NamedTuple, Any
 from flax.training.train_state import TrainState
 import distrax
 from PyExpUtils.models.ExperimentDescription import ExperimentDescription
+from PyExpUtils.FileSystemContext import FileSystemContext
 import json
+import functools
 import os
 from threading import Lock
 import logging
 
+if __name__ == "__main__":
+    # the host device count must be set before gymnax (imported by wrappers)
+    # initialises the JAX backend
+    from devices import set_host_device_count_from_argv
+
+    set_host_device_count_from_argv()
+
 from wrappers import (
     LogWrapper,
     BraxGymnaxWrapper,
     VecEnv,
     NormalizeVecObservation,
+    SwitchNormalizeVecObservation,
     ClipAction,
+    resolve_backend,
+    load_backend,
+)
+from sweep import (
+    HYPER_KEYS,
+    ALG_KEY,
+    GRAPH_KEYS,
+    SWITCH_GRAPH_KEYS,
+    config_hypers,
+    stack_hypers,
+    slice_indices,
+    batched,
+    lane_id,
+    make_sweep_train,
+)
+from episodes import (
+    init_episode_buffer,
+    record_episodes,
+    compact_episodes,
+    save_episode_table,
+)
+from episode_log import get_episode_logger
+from advantage import update_advantage_stats, calculate_gae, normalize_advantages
+from variants import (
+    VARIANT_KEYS,
+    variant_config,
+    alg_index,
+    traced_variant,
+    apply_if,
+    uses_advn_stats,
+)
+from checkpoint import checkpoint_key, clear_checkpoint, train_chunked
+from seed_batches import SeedBatchWriter, train_seed_batches
+from health import init_health, all_finite, update_health, train_dropping_diverged
+from telemetry import (
+    TELEMETRY_KEYS,
+    policy_diagnostics,
+    grad_norms,
+    advantage_diagnostics,
+    reduce_minibatches,
+    get_telemetry_writer,
+)
+from profiling import profile_train, phase_output
+from run_summary import (
+    read_summary_constants,
+    init_run_summary,
+    update_run_summary,
+    summary_record,
+    save_run_summary,
+)
+from devices import (
+    batch_mesh,
+    shard_leading_axis,
+    check_divisible,
+)
+from compile_cache import (
+    enable_compilation_cache,
+    compile_aot,
+    load_or_compile,
+    graph_key,
+    graph_representatives,
 )
 
 logging.basicConfig(
@@ -30,10 +101,13 @@ logging.basicConfig(
     format="%(asctime)s - %(message)s",  
     datefmt="%Y-%m-%d %H:%M:%S"  
 )
+# finished episodes logged with DEBUG=True (see episode_log.read_episode_log);
+# the text log above only receives the periodic summaries
+EPISODE_LOG = "/hyperparameter_sensitivity/returns/episodic_returns_timestep.bin"
+
+EXP_PATH = "../experiments/ppo_variants_brax.json"
 
 # jax.config.update("jax_enable_x64", True)
-last_save_timestep = 0
-cumulative_data = []
 
 class ActorTrainState(TrainState):
     advn_stats: dict[float, float]
@@ -68,7 +142,7 @@ class Actor(nn.Module):
     activation: str = "tanh"
 
     @nn.compact
-    def __call__(self, x):
+    def __call__(self, x, action_mask=None):
         if self.activation == "relu":
             activation = nn.relu
         else:
@@ -85,6 +159,11 @@ class Actor(nn.Module):
             self.action_dim, kernel_init=orthogonal(0.01), bias_init=constant(0.0)
         )(actor_mean)
         actor_logtstd = self.param("log_std", nn.initializers.zeros, (self.action_dim,))
+        if action_mask is not None:
+            # padded action dims stay N(0, 1): they add a constant to the
+            # entropy and cancel in the ratio, so they get no gradient
+            actor_mean = actor_mean * action_mask
+            actor_logtstd = actor_logtstd * action_mask
         pi = distrax.MultivariateNormalDiag(actor_mean, jnp.exp(actor_logtstd))
 
         return pi
@@ -100,30 +179,53 @@ class Transition(NamedTuple):
     info: jnp.ndarray
 
 
-def make_train(config):
-    config["NUM_UPDATES"] = (
-        config["TOTAL_TIMESTEPS"] // config["NUM_STEPS"] // config["NUM_ENVS"]
+class RunnerState(NamedTuple):
+    actor_train_state: TrainState
+    critic_train_state: TrainState
+    env_state: Any
+    last_obs: jnp.ndarray
+    rng: jnp.ndarray
+    # traced hyperparameters (see sweep.HYPER_KEYS); the learning rates are
+    # read from the optimizer states, which were initialised from these values
+    hypers: Any = None
+    episodes: Any = None
+    # divergence check of each lane, with CHECK_HEALTH (see health.py)
+    health: Any = None
+    # running AUC / step-to-threshold, with SUMMARY_CONSTANTS (see run_summary.py)
+    summary: Any = None
+    # 1 for the env's action dims, 0 for padding, in packed runs (see packed.py)
+    action_mask: Any = None
+    # sweep.lane_id of the lane's seed and initial hypers, for the host callbacks
+    lane: Any = None
+
+
+def make_agent_fns(config, observation_shape, action_dim):
+    """The per-lane parts of PPO that do not touch the env.
+
+    Returns ``(init, act, observe, learn, variant)``: ``init`` builds the
+    networks, optimizers and optional extras of a RunnerState without env
+    state, ``act`` samples the actions of the lane's NUM_ENVS envs,
+    ``observe`` preprocesses the observations an env step returns, and
+    ``learn`` runs GAE and the update epochs on a rollout. make_train_fns
+    steps one env stack per lane in between; packed.py steps several.
+    """
+    # TOTAL_TIMESTEPS counts physics steps, ACTION_REPEAT of them per agent step
+    config["NUM_UPDATES"] = int(
+        config["TOTAL_TIMESTEPS"]
+        // config["NUM_STEPS"]
+        // config["NUM_ENVS"]
+        // config.get("ACTION_REPEAT", 1)
     )
     config["MINIBATCH_SIZE"] = (
         config["NUM_ENVS"] * config["NUM_STEPS"] // config["NUM_MINIBATCHES"]
     )
 
-    if config["ENV_NAME"] == "swimmer":
-        env, env_params = (
-            BraxGymnaxWrapper(config["ENV_NAME"], backend="generalized"),
-            None,
-        )
-
-    else:
-        env, env_params = (
-            BraxGymnaxWrapper(config["ENV_NAME"], backend="positional"),
-            None,
+    if config.get("DEBUG"):
+        episode_logger = get_episode_logger(
+            config.get("EPISODE_LOG", EPISODE_LOG),
+            summary_seconds=config.get("LOG_SUMMARY_SECONDS", 60.0),
         )
-    env = LogWrapper(env)
-    env = ClipAction(env)
-    env = VecEnv(env)
-    if config["NORMALIZE_OBS"]:
-        env = NormalizeVecObservation(env)
+        log_run = episode_logger.new_run(json.dumps(config, sort_keys=True, default=str))
 
     def linear_schedule(count):
         frac = (
@@ -133,18 +235,32 @@ def make_train(config):
         )
         return config["LR"] * frac
 
-    def train(rng):
-        # INIT NETWORK
-        
-        actor_network = Actor(
-            env.action_space(env_params).shape[0], activation=config["ACTIVATION"]
-        )
-        critic_network = Critic(activation=config["ACTIVATION"])
+    def variant(hypers):
+        """Variant flags: from the config, or from the traced alg_type with ALG_SWITCH."""
+        if config.get("ALG_SWITCH"):
+            return traced_variant(hypers[ALG_KEY])
+        return {key: config[key] for key in VARIANT_KEYS}
+
+    symlog = lambda x: jnp.sign(x) * jnp.log(1 + jnp.abs(x))
+    symexp = lambda x: jnp.sign(x) * (jnp.exp(jnp.abs(x)) - 1)
+
+    # INIT NETWORK
+    actor_network = Actor(action_dim, activation=config["ACTIVATION"])
+    critic_network = Critic(activation=config["ACTIVATION"])
+
+    def init(rng, hypers=None, action_mask=None):
+        # hypers holds the traced scalar hyperparameters (see sweep.HYPER_KEYS),
+        # so one compiled train serves any point of the numeric grid.
+        if hypers is None:
+            hypers = {key: config[key] for key in HYPER_KEYS.values()}
+            if config.get("ALG_SWITCH"):
+                hypers[ALG_KEY] = config[ALG_KEY]
+        lane = lane_id(rng, hypers)
 
         #Mingyu: INIT ACTOR/CRITIC PARAS
         rng, _rng = jax.random.split(rng)
         # print(_rng)
-        init_x = jnp.zeros(env.observation_space(env_params).shape)
+        init_x = jnp.zeros(observation_shape)
         actor_network_params = actor_network.init(_rng, init_x)
         rng, _rng = jax.random.split(rng)
         critic_network_params = critic_network.init(_rng, init_x)
@@ -161,11 +277,15 @@ def make_train(config):
         else:
             actor_tx = optax.chain(
                 optax.clip_by_global_norm(config["MAX_GRAD_NORM"]),
-                optax.adam(config["ACTOR_LR"], eps=1e-5),
+                optax.inject_hyperparams(optax.adam)(
+                    learning_rate=hypers["ACTOR_LR"], eps=1e-5
+                ),
             )
             critic_tx = optax.chain(
                 optax.clip_by_global_norm(config["MAX_GRAD_NORM"]),
-                optax.adam(config["CRITIC_LR"], eps=1e-5),
+                optax.inject_hyperparams(optax.adam)(
+                    learning_rate=hypers["CRITIC_LR"], eps=1e-5
+                ),
             )
         actor_train_state = ActorTrainState.create(
             apply_fn=actor_network.apply,
@@ -184,382 +304,533 @@ def make_train(config):
             tx=critic_tx,
         )
 
-        # INIT ENV
-        rng, _rng = jax.random.split(rng)
-        reset_rng = jax.random.split(_rng, config["NUM_ENVS"])
-        # print(reset_rng)
-        obsv, env_state = env.reset(reset_rng, env_params)
-
-        # TRAIN LOOP
-        def _update_step(runner_state, unused):
-            # COLLECT TRAJECTORIES
-            def _env_step(runner_state, unused):
-                (
-                    actor_train_state,
-                    critic_train_state,
-                    env_state,
-                    last_obs,
-                    rng,
-                ) = runner_state
-
-                # SELECT ACTION
-                rng, _rng = jax.random.split(rng)
-                pi = actor_network.apply(actor_train_state.params, last_obs)
-                value = critic_network.apply(critic_train_state.params, last_obs)
-
-                if config["SYMLOG_CRITIC_TARGETS"]:
-                    symexp = lambda x: jnp.sign(x) * (jnp.exp(jnp.abs(x)) - 1)
-                    value = symexp(value)
-
-                action = pi.sample(seed=_rng)
-                log_prob = pi.log_prob(action)
-
-                # STEP ENV
-                rng, _rng = jax.random.split(rng)
-                rng_step = jax.random.split(_rng, config["NUM_ENVS"])
-                obsv, env_state, reward, done, info = env.step(
-                    rng_step, env_state, action, env_params
-                )
-                # print(info)
+        episodes = None
+        if config.get("EPISODE_BUFFER_SIZE"):
+            episodes = init_episode_buffer(config["EPISODE_BUFFER_SIZE"])
+        health = init_health() if config.get("CHECK_HEALTH") else None
+        summary = None
+        if config.get("SUMMARY_CONSTANTS"):
+            summary = init_run_summary(config["SUMMARY_CONSTANTS"])
+        # the caller resets the envs and sets env_state, last_obs and rng
+        return rng, RunnerState(
+            actor_train_state,
+            critic_train_state,
+            None,
+            None,
+            None,
+            hypers,
+            episodes,
+            health,
+            summary,
+            action_mask,
+            lane,
+        )
 
-                if config["SYMLOG_OBS"]:
-                    symlog = lambda x: jnp.sign(x) * jnp.log(1 + jnp.abs(x))
-                    obsv = symlog(obsv)
+    def act(runner_state):
+        """Sample actions for the lane's envs; also returns their step rngs."""
+        flags = variant(runner_state.hypers)
+        (
+            actor_train_state,
+            critic_train_state,
+            env_state,
+            last_obs,
+            rng,
+        ) = runner_state[:5]
+
+        # SELECT ACTION
+        rng, _rng = jax.random.split(rng)
+        pi = actor_network.apply(
+            actor_train_state.params, last_obs, runner_state.action_mask
+        )
+        value = critic_network.apply(critic_train_state.params, last_obs)
+        value = apply_if(flags["SYMLOG_CRITIC_TARGETS"], symexp, value)
 
-                transition = Transition(
-                    done, action, value, reward, log_prob, last_obs, info
-                )
-                runner_state = (
-                    actor_train_state,
-                    critic_train_state,
-                    env_state,
-                    obsv,
-                    rng,
-                )
-                return runner_state, transition
+        action = pi.sample(seed=_rng)
+        log_prob = pi.log_prob(action)
 
-            ##mark 
-            runner_state, traj_batch = jax.lax.scan(
-                _env_step, runner_state, None, config["NUM_STEPS"]
+        rng, _rng = jax.random.split(rng)
+        rng_step = jax.random.split(_rng, config["NUM_ENVS"])
+        return runner_state._replace(rng=rng), (action, value, log_prob, rng_step)
+
+    def observe(hypers, obsv):
+        return apply_if(variant(hypers)["SYMLOG_OBS"], symlog, obsv)
+
+    def learn(runner_state, traj_batch):
+        """GAE and the update epochs on ``traj_batch``, a [NUM_STEPS, NUM_ENVS] rollout."""
+        hypers = runner_state.hypers
+        flags = variant(hypers)
+        action_mask = runner_state.action_mask
+
+        # CALCULATE ADVANTAGE
+        (
+            actor_train_state,
+            critic_train_state,
+            env_state,
+            last_obs,
+            rng,
+        ) = runner_state[:5]
+        last_val = critic_network.apply(critic_train_state.params, last_obs)
+        last_val = apply_if(flags["SYMLOG_CRITIC_TARGETS"], symexp, last_val)
+
+        def _calculate_gae(traj_batch, last_val):
+            advantages = calculate_gae(
+                traj_batch.reward,
+                traj_batch.value,
+                traj_batch.done,
+                last_val,
+                config["GAMMA"],
+                hypers["GAE_LAMBDA"],
+                config.get("GAE_METHOD", "SCAN"),
             )
+            return advantages, advantages + traj_batch.value
 
-            # CALCULATE ADVANTAGE
-            (
-                actor_train_state,
-                critic_train_state,
-                env_state,
-                last_obs,
-                rng,
-            ) = runner_state
-            last_val = critic_network.apply(critic_train_state.params, last_obs)
-            if config["SYMLOG_CRITIC_TARGETS"]:
-                symexp = lambda x: jnp.sign(x) * (jnp.exp(jnp.abs(x)) - 1)
-                last_val = symexp(last_val)
-
-            def _calculate_gae(traj_batch, last_val):
-                def _get_advantages(gae_and_next_value, transition):
-                    gae, next_value = gae_and_next_value
-                    done, value, reward = (
-                        transition.done,
-                        transition.value,
-                        transition.reward,
-                    )
-                    delta = reward + config["GAMMA"] * next_value * (1 - done) - value
-                    gae = (
-                        delta
-                        + config["GAMMA"] * config["GAE_LAMBDA"] * (1 - done) * gae
+        with jax.named_scope("gae"):
+            advantages, targets = _calculate_gae(traj_batch, last_val)
+        if config.get("STOP_AFTER_PHASE") == "gae":
+            return runner_state, phase_output(advantages, targets)
+
+        if uses_advn_stats(flags["ADVN_NORM"]):
+            with jax.named_scope("advantage_stats"):
+                actor_train_state = actor_train_state.replace(
+                    advn_stats=update_advantage_stats(
+                        actor_train_state.advn_stats,
+                        advantages,
+                        config["EMA_RATE"],
+                        config.get("ADVN_STATS", "SORT"),
                     )
-                    return (gae, value), gae
-
-                _, advantages = jax.lax.scan(
-                    _get_advantages,
-                    (jnp.zeros_like(last_val), last_val),
-                    traj_batch,
-                    reverse=True,
-                    unroll=16,
                 )
-                return advantages, advantages + traj_batch.value
-
-            advantages, targets = _calculate_gae(traj_batch, last_val)
-
-            actor_train_state.advn_stats["advn_per_5"] = jax.lax.cond(
-                actor_train_state.advn_stats["advn_per_5"] == 0.0,
-                lambda x: jnp.percentile(x, 5),
-                lambda x: config["EMA_RATE"] * jnp.percentile(x, 5)
-                + (1 - config["EMA_RATE"]) * actor_train_state.advn_stats["advn_per_5"],
-                advantages,
-            )
-
-            actor_train_state.advn_stats["advn_per_95"] = jax.lax.cond(
-                actor_train_state.advn_stats["advn_per_95"] == 0.0,
-                lambda x: jnp.percentile(x, 95),
-                lambda x: config["EMA_RATE"] * jnp.percentile(x, 95)
-                + (1 - config["EMA_RATE"])
-                * actor_train_state.advn_stats["advn_per_95"],
-                advantages,
-            )
-
-            actor_train_state.advn_stats["advn_mean"] = jax.lax.cond(
-                actor_train_state.advn_stats["advn_mean"] == 0.0,
-                lambda x: x.mean(),
-                lambda x: config["EMA_RATE"] * x.mean()
-                + (1 - config["EMA_RATE"]) * actor_train_state.advn_stats["advn_mean"],
-                advantages,
-            )
-
-            actor_train_state.advn_stats["advn_std"] = jax.lax.cond(
-                actor_train_state.advn_stats["advn_std"] == 0.0,
-                lambda x: x.std(),
-                lambda x: config["EMA_RATE"] * x.std()
-                + (1 - config["EMA_RATE"]) * actor_train_state.advn_stats["advn_std"],
-                advantages,
+        if config.get("STOP_AFTER_PHASE") == "advantage_stats":
+            return runner_state, phase_output(
+                advantages, targets, actor_train_state.advn_stats
             )
 
-            # UPDATE NETWORK
-            def _update_epoch(update_state, unused):
-                def _update_minbatch(train_state, batch_info):
-                    traj_batch, advantages, targets = batch_info
-                    actor_train_state, critic_train_state = train_state
+        # UPDATE NETWORK
+        def _update_epoch(update_state, unused):
+            def _update_minbatch(train_state, minibatch_idx):
+                # gather this minibatch's rows from the flat rollout in place
+                traj_batch, advantages, targets = jax.tree_util.tree_map(
+                    lambda x: jnp.take(x, minibatch_idx, axis=0), batch
+                )
+                actor_train_state, critic_train_state = train_state
 
-                    def _critic_loss_fn(critic_params, traj_batch, gae, targets):
+                def _critic_loss_fn(critic_params, traj_batch, gae, targets):
 
-                        if config["SYMLOG_CRITIC_TARGETS"]:
-                            symlog = lambda x: jnp.sign(x) * jnp.log(1 + jnp.abs(x))
-                            targets = symlog(targets)
+                    targets = apply_if(flags["SYMLOG_CRITIC_TARGETS"], symlog, targets)
 
-                        # RERUN NETWORK
-                        value = critic_network.apply(critic_params, traj_batch.obs)
+                    # RERUN NETWORK
+                    value = critic_network.apply(critic_params, traj_batch.obs)
 
-                        # CALCULATE VALUE LOSS
+                    # CALCULATE VALUE LOSS
 
-                        value_losses = jnp.square(
-                            value - jax.lax.stop_gradient(targets)
-                        )
-                        value_loss = value_losses.mean()
-
-                        total_loss = value_loss
-
-                        return total_loss, (value_loss,)
-
-                    def _actor_loss_fn(actor_params, traj_batch, gae, targets):
-                        # RERUN NETWORK
-                        pi = actor_network.apply(actor_params, traj_batch.obs)
-                        log_prob = pi.log_prob(traj_batch.action)
-
-                        if config["ADVN_NORM"] == "MEAN":
-                            gae = (gae - gae.mean()) / (gae.std() + 1e-8)
-
-                        elif config["ADVN_NORM"] == "EMA_MEAN":
-                            gae = (gae - actor_train_state.advn_stats["advn_mean"]) / (
-                                actor_train_state.advn_stats["advn_std"] + 1e-8
-                            )
-
-                        elif config["ADVN_NORM"] == "EMA_PERC":
-                            gae = gae / (
-                                actor_train_state.advn_stats["advn_per_95"]
-                                - actor_train_state.advn_stats["advn_per_5"]
-                                + 1e-8
-                            )
-                        elif config["ADVN_NORM"] == "MAX_EMA_PERC":
-                            gae = gae / (
-                                jnp.maximum(
-                                    1.0,
-                                    actor_train_state.advn_stats["advn_per_95"]
-                                    - actor_train_state.advn_stats["advn_per_5"],
-                                )
-                            )
-
-                        # CALCULATE ACTOR LOSS
-                        ratio = jnp.exp(log_prob - traj_batch.log_prob)
-                        loss_actor1 = ratio * gae
-                        loss_actor2 = (
-                            jnp.clip(
-                                ratio,
-                                1.0 - config["CLIP_EPS"],
-                                1.0 + config["CLIP_EPS"],
-                            )
-                            * gae
-                        )
-                        loss_actor = -jnp.minimum(loss_actor1, loss_actor2)
-                        loss_actor = loss_actor.mean()
-                        entropy = pi.entropy().mean()
+                    value_losses = jnp.square(
+                        value - jax.lax.stop_gradient(targets)
+                    )
+                    value_loss = value_losses.mean()
 
-                        total_loss = loss_actor - config["ENT_COEF"] * entropy
+                    total_loss = value_loss
 
-                        return total_loss, (loss_actor, entropy)
+                    return total_loss, (value_loss,)
 
-                    actor_grad_fn = jax.value_and_grad(_actor_loss_fn, has_aux=True)
-                    critic_grad_fn = jax.value_and_grad(_critic_loss_fn, has_aux=True)
+                def _actor_loss_fn(actor_params, traj_batch, gae, targets):
+                    # RERUN NETWORK
+                    pi = actor_network.apply(actor_params, traj_batch.obs, action_mask)
+                    log_prob = pi.log_prob(traj_batch.action)
 
-                    critic_loss, critic_grads = critic_grad_fn(
-                        critic_train_state.params, traj_batch, advantages, targets
+                    gae = normalize_advantages(
+                        gae, actor_train_state.advn_stats, flags["ADVN_NORM"]
                     )
 
-                    actor_loss, actor_grads = actor_grad_fn(
-                        actor_train_state.params, traj_batch, advantages, targets
+                    # CALCULATE ACTOR LOSS
+                    ratio = jnp.exp(log_prob - traj_batch.log_prob)
+                    loss_actor1 = ratio * gae
+                    loss_actor2 = (
+                        jnp.clip(
+                            ratio,
+                            1.0 - config["CLIP_EPS"],
+                            1.0 + config["CLIP_EPS"],
+                        )
+                        * gae
                     )
+                    loss_actor = -jnp.minimum(loss_actor1, loss_actor2)
+                    loss_actor = loss_actor.mean()
+                    entropy = pi.entropy().mean()
 
-                    total_loss = actor_loss + critic_loss
+                    total_loss = loss_actor - hypers["ENT_COEF"] * entropy
 
-                    critic_train_state = critic_train_state.apply_gradients(
-                        grads=critic_grads
+                    diagnostics = policy_diagnostics(
+                        log_prob - traj_batch.log_prob, config["CLIP_EPS"]
                     )
+                    return total_loss, (loss_actor, entropy, diagnostics)
 
-                    actor_train_state = actor_train_state.apply_gradients(
-                        grads=actor_grads
-                    )
+                actor_grad_fn = jax.value_and_grad(_actor_loss_fn, has_aux=True)
+                critic_grad_fn = jax.value_and_grad(_critic_loss_fn, has_aux=True)
 
-                    train_state = (actor_train_state, critic_train_state)
-                    return train_state, total_loss
-
-                (
-                    actor_train_state,
-                    critic_train_state,
-                    traj_batch,
-                    advantages,
-                    targets,
-                    rng,
-                ) = update_state
-                rng, _rng = jax.random.split(rng)
-                batch_size = config["MINIBATCH_SIZE"] * config["NUM_MINIBATCHES"]
-                assert (
-                    batch_size == config["NUM_STEPS"] * config["NUM_ENVS"]
-                ), "batch size must be equal to number of steps * number of envs"
-                permutation = jax.random.permutation(_rng, batch_size)
-                batch = (traj_batch, advantages, targets)
-                batch = jax.tree_util.tree_map(
-                    lambda x: x.reshape((batch_size,) + x.shape[2:]), batch
+                critic_loss, critic_grads = critic_grad_fn(
+                    critic_train_state.params, traj_batch, advantages, targets
                 )
-                shuffled_batch = jax.tree_util.tree_map(
-                    lambda x: jnp.take(x, permutation, axis=0), batch
-                )
-                minibatches = jax.tree_util.tree_map(
-                    lambda x: jnp.reshape(
-                        x, [config["NUM_MINIBATCHES"], -1] + list(x.shape[1:])
-                    ),
-                    shuffled_batch,
+
+                actor_loss, actor_grads = actor_grad_fn(
+                    actor_train_state.params, traj_batch, advantages, targets
                 )
-                train_state = (actor_train_state, critic_train_state)
-                train_state, total_loss = jax.lax.scan(
-                    _update_minbatch, train_state, minibatches
+
+                total_loss = actor_loss + critic_loss
+
+                diagnostics = None
+                if config.get("TELEMETRY"):
+                    diagnostics = {
+                        "actor_loss": actor_loss[1][0],
+                        "critic_loss": critic_loss[1][0],
+                        "entropy": actor_loss[1][1],
+                        **actor_loss[1][2],
+                        **grad_norms(actor_grads, critic_grads),
+                    }
+
+                critic_train_state = critic_train_state.apply_gradients(
+                    grads=critic_grads
                 )
-                actor_train_state, critic_train_state = train_state
-                update_state = (
-                    actor_train_state,
-                    critic_train_state,
-                    traj_batch,
-                    advantages,
-                    targets,
-                    rng,
+
+                actor_train_state = actor_train_state.apply_gradients(
+                    grads=actor_grads
                 )
-                return update_state, total_loss
-
-            update_state = (
-                actor_train_state,
-                critic_train_state,
-                traj_batch,
-                advantages,
-                targets,
-                rng,
+
+                train_state = (actor_train_state, critic_train_state)
+                return train_state, (total_loss, diagnostics)
+
+            actor_train_state, critic_train_state, batch, rng = update_state
+            rng, _rng = jax.random.split(rng)
+            # only the indices are shuffled; _update_minbatch gathers the rows
+            permutation = jax.random.permutation(_rng, batch_size)
+            minibatch_indices = permutation.reshape((config["NUM_MINIBATCHES"], -1))
+            train_state = (actor_train_state, critic_train_state)
+            train_state, total_loss = jax.lax.scan(
+                _update_minbatch, train_state, minibatch_indices
             )
+            actor_train_state, critic_train_state = train_state
+            update_state = (actor_train_state, critic_train_state, batch, rng)
+            return update_state, total_loss
+
+        # flatten the rollout once per update; info is not needed for training
+        batch_size = config["MINIBATCH_SIZE"] * config["NUM_MINIBATCHES"]
+        assert (
+            batch_size == config["NUM_STEPS"] * config["NUM_ENVS"]
+        ), "batch size must be equal to number of steps * number of envs"
+        batch = (traj_batch._replace(info=None), advantages, targets)
+        batch = jax.tree_util.tree_map(
+            lambda x: x.reshape((batch_size,) + x.shape[2:]), batch
+        )
+        update_state = (actor_train_state, critic_train_state, batch, rng)
+        with jax.named_scope("update_epochs"):
             update_state, loss_info = jax.lax.scan(
                 _update_epoch, update_state, None, config["UPDATE_EPOCHS"]
             )
-            actor_train_state = update_state[0]
-            critic_train_state = update_state[1]
-            metric = traj_batch.info
-            rng = update_state[-1]
-
-            #rng_numpy = jax.device_get(rng)
-            #jax.debug.print(rng_numpy)
-
-            if config.get("DEBUG"):
-                
-                def callback(info):
-                    global cumulative_data, last_save_timestep
-                    return_values = info["returned_episode_returns"][
-                        info["returned_episode"]
-                    ]
-                    
-                    true_indices = np.argwhere(info["returned_episode"])
-                    mapped_timesteps = info["timestep"][true_indices[:, 0], true_indices[:, 1]]
-                    timesteps = list(zip(mapped_timesteps, true_indices[:, 1]))
-                    # num_rows = info["returned_episode"].shape[0]  
-                    # idx = true_indices[:, 0] + num_rows * true_indices[:, 1]
-                    
-                    # timesteps = (
-                    #     info["timestep"][info["returned_episode"]] * config["NUM_ENVS"]
-                    # )                   
-                    # print("info:", info)
-
-                    # print("timesteps:", timesteps)
-                    #row_indices, col_indices = np.nonzero(ts_matrix)
-                    #values = ts_matrix[row_indices, col_indices]
-
-                    for t in range(len(timesteps)):
-                        #print(len(timesteps), timesteps)
-                        # print(
-                        #     f"global step={timesteps}, episodic return={return_values}"
-                        # )
-                        logging.info(f"global step={timesteps[t]}, episodic return={return_values}")
-                        # _rng_numpy = jax.device_get(_rng)
-                        # jax.debug.print("{}", _rng)
-                        #print("RNG Key:", rng_new)
-                        
-                #callback(traj_batch.info)
-                jax.debug.callback(callback, traj_batch.info)
-                # jax.debug.callback(callback, metric)
-                
-            runner_state = (
-                actor_train_state,
-                critic_train_state,
-                env_state,
-                last_obs,
-                rng,
+        actor_train_state = update_state[0]
+        critic_train_state = update_state[1]
+        metric = traj_batch.info
+        rng = update_state[-1]
+
+        #rng_numpy = jax.device_get(rng)
+        #jax.debug.print(rng_numpy)
+
+        if config.get("DEBUG"):
+            # only the compacted finished episodes cross to the host; the
+            # file IO happens on the logger's writer thread
+            jax.debug.callback(
+                functools.partial(episode_logger.push, log_run),
+                runner_state.lane,
+                compact_episodes(traj_batch.info, config["NUM_ENVS"]),
+            )
+
+        health = runner_state.health
+        if config.get("CHECK_HEALTH"):
+            health = update_health(
+                health,
+                all_finite(
+                    actor_train_state.params,
+                    critic_train_state.params,
+                    loss_info,
+                    traj_batch.reward,
+                    metric["returned_episode_returns"],
+                ),
+            )
+
+        summary = runner_state.summary
+        if config.get("SUMMARY_CONSTANTS"):
+            summary = update_run_summary(
+                summary, metric, config["SUMMARY_CONSTANTS"], config["NUM_ENVS"]
             )
-            return runner_state, traj_batch.info
+
+        episodes = runner_state.episodes
+        if config.get("EPISODE_BUFFER_SIZE"):
+            # keep only finished episodes instead of the dense info tensors
+            episodes = record_episodes(episodes, metric, config["NUM_ENVS"])
+            metric = None
+        if config.get("SUMMARY_ONLY"):
+            metric = None
+        if config.get("TELEMETRY"):
+            # a few scalars per update, kept even when the dense info is not
+            telemetry = reduce_minibatches(loss_info[1])
+            telemetry.update(advantage_diagnostics(advantages))
+            metric = {**(metric or {}), **telemetry}
+
+        runner_state = runner_state._replace(
+            actor_train_state=actor_train_state,
+            critic_train_state=critic_train_state,
+            rng=rng,
+            episodes=episodes,
+            health=health,
+            summary=summary,
+        )
+        return runner_state, metric
+
+    return init, act, observe, learn, variant
+
+
+def make_train_fns(config):
+    backend = resolve_backend(config["ENV_NAME"], config.get("BACKEND"))
+    env, env_params = (
+        BraxGymnaxWrapper(
+            config["ENV_NAME"],
+            backend=backend,
+            reset_pool=config.get("RESET_POOL", 0),
+            episode_length=config.get("EPISODE_LENGTH", 1000),
+            action_repeat=config.get("ACTION_REPEAT", 1),
+        ),
+        None,
+    )
+    env = LogWrapper(env, action_repeat=config.get("ACTION_REPEAT", 1))
+    env = ClipAction(env)
+    env = VecEnv(env)
+    if config.get("ALG_SWITCH"):
+        env = SwitchNormalizeVecObservation(env)
+    elif config["NORMALIZE_OBS"]:
+        env = NormalizeVecObservation(env)
+
+    flush_every = config.get("TELEMETRY_FLUSH_EVERY", 0) if config.get("TELEMETRY") else 0
+    if flush_every:
+        telemetry_writer = get_telemetry_writer(config["TELEMETRY_LOG"])
+
+    init_agent, act, observe, learn, variant = make_agent_fns(
+        config,
+        env.observation_space(env_params).shape,
+        env.action_space(env_params).shape[0],
+    )
+
+    def init(rng, hypers=None):
+        rng, runner_state = init_agent(rng, hypers)
+        hypers = runner_state.hypers
+
+        # INIT ENV
+        rng, _rng = jax.random.split(rng)
+        reset_rng = jax.random.split(_rng, config["NUM_ENVS"])
+        # print(reset_rng)
+        if config.get("ALG_SWITCH"):
+            obsv, env_state = env.reset(
+                reset_rng, env_params, normalize=variant(hypers)["NORMALIZE_OBS"]
+            )
+        else:
+            obsv, env_state = env.reset(reset_rng, env_params)
 
         rng, _rng = jax.random.split(rng)
-        runner_state = (actor_train_state, critic_train_state, env_state, obsv, _rng)
+        return runner_state._replace(env_state=env_state, last_obs=obsv, rng=_rng)
+
+    # TRAIN LOOP
+    def _update_step(runner_state, unused):
+        # COLLECT TRAJECTORIES
+        def _env_step(runner_state, unused):
+            runner_state, (action, value, log_prob, rng_step) = act(runner_state)
+
+            # STEP ENV
+            obsv, env_state, reward, done, info = env.step(
+                rng_step, runner_state.env_state, action, env_params
+            )
+            # print(info)
+
+            obsv = observe(runner_state.hypers, obsv)
+
+            transition = Transition(
+                done, action, value, reward, log_prob, runner_state.last_obs, info
+            )
+            runner_state = runner_state._replace(env_state=env_state, last_obs=obsv)
+            return runner_state, transition
+
+        ##mark 
+        with jax.named_scope("env_rollout"):
+            runner_state, traj_batch = jax.lax.scan(
+                _env_step, runner_state, None, config["NUM_STEPS"]
+            )
+        if config.get("STOP_AFTER_PHASE") == "env_rollout":
+            return runner_state, phase_output(traj_batch)
+        return learn(runner_state, traj_batch)
+
+    def _telemetry_block(runner_state, unused):
+        # one host callback per block of updates instead of one per update
+        runner_state, metric = jax.lax.scan(_update_step, runner_state, None, flush_every)
+        steps_per_update = config["UPDATE_EPOCHS"] * config["NUM_MINIBATCHES"]
+        jax.debug.callback(
+            telemetry_writer.push,
+            runner_state.lane,
+            runner_state.hypers,
+            runner_state.actor_train_state.step // steps_per_update - 1,
+            {key: metric[key] for key in TELEMETRY_KEYS},
+        )
+        return runner_state, metric
+
+    def update(runner_state, num_updates):
+        if not flush_every or num_updates < flush_every:
+            return jax.lax.scan(_update_step, runner_state, None, num_updates)
+        num_blocks, rest = divmod(num_updates, flush_every)
         runner_state, metric = jax.lax.scan(
-            _update_step, runner_state, None, config["NUM_UPDATES"]
+            _telemetry_block, runner_state, None, num_blocks
+        )
+        metric = jax.tree_util.tree_map(
+            lambda x: x.reshape((num_blocks * flush_every,) + x.shape[2:]), metric
         )
-        return {"runner_state": runner_state, "metrics": metric}
+        if rest:
+            runner_state, rest_metric = jax.lax.scan(
+                _update_step, runner_state, None, rest
+            )
+            metric = jax.tree_util.tree_map(
+                lambda x, y: jnp.concatenate([x, y]), metric, rest_metric
+            )
+        return runner_state, metric
+
+    return init, update
+
+
+def make_train(config):
+    init, update = make_train_fns(config)
+
+    def train(rng, hypers=None):
+        runner_state = init(rng, hypers)
+        runner_state, metric = update(runner_state, config["NUM_UPDATES"])
+        return train_outputs(config, runner_state, metric)
 
     return train
 
-if __name__ == "__main__":
 
-    parser = argparse.ArgumentParser()
+def train_outputs(config, runner_state, metrics):
+    """Outputs of a finished train: the dense metrics and the optional extras."""
+    out = {"runner_state": runner_state, "metrics": metrics}
+    if config.get("EPISODE_BUFFER_SIZE"):
+        out["episodes"] = runner_state.episodes
+    if config.get("CHECK_HEALTH"):
+        out["diverged"] = runner_state.health["diverged_update"]
+    if config.get("SUMMARY_CONSTANTS"):
+        out["summary"] = runner_state.summary
+    if config.get("TELEMETRY"):
+        out["telemetry"] = {key: metrics[key] for key in TELEMETRY_KEYS}
+    return out
 
-    parser.add_argument("--sweep_idx", action="store", default=-1, type=int)
-    parser.add_argument("--num_seeds", action="store", default=1, type=int)
-    parser.add_argument("--start_seed", action="store", default=42, type=int)
-    parser.add_argument("--actor_lr", action="store", default=3e-4, type=float)
-    parser.add_argument("--critic_lr", action="store", default=3e-4, type=float)
-    parser.add_argument("--ent_coef", action="store", default=0.1, type=float)
-    parser.add_argument("--gae_lambda", action="store", default=0.9, type=float)
-    parser.add_argument("--env_name", action="store", default="swimmer", type=str)
-    parser.add_argument("--alg_type", action="store", default="lambda_ac", type=str)
 
-    args = parser.parse_args()
+def batched_train_fn(config, sweep=False):
+    """train vmapped over seeds, or over configs x seeds when ``sweep``.
 
-    if args.sweep_idx == -1:
-        hypers = dict(
-            alg_type=args.alg_type,
-            env_name=args.env_name,
-            gae_lambda=args.gae_lambda,
-            ent_coef=args.ent_coef,
-            actor_lr=args.actor_lr,
-            critic_lr=args.critic_lr,
-        )
+    With ``config["NUM_DEVICES"] > 1`` the seed axis (the config axis when
+    ``sweep``) is split across that many devices.
+    """
+    train = make_train(config)
+    if sweep:
+        fn = make_sweep_train(train)
     else:
-        exp_path = "../experiments/ppo_variants_brax.json"
-        with open(exp_path, "r") as f:
-            d = json.load(f)
-        exp = ExperimentDescription(d)
-        hypers = exp.getPermutation(args.sweep_idx)["metaParameters"]
+        fn = jax.vmap(train, in_axes=(0, None))
+    if config.get("NUM_DEVICES", 1) > 1:
+        # the leading axis of rngs is sharded, or that of the hypers when sweeping
+        fn = shard_leading_axis(fn, batch_mesh(config["NUM_DEVICES"]), (not sweep, sweep))
+    return fn
+
+
+def make_batched_train(config, sweep=False, chunk_updates=0, cache_dir=None):
+    """Jitted train over seeds, or over configs x seeds when ``sweep``.
+
+    Returns ``run(rngs, hypers, checkpoint_dir=None)``. With ``chunk_updates``
+    the updates run in jitted calls of that many updates and the runner state
+    is checkpointed to ``checkpoint_dir`` after each call, so an interrupted
+    run resumes where it stopped (see checkpoint.train_chunked); a checkpoint
+    of other hypers, seeds or config is refused. With ``cache_dir`` the full train is loaded from a serialized executable
+    written by ``--aot_compile`` (or compiled and serialized on first use).
+    With ``config["DROP_DIVERGED"]`` the chunks instead run over a flat batch
+    of lanes from which diverged lanes are dropped after each chunk (see
+    health.train_dropping_diverged); such runs are not checkpointed. Runs are
+    sharded across devices as in batched_train_fn.
+    """
+    mesh = None
+    if config.get("NUM_DEVICES", 1) > 1:
+        mesh = batch_mesh(config["NUM_DEVICES"])
+
+    def check_batch(rngs, hypers):
+        if mesh is not None:
+            size = jax.tree_util.tree_leaves(hypers)[0].shape[0] if sweep else rngs.shape[0]
+            check_divisible(size, mesh, "config_batch" if sweep else "num_seeds")
+
+    if not chunk_updates:
+        fn = batched_train_fn(config, sweep)
+        if cache_dir is None:
+            train_jit = jax.jit(fn)
+        else:
+            executables = {}
+
+            def train_jit(rngs, hypers):
+                key = graph_key("ppo_continuous_action", config, (rngs, hypers))
+                if key not in executables:
+                    executables[key] = load_or_compile(
+                        fn, (rngs, hypers), cache_dir, "ppo_continuous_action", config
+                    )
+                return executables[key](rngs, hypers)
+
+        def run(rngs, hypers, checkpoint_dir=None):
+            check_batch(rngs, hypers)
+            return train_jit(rngs, hypers)
+
+        return run
+
+    init, update = make_train_fns(config)
+    batch_init = jax.vmap(init, in_axes=(0, None))
+    batch_update = jax.vmap(update, in_axes=(0, None))
+    if sweep:
+        batch_init = jax.vmap(batch_init, in_axes=(None, 0))
+        if not config.get("DROP_DIVERGED"):
+            # the lanes stay [configs, seeds] unless they are repacked
+            batch_update = jax.vmap(batch_update, in_axes=(0, None))
+    if mesh is not None:
+        batch_init = shard_leading_axis(batch_init, mesh, (not sweep, sweep))
+        unsharded_update = batch_update
+
+        def batch_update(runner_state, num_updates):
+            return shard_leading_axis(
+                lambda state: unsharded_update(state, num_updates), mesh, (True,)
+            )(runner_state)
+
+    init_jit = jax.jit(batch_init)
+    update_jit = jax.jit(batch_update, static_argnums=1)
+
+    def run(rngs, hypers, checkpoint_dir=None):
+        check_batch(rngs, hypers)
+        if config.get("DROP_DIVERGED"):
+            runner_state, metrics, _ = train_dropping_diverged(
+                lambda: init_jit(rngs, hypers),
+                update_jit,
+                config["NUM_UPDATES"],
+                chunk_updates,
+                batch_ndim=2 if sweep else 1,
+                multiple=config.get("NUM_DEVICES", 1),
+            )
+            return train_outputs(config, runner_state, metrics)
+
+        runner_state, metrics = train_chunked(
+            lambda: init_jit(rngs, hypers),
+            update_jit,
+            config["NUM_UPDATES"],
+            chunk_updates,
+            checkpoint_dir,
+            update_axis=2 if sweep else 1,
+            key=checkpoint_key(config, rngs, hypers),
+        )
+        return train_outputs(config, runner_state, metrics)
+
+    return run
 
+
+def build_config(hypers):
     config = {
         "ACTOR_LR": hypers["actor_lr"],
         "CRITIC_LR": hypers["critic_lr"],
@@ -575,6 +846,9 @@ if __name__ == "__main__":
         "MAX_GRAD_NORM": 0.5,
         "ACTIVATION": "tanh",
         "ENV_NAME": hypers["env_name"],
+        # optional sweep JSON entries; both count physics steps
+        "ACTION_REPEAT": int(hypers.get("action_repeat", 1)),
+        "EPISODE_LENGTH": int(hypers.get("episode_length", 1000)),
         "ANNEAL_LR": False,
         "DEBUG": True,
         "EMA_RATE": 0.02,
@@ -582,48 +856,345 @@ if __name__ == "__main__":
         "SYMLOG_CRITIC_TARGETS": False,
         "NORMALIZE_OBS": False,
         "SYMLOG_OBS": False,
+        "EPISODE_BUFFER_SIZE": 0,
+        "ADVN_STATS": "SORT",
+        "NUM_DEVICES": 1,
+        "GAE_METHOD": "SCAN",
+        "ALG_SWITCH": False,
+        # Brax pipeline, or a dict env -> pipeline; see wrappers.resolve_backend
+        "BACKEND": None,
+        # > 0 restarts episodes from a pool of this many reset states per env
+        "RESET_POOL": 0,
+        "CHECK_HEALTH": False,
+        "DROP_DIVERGED": False,
+        # {"p5", "p95", "thresholds": {name: value}} of the env, see run_summary.py
+        "SUMMARY_CONSTANTS": None,
+        "SUMMARY_ONLY": False,
+        "TELEMETRY": False,
+        # > 0 also streams the telemetry to TELEMETRY_LOG every this many updates
+        "TELEMETRY_FLUSH_EVERY": 0,
+        "TELEMETRY_LOG": "./telemetry.jsonl",
     }
 
-    if hypers["alg_type"] == "advn_norm_ema":
-        config["ADVN_NORM"] = "EMA_PERC"
-    elif hypers["alg_type"] == "advn_norm_max_ema":
-        config["ADVN_NORM"] = "MAX_EMA_PERC"
-    elif hypers["alg_type"] == "advn_norm_mean":
-        config["ADVN_NORM"] = "MEAN"
-    elif hypers["alg_type"] == "symlog_critic_targets":
-        config["SYMLOG_CRITIC_TARGETS"] = True
-    elif hypers["alg_type"]:
-        config["SYMLOG_OBS"] = True
-    elif hypers["alg_type"] == "norm_obs":
-        config["NORMALIZE_OBS"] = True
+    config.update(variant_config(hypers["alg_type"]))
+    config[ALG_KEY] = alg_index(hypers["alg_type"])
+
+    return config
+
+
+def apply_run_args(config, args):
+    config["EPISODE_BUFFER_SIZE"] = args.episode_buffer
+    config["ADVN_STATS"] = args.advn_stats
+    config["NUM_DEVICES"] = args.num_devices
+    config["GAE_METHOD"] = args.gae_method
+    config["BACKEND"] = load_backend(args.backend)
+    config["RESET_POOL"] = args.reset_pool
+    if args.drop_diverged:
+        assert args.chunk_updates, "--drop_diverged requires --chunk_updates"
+        config.update(CHECK_HEALTH=True, DROP_DIVERGED=True)
+    if args.summary_constants:
+        path = args.summary_constants.format(env=config["ENV_NAME"])
+        config["SUMMARY_CONSTANTS"] = read_summary_constants(path)
+        config["SUMMARY_ONLY"] = args.summary_only
+    else:
+        assert not args.summary_only, "--summary_only requires --summary_constants"
+    if args.telemetry:
+        config.update(
+            TELEMETRY=True,
+            TELEMETRY_FLUSH_EVERY=args.telemetry_flush,
+            TELEMETRY_LOG=args.telemetry_log,
+        )
+        if args.telemetry_flush and args.compile_cache:
+            print("--telemetry_flush uses a host callback; not flushing with --compile_cache")
+            config["TELEMETRY_FLUSH_EVERY"] = 0
+    if args.alg_switch:
+        # the variant is picked by the traced ALG_TYPE instead
+        config.update(variant_config("lambda_ac"), ALG_SWITCH=True)
+    if args.compile_cache:
+        # executables with host callbacks can neither be cached nor serialized
+        config["DEBUG"] = False
+    return config
+
+
+def aot_compile_experiment(args, rngs):
+    """Compile and serialize one executable per graph shape in the sweep JSON."""
+    with open(EXP_PATH, "r") as f:
+        exp = ExperimentDescription(json.load(f))
+    keys = SWITCH_GRAPH_KEYS if args.alg_switch else GRAPH_KEYS
+    for idx in graph_representatives(exp, keys):
+        hypers = exp.getPermutation(idx)["metaParameters"]
+        config = apply_run_args(build_config(hypers), args)
+        if args.sweep_slice:
+            traced = stack_hypers(
+                [config_hypers(hypers, args.alg_switch)] * args.config_batch
+            )
+        else:
+            traced = config_hypers(hypers, args.alg_switch)
+        fn = batched_train_fn(config, sweep=args.sweep_slice)
+        compile_aot(fn, (rngs, traced), args.compile_cache, "ppo_continuous_action", config)
+
+
+def save_outputs(file_context, out, summary_constants=None):
+    file_context.ensureExists()
+    if "diverged" in out:
+        # update at which each seed went non-finite, health.HEALTHY if never
+        jnp.save(file_context.resolve("diverged.npy"), out["diverged"])
+    if "summary" in out:
+        save_run_summary(
+            file_context.resolve("summary.json"),
+            summary_record(out["summary"], summary_constants, out.get("diverged")),
+        )
+    if "telemetry" in out:
+        np.savez(file_context.resolve("telemetry.npz"), **jax.device_get(out["telemetry"]))
+    if "episodes" in out:
+        path_episodes = file_context.resolve("episodes.npz")
+        print("saving file to: " + path_episodes)
+        save_episode_table(path_episodes, out["episodes"])
+        return
+
+    metrics = out["metrics"]
+    if metrics is None or "returned_episode_returns" not in metrics:
+        # --summary_only, possibly with --telemetry
+        return
+    path_returns = file_context.resolve("returns.npy")
+    path_timestep = file_context.resolve("timestep.npy")
+    path_lengths = file_context.resolve("lengths.npy")
+    path_completed = file_context.resolve("completed.npy")
+
+    print("saving file to: " + path_returns)
+
+    returns = metrics["returned_episode_returns"]
+    jnp.save(path_returns, returns)
+    timestep = metrics["timestep"]
+    jnp.save(path_timestep, timestep)
+    lengths = metrics["returned_episode_lengths"]
+    jnp.save(path_lengths, lengths)
+    completed_episodes = metrics["returned_episode"]
+    jnp.save(path_completed, completed_episodes)
+
+
+def run_sweep_index(run, exp, idx, rngs, config, args):
+    """Train sweep permutation ``idx`` and save its outputs to its save context."""
+    traced = config_hypers(exp.getPermutation(idx)["metaParameters"], args.alg_switch)
+    file_context = exp.buildSaveContext(idx)
+    checkpoint_dir = file_context.resolve("checkpoint")
+    if args.seed_batch:
+        writer = SeedBatchWriter(
+            file_context, args.num_seeds, key=checkpoint_key(config, rngs, traced)
+        )
+        train_seed_batches(run, rngs, traced, args.seed_batch, [writer], checkpoint_dir)
+        save_outputs(file_context, writer.outputs(), config["SUMMARY_CONSTANTS"])
+        # the dense files go last: they mark the run as complete
+        writer.close()
+    else:
+        out = run(rngs, traced, checkpoint_dir)
+        save_outputs(file_context, out, config["SUMMARY_CONSTANTS"])
+    clear_checkpoint(checkpoint_dir)
+
+
+def run_sweep_slice(run, exp, batch, num_valid, rngs, config, args):
+    """Train the permutations of ``batch`` under one compile and save each one.
+
+    ``run`` is a sweep train; the entries of ``batch`` past ``num_valid`` are
+    padding (see sweep.batched) and are not saved.
+    """
+    batch_hypers = stack_hypers(
+        [
+            config_hypers(exp.getPermutation(i)["metaParameters"], args.alg_switch)
+            for i in batch
+        ]
+    )
+    checkpoint_dir = exp.buildSaveContext(batch[0]).resolve("checkpoint_slice")
+    if args.seed_batch:
+        writers = [
+            SeedBatchWriter(
+                exp.buildSaveContext(idx),
+                args.num_seeds,
+                key=checkpoint_key(
+                    config,
+                    rngs,
+                    config_hypers(exp.getPermutation(idx)["metaParameters"], args.alg_switch),
+                ),
+            )
+            for idx in batch[:num_valid]
+        ]
+        train_seed_batches(
+            run, rngs, batch_hypers, args.seed_batch, writers, checkpoint_dir, sweep=True
+        )
+        for idx, writer in zip(batch, writers):
+            save_outputs(
+                exp.buildSaveContext(idx), writer.outputs(), config["SUMMARY_CONSTANTS"]
+            )
+        # the dense files go last: they mark the configs as complete
+        for writer in writers:
+            writer.close()
+    else:
+        out = run(rngs, batch_hypers, checkpoint_dir)
+        for j, idx in enumerate(batch[:num_valid]):
+            save_outputs(
+                exp.buildSaveContext(idx),
+                jax.tree_util.tree_map(lambda x: x[j], out),
+                config["SUMMARY_CONSTANTS"],
+            )
+    clear_checkpoint(checkpoint_dir)
+
+
+def build_parser():
+    """The command line of a training run; worker.py takes the same flags."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--sweep_idx", action="store", default=-1, type=int)
+    parser.add_argument("--num_seeds", action="store", default=1, type=int)
+    parser.add_argument("--start_seed", action="store", default=42, type=int)
+    parser.add_argument("--actor_lr", action="store", default=3e-4, type=float)
+    parser.add_argument("--critic_lr", action="store", default=3e-4, type=float)
+    parser.add_argument("--ent_coef", action="store", default=0.1, type=float)
+    parser.add_argument("--gae_lambda", action="store", default=0.9, type=float)
+    parser.add_argument("--env_name", action="store", default="swimmer", type=str)
+    parser.add_argument("--alg_type", action="store", default="lambda_ac", type=str)
+    # physics steps per agent step, and per episode (used without --sweep_idx)
+    parser.add_argument("--action_repeat", action="store", default=1, type=int)
+    parser.add_argument("--episode_length", action="store", default=1000, type=int)
+    # run every permutation sharing --sweep_idx's (alg_type, env_name) under one compile
+    parser.add_argument("--sweep_slice", action="store_true")
+    parser.add_argument("--config_batch", action="store", default=25, type=int)
+    # > 0 saves a compact table of finished episodes instead of dense per-step metrics
+    parser.add_argument("--episode_buffer", action="store", default=0, type=int)
+    # SORT: exact percentiles for the EMA advantage norms; STREAMING: sort-free estimate
+    parser.add_argument("--advn_stats", action="store", default="SORT", choices=["SORT", "STREAMING"])
+    # SCAN: sequential reverse scan; ASSOCIATIVE: parallel-in-time associative scan
+    parser.add_argument("--gae_method", action="store", default="SCAN", choices=["SCAN", "ASSOCIATIVE"])
+    # pass alg_type as a traced index so all variants share one compile; with
+    # --sweep_slice the slice then covers every alg_type of --sweep_idx's env
+    parser.add_argument("--alg_switch", action="store_true")
+    # > 0 runs this many updates per jitted call and checkpoints in between
+    parser.add_argument("--chunk_updates", action="store", default=0, type=int)
+    parser.add_argument("--checkpoint_dir", action="store", default="./checkpoint", type=str)
+    # drop lanes with non-finite params, losses or returns after each chunk and
+    # repack the survivors; dropped runs get NaN returns and a diverged.npy
+    parser.add_argument("--drop_diverged", action="store_true")
+    # quantile CSV (p5, p95 and thresholds such as p90; "{env}" is filled in)
+    # for the on-device AUC and step-to-threshold written to summary.json
+    parser.add_argument("--summary_constants", action="store", default=None, type=str)
+    # with --summary_constants, save only summary.json instead of the dense arrays
+    parser.add_argument("--summary_only", action="store_true")
+    # per-update losses, approx KL, clip fraction, grad norms and advantage
+    # stats, reduced on device and saved to telemetry.npz
+    parser.add_argument("--telemetry", action="store_true")
+    # > 0 also appends them to --telemetry_log every this many updates
+    parser.add_argument("--telemetry_flush", action="store", default=0, type=int)
+    parser.add_argument("--telemetry_log", action="store", default="./telemetry.jsonl", type=str)
+    # trace --profile_updates updates with the JAX profiler into this directory,
+    # write profile_summary.json and exit without training
+    parser.add_argument("--profile", action="store", default=None, type=str)
+    parser.add_argument("--profile_updates", action="store", default=20, type=int)
+    # on-disk compilation cache; also holds the --aot_compile executables
+    parser.add_argument("--compile_cache", action="store", default=None, type=str)
+    # compile every graph shape of the sweep JSON into --compile_cache and exit
+    parser.add_argument("--aot_compile", "--aot-compile", action="store_true")
+    # > 1 splits the host CPU into this many XLA devices and shards the seeds
+    # (or, with --sweep_slice, the configs) across them
+    parser.add_argument("--num_devices", action="store", default=1, type=int)
+    # Brax pipeline (positional, generalized, spring, mjx), or a JSON table of
+    # env -> pipeline as written by bench_envs.py; defaults to wrappers.default_backend
+    parser.add_argument("--backend", action="store", default=None, type=str)
+    # > 0 auto-resets each env to one of a per-seed pool of this many reset
+    # states (wrappers.ResetPoolWrapper) instead of always its first one
+    parser.add_argument("--reset_pool", action="store", default=0, type=int)
+    # > 0 trains the seeds this many at a time and writes each batch's results
+    # as it finishes, bounding memory for large --num_seeds (see seed_batches.py)
+    parser.add_argument("--seed_batch", action="store", default=0, type=int)
+    return parser
+
+
+if __name__ == "__main__":
+
+    args = build_parser().parse_args()
+
+    if args.compile_cache:
+        enable_compilation_cache(args.compile_cache)
+
+    if args.aot_compile:
+        assert args.compile_cache, "--aot_compile requires --compile_cache"
+        rngs = jax.random.split(jax.random.PRNGKey(args.start_seed), args.num_seeds)
+        aot_compile_experiment(args, rngs)
+        raise SystemExit(0)
+
+    if args.sweep_idx == -1:
+        assert not args.sweep_slice, "--sweep_slice requires --sweep_idx"
+        hypers = dict(
+            alg_type=args.alg_type,
+            env_name=args.env_name,
+            gae_lambda=args.gae_lambda,
+            ent_coef=args.ent_coef,
+            actor_lr=args.actor_lr,
+            critic_lr=args.critic_lr,
+            action_repeat=args.action_repeat,
+            episode_length=args.episode_length,
+        )
+    else:
+        with open(EXP_PATH, "r") as f:
+            d = json.load(f)
+        exp = ExperimentDescription(d)
+        hypers = exp.getPermutation(args.sweep_idx)["metaParameters"]
+
+    config = apply_run_args(build_config(hypers), args)
 
     rng = jax.random.PRNGKey(args.start_seed)
     rngs = jax.random.split(rng, args.num_seeds)
 
-    train = make_train(config)
-    train_jit = jax.jit(jax.vmap(train))
-    out = train_jit(rngs)
+    if args.profile:
+        profile_train(
+            batched_train_fn,
+            config,
+            (rngs, config_hypers(hypers, args.alg_switch)),
+            args.profile,
+            args.profile_updates,
+        )
+        raise SystemExit(0)
 
-    if args.sweep_idx == -1:
-        returns = out["metrics"]["returned_episode_returns"]
-        jnp.save("./returns.npy", returns)
-        # np.savez_compressed("./returns_compressed.npz", returns=returns)
+    run = make_batched_train(
+        config,
+        sweep=args.sweep_slice,
+        chunk_updates=args.chunk_updates,
+        cache_dir=args.compile_cache,
+    )
 
+    if args.sweep_slice:
+        keys = SWITCH_GRAPH_KEYS if args.alg_switch else GRAPH_KEYS
+        indices = slice_indices(exp, args.sweep_idx, keys)
+        for batch, num_valid in batched(indices, args.config_batch):
+            run_sweep_slice(run, exp, batch, num_valid, rngs, config, args)
+    elif args.sweep_idx != -1:
+        run_sweep_index(run, exp, args.sweep_idx, rngs, config, args)
+    elif args.seed_batch:
+        # local runs write the same files as a sweep run, to the working directory
+        traced = config_hypers(hypers, args.alg_switch)
+        writer = SeedBatchWriter(
+            FileSystemContext("."), args.num_seeds, key=checkpoint_key(config, rngs, traced)
+        )
+        train_seed_batches(run, rngs, traced, args.seed_batch, [writer], args.checkpoint_dir)
+        save_outputs(FileSystemContext("."), writer.outputs(), config["SUMMARY_CONSTANTS"])
+        writer.close()
+        clear_checkpoint(args.checkpoint_dir)
     else:
-        file_context = exp.buildSaveContext(args.sweep_idx)
-        file_context.ensureExists()
-        path_returns = file_context.resolve("returns.npy")
-        path_timestep = file_context.resolve("timestep.npy")
-        path_lengths = file_context.resolve("lengths.npy")
-        path_completed = file_context.resolve("completed.npy")
-
-        print("saving file to: " + path_returns)
-
-        returns = out["metrics"]["returned_episode_returns"]
-        jnp.save(path_returns, returns)
-        timestep = out["metrics"]["timestep"]
-        jnp.save(path_timestep, timestep)
-        lengths = out["metrics"]["returned_episode_lengths"]
-        jnp.save(path_lengths, lengths)
-        completed_episodes = out["metrics"]["returned_episode"]
-        jnp.save(path_completed, completed_episodes)
\ No newline at end of file
+        out = run(rngs, config_hypers(hypers, args.alg_switch), args.checkpoint_dir)
+
+        if "episodes" in out:
+            save_episode_table("./episodes.npz", out["episodes"])
+        elif out["metrics"] is not None and "returned_episode_returns" in out["metrics"]:
+            returns = out["metrics"]["returned_episode_returns"]
+            jnp.save("./returns.npy", returns)
+            # np.savez_compressed("./returns_compressed.npz", returns=returns)
+        if "diverged" in out:
+            jnp.save("./diverged.npy", out["diverged"])
+        if "telemetry" in out:
+            np.savez("./telemetry.npz", **jax.device_get(out["telemetry"]))
+        if "summary" in out:
+            save_run_summary(
+                "./summary.json",
+                summary_record(
+                    out["summary"], config["SUMMARY_CONSTANTS"], out.get("diverged")
+                ),
+            )
+        clear_checkpoint(args.checkpoint_dir)
@@ -0,0 +1,102 @@
+import json
+import os
+import time
+import jax
+import jax.numpy as jnp
+
+# named scopes of one update (see _update_step), in the order they run; they
+# group the ops of each phase in the trace viewer
+PHASES = ("env_rollout", "gae", "advantage_stats", "update_epochs")
+
+SUMMARY_FILE = "profile_summary.json"
+
+
+def phase_output(*outputs):
+    """Metrics of an update cut short by STOP_AFTER_PHASE.
+
+    A single sum over the phase's outputs, so the phase is not optimized away
+    but no large arrays are stacked across updates.
+    """
+    leaves = jax.tree_util.tree_leaves(outputs)
+    return {"phase_output": sum(jnp.sum(jnp.asarray(x, jnp.float32)) for x in leaves)}
+
+
+def _compile_and_time(make_fn, config, args):
+    """Compile ``make_fn(config)`` for ``args`` and time one warmed-up run."""
+    start = time.perf_counter()
+    train = jax.jit(make_fn(config)).lower(*args).compile()
+    compile_s = time.perf_counter() - start
+    jax.block_until_ready(train(*args))
+    start = time.perf_counter()
+    jax.block_until_ready(train(*args))
+    return train, compile_s, time.perf_counter() - start
+
+
+def profile_train(make_fn, config, args, profile_dir, num_updates):
+    """Compile and trace a short run of ``make_fn(config)(*args)``, and time its phases.
+
+    The run is shortened to ``num_updates`` updates. It is compiled, run once
+    to warm up, timed, and run again under the JAX profiler, which writes a
+    TensorBoard/Perfetto trace to ``profile_dir``. On GPU the kernels of each
+    phase carry the PHASES scopes in their names; the CPU backend only records
+    its thunks. The per-phase times are therefore measured directly: the train
+    is also compiled with each update cut short after each phase
+    (STOP_AFTER_PHASE), and a phase's time per update is the difference
+    between the run ending after it and the run ending before it. The compile
+    time, steady-state time per update, env steps/s and the ms/update of each
+    phase are written to ``profile_summary.json`` next to the trace and
+    returned.
+    """
+    config = dict(config)
+    steps_per_update = (
+        config["NUM_STEPS"] * config["NUM_ENVS"] * config.get("ACTION_REPEAT", 1)
+    )
+    config["TOTAL_TIMESTEPS"] = num_updates * steps_per_update
+    # host callbacks would show up as (and stall on) file IO
+    config["DEBUG"] = False
+    num_lanes = args[0].shape[0]
+
+    train, compile_s, run_s = _compile_and_time(make_fn, config, args)
+
+    os.makedirs(profile_dir, exist_ok=True)
+    jax.profiler.start_trace(profile_dir, create_perfetto_trace=True)
+    jax.block_until_ready(train(*args))
+    jax.profiler.stop_trace()
+
+    # the telemetry reads the metrics of complete updates
+    truncated = dict(config, TELEMETRY=False, TELEMETRY_FLUSH_EVERY=0)
+    phase_ms = {}
+    previous_s = 0.0
+    for phase in PHASES:
+        if phase == PHASES[-1]:
+            phase_s = run_s
+        else:
+            _, _, phase_s = _compile_and_time(
+                make_fn, dict(truncated, STOP_AFTER_PHASE=phase), args
+            )
+        # timing noise can make a cheap phase come out slightly negative
+        phase_ms[phase] = max(phase_s - previous_s, 0.0) / num_updates * 1e3
+        previous_s = phase_s
+
+    env_steps = num_updates * steps_per_update * num_lanes
+    summary = {
+        "env_name": config["ENV_NAME"],
+        "num_envs": config["NUM_ENVS"],
+        "num_steps": config["NUM_STEPS"],
+        "num_minibatches": config["NUM_MINIBATCHES"],
+        "update_epochs": config["UPDATE_EPOCHS"],
+        "num_lanes": num_lanes,
+        "profiled_updates": num_updates,
+        "compile_s": compile_s,
+        "ms_per_update": run_s / num_updates * 1e3,
+        "env_steps_per_s": env_steps / run_s,
+        "phase_ms_per_update": phase_ms,
+    }
+    with open(os.path.join(profile_dir, SUMMARY_FILE), "w") as f:
+        json.dump(summary, f, indent=2)
+    print(
+        f"compile {compile_s:.1f} s, {summary['ms_per_update']:.2f} ms/update, "
+        f"{summary['env_steps_per_s']:.0f} env steps/s; trace in {profile_dir}"
+    )
+    print(", ".join(f"{phase} {ms:.2f} ms" for phase, ms in phase_ms.items()))
+    return summary
@@ -0,0 +1,100 @@
+import csv
+import json
+import jax
+import jax.numpy as jnp
+import numpy as np
+from flax import struct
+
+# step_to_* value of thresholds that were never crossed
+NOT_REACHED = -1
+
+
+@struct.dataclass
+class RunSummary:
+    """Running AUC and step-to-threshold of one run, kept on device.
+
+    ``auc`` is the sum of (return - p5) / (p95 - p5) over finished episodes, as
+    in sec5's calculate_new_auc_from_rewards_csv but without the truncation to
+    a common length (which needs every run). ``step_to`` holds, per threshold,
+    the global step (env steps across all envs, as in the episode table) of the
+    first finished episode whose return reached it.
+    """
+
+    auc: jnp.ndarray
+    episodes: jnp.ndarray
+    step_to: jnp.ndarray
+
+
+def read_summary_constants(path):
+    """Per-env constants from a quantile CSV with p5, p95 and threshold columns.
+
+    Both sec5's ``reward_quantiles_{env}.csv`` (p5, p90, p95) and
+    ``global_quantiles_{env}.csv`` work. Every p* column except p5 becomes a
+    threshold.
+    """
+    with open(path) as f:
+        row = next(csv.DictReader(f))
+    thresholds = {
+        name: float(value)
+        for name, value in row.items()
+        if name.startswith("p") and name != "p5"
+    }
+    return {"p5": float(row["p5"]), "p95": float(row["p95"]), "thresholds": thresholds}
+
+
+def init_run_summary(constants):
+    return RunSummary(
+        auc=jnp.zeros((), dtype=jnp.float32),
+        episodes=jnp.zeros((), dtype=jnp.int32),
+        step_to=jnp.full((len(constants["thresholds"]),), NOT_REACHED, dtype=jnp.int32),
+    )
+
+
+def update_run_summary(summary, info, constants, num_envs):
+    """Accumulate the episodes finished during one rollout.
+
+    ``info`` is the LogWrapper info of a rollout with shape [NUM_STEPS, NUM_ENVS].
+    """
+    done = info["returned_episode"]
+    returns = info["returned_episode_returns"]
+    norm = (returns - constants["p5"]) / (constants["p95"] - constants["p5"])
+    global_step = (info["timestep"] * num_envs).astype(jnp.int32)
+
+    thresholds = jnp.asarray(list(constants["thresholds"].values()), dtype=jnp.float32)
+    crossed = done[None] & (returns[None] >= thresholds.reshape(-1, 1, 1))
+    first = jnp.where(crossed, global_step[None], jnp.iinfo(jnp.int32).max).min(axis=(1, 2))
+    step_to = jnp.where(
+        (summary.step_to == NOT_REACHED) & crossed.any(axis=(1, 2)), first, summary.step_to
+    )
+    return summary.replace(
+        auc=summary.auc + jnp.where(done, norm, 0.0).sum(),
+        episodes=summary.episodes + done.sum(dtype=jnp.int32),
+        step_to=step_to,
+    )
+
+
+def summary_record(summary, constants, diverged=None):
+    """JSON-ready record of a run's (per-seed) summaries."""
+    summary = jax.device_get(summary)
+    episodes = np.asarray(summary.episodes)
+    record = {
+        "p5": constants["p5"],
+        "p95": constants["p95"],
+        "auc": np.asarray(summary.auc).tolist(),
+        "episodes": episodes.tolist(),
+        "mean_normalized_return": (
+            np.asarray(summary.auc) / np.maximum(episodes, 1)
+        ).tolist(),
+    }
+    step_to = np.asarray(summary.step_to)
+    for i, (name, value) in enumerate(constants["thresholds"].items()):
+        record[f"{name}_threshold"] = value
+        record[f"step_to_{name}"] = step_to[..., i].tolist()
+    if diverged is not None:
+        record["diverged"] = np.asarray(diverged).tolist()
+    return record
+
+
+def save_run_summary(path, record):
+    with open(path, "w") as f:
+        json.dump(record, f, indent=2)
@@ -0,0 +1,180 @@
+"""Train many seeds a bounded number at a time.
+
+The seed vmap keeps the train state and the stacked metrics of every seed in
+memory at once. Instead, the seeds can run ``batch_size`` at a time through one
+compiled train; a short last batch is padded with repeats of its seeds, so every
+batch has the same shape and nothing recompiles. Peak memory is then that of
+``batch_size`` seeds. As each batch finishes, its dense metrics are written
+into memory-mapped ``*.partial.npy`` files and its small extras (diverged,
+summary, telemetry, episode tables) to a ``*.partial.msgpack`` file, which
+marks the batch as done: a restarted run skips it. The extras are saved with
+save_outputs, and only then are the partial files renamed to the usual
+returns/timestep/lengths/completed.npy, so a run only looks complete when all
+of its files are there.
+"""
+import glob
+import os
+import numpy as np
+import jax
+from flax import serialization
+
+# file name -> metric, as written by save_outputs
+DENSE_METRICS = {
+    "returns": "returned_episode_returns",
+    "timestep": "timestep",
+    "lengths": "returned_episode_lengths",
+    "completed": "returned_episode",
+}
+
+PARTIAL_SUFFIX = ".partial.npy"
+EXTRAS_SUFFIX = ".partial.msgpack"
+
+
+def seed_batches(num_seeds, batch_size):
+    """``(start, stop)`` of each batch of seeds."""
+    return [
+        (start, min(start + batch_size, num_seeds))
+        for start in range(0, num_seeds, batch_size)
+    ]
+
+
+class SeedBatchWriter:
+    """Collects the outputs of one run's seed batches in its save context.
+
+    ``key`` (see checkpoint.checkpoint_key) identifies the run; batches an
+    earlier attempt wrote under another key are trained again.
+    """
+
+    def __init__(self, file_context, num_seeds, key=None):
+        self.file_context = file_context
+        self.num_seeds = num_seeds
+        self.key = key
+        self.arrays = {}
+        # start -> extras of the batches written by this process
+        self.extras = {}
+        # start -> extras state dict of the batches an earlier attempt finished
+        self.restored = {}
+
+    def _extras_path(self, start, stop):
+        return self.file_context.resolve(f"extras_{start:05d}_{stop:05d}{EXTRAS_SUFFIX}")
+
+    def _array(self, name, batch):
+        if name not in self.arrays:
+            self.file_context.ensureExists()
+            path = self.file_context.resolve(name + PARTIAL_SUFFIX)
+            shape = (self.num_seeds,) + batch.shape[1:]
+            array = None
+            if os.path.exists(path):
+                # keep the seeds an earlier attempt wrote
+                array = np.lib.format.open_memmap(path, mode="r+")
+                if array.shape != shape or array.dtype != batch.dtype:
+                    array = None
+            if array is None:
+                array = np.lib.format.open_memmap(
+                    path, mode="w+", dtype=batch.dtype, shape=shape
+                )
+            self.arrays[name] = array
+        return self.arrays[name]
+
+    def finished(self, start, stop):
+        """Whether an earlier attempt of this run wrote seeds [start, stop)."""
+        if start in self.restored:
+            return True
+        path = self._extras_path(start, stop)
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as f:
+            state = serialization.msgpack_restore(f.read())
+        if state.get("key") != self.key:
+            return False
+        self.restored[start] = state["extras"]
+        return True
+
+    def write(self, start, stop, out):
+        """Store the outputs of seeds [start, stop); ``out`` has a leading seed axis."""
+        out = jax.device_get(
+            {key: value for key, value in out.items() if key != "runner_state"}
+        )
+        out = jax.tree_util.tree_map(lambda x: x[: stop - start], out)
+        metrics = out.pop("metrics")
+        if metrics is not None and DENSE_METRICS["returns"] in metrics:
+            for name, key in DENSE_METRICS.items():
+                array = self._array(name, metrics[key])
+                array[start:stop] = metrics[key]
+                array.flush()
+        # written after the dense rows, so it marks the batch as done
+        state = {"extras": serialization.to_state_dict(out)}
+        if self.key is not None:
+            state["key"] = self.key
+        path = self._extras_path(start, stop)
+        with open(path + ".tmp", "wb") as f:
+            f.write(serialization.msgpack_serialize(state))
+        os.replace(path + ".tmp", path)
+        self.restored.pop(start, None)
+        self.extras[start] = out
+
+    def outputs(self):
+        """The extras of all batches as one output dict, for save_outputs.
+
+        save_outputs skips the dense metrics; they are moved into place by
+        ``close`` afterwards. Needs at least one batch written by this process,
+        whose extras give the structure of the restored ones.
+        """
+        template = next(iter(self.extras.values()))
+        extras = [
+            self.extras[start]
+            if start in self.extras
+            else serialization.from_state_dict(template, self.restored[start])
+            for start in sorted({*self.extras, *self.restored})
+        ]
+        extras = jax.tree_util.tree_map(lambda *xs: np.concatenate(xs), *extras)
+        return dict(extras, metrics=None)
+
+    def close(self):
+        """Move the dense arrays into place, which completes the run; call after save_outputs."""
+        for name in DENSE_METRICS:
+            path = self.file_context.resolve(name + PARTIAL_SUFFIX)
+            if name in self.arrays:
+                self.arrays[name].flush()
+            if os.path.exists(path):
+                os.replace(path, self.file_context.resolve(name + ".npy"))
+        self.arrays = {}
+        for path in glob.glob(self.file_context.resolve("extras_*" + EXTRAS_SUFFIX)):
+            os.remove(path)
+
+
+def train_seed_batches(
+    run, rngs, hypers, batch_size, writers, checkpoint_dir=None, sweep=False
+):
+    """``run(rngs, hypers, checkpoint_dir)`` on batches of ``batch_size`` seeds.
+
+    ``writers`` holds one SeedBatchWriter per run: a single one, or with
+    ``sweep`` one per leading config of the outputs (padding configs at the
+    end may be left out). With chunked updates each batch checkpoints to its
+    own subdirectory of ``checkpoint_dir``. Batches that every writer
+    already finished in an earlier attempt are skipped.
+    """
+    num_seeds = rngs.shape[0]
+    batch_size = min(batch_size, num_seeds)
+    batches = seed_batches(num_seeds, batch_size)
+    # batches an earlier attempt finished are skipped; if all of them are, the
+    # last one is trained again, as SeedBatchWriter.outputs needs a fresh batch
+    todo = [
+        (start, stop)
+        for start, stop in batches
+        if not all(writer.finished(start, stop) for writer in writers)
+    ] or batches[-1:]
+    for start, stop in batches:
+        if (start, stop) not in todo:
+            print(f"seeds {start}-{stop - 1} of {num_seeds} already done")
+            continue
+        batch_rngs = np.resize(np.asarray(rngs[start:stop]), (batch_size,) + rngs.shape[1:])
+        batch_dir = None
+        if checkpoint_dir is not None:
+            batch_dir = os.path.join(checkpoint_dir, f"seeds_{start:05d}")
+        out = run(batch_rngs, hypers, batch_dir)
+        for j, writer in enumerate(writers):
+            writer.write(
+                start, stop, jax.tree_util.tree_map(lambda x: x[j], out) if sweep else out
+            )
+        print(f"seeds {start}-{stop - 1} of {num_seeds} done")
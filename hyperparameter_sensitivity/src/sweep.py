@@ -0,0 +1,113 @@
+import numpy as np
+import jax
+import jax.numpy as jnp
+
+from variants import alg_index
+
+# Sweep-JSON names of the hyperparameters that only change scalar values in
+# the training graph, mapped to the config keys read by ``train``. These are
+# passed to ``train`` as traced arrays so one executable serves the whole grid.
+HYPER_KEYS = {
+    "actor_lr": "ACTOR_LR",
+    "critic_lr": "CRITIC_LR",
+    "ent_coef": "ENT_COEF",
+    "gae_lambda": "GAE_LAMBDA",
+}
+
+# Traced index of the algorithm variant (see variants.ALG_TYPES). With
+# ALG_SWITCH, alg_type is passed to ``train`` like the numeric hyperparameters.
+ALG_KEY = "ALG_TYPE"
+
+# Sweep-JSON names that change the traced graph and therefore the compile.
+# action_repeat and episode_length are optional in the sweep JSON.
+GRAPH_KEYS = ("alg_type", "env_name", "action_repeat", "episode_length")
+SWITCH_GRAPH_KEYS = ("env_name", "action_repeat", "episode_length")
+
+
+def config_hypers(hypers, alg_switch=False):
+    """Pick the traced hyperparameters out of a sweep permutation."""
+    traced = {key: float(hypers[name]) for name, key in HYPER_KEYS.items()}
+    if alg_switch:
+        traced[ALG_KEY] = float(alg_index(hypers["alg_type"]))
+    return traced
+
+
+def stack_hypers(hypers_list):
+    """Stack several ``config_hypers`` dicts into one batch of arrays."""
+    return {
+        key: jnp.asarray([h[key] for h in hypers_list], dtype=jnp.float32)
+        for key in hypers_list[0]
+    }
+
+
+def slice_indices(exp, sweep_idx, keys=GRAPH_KEYS):
+    """All sweep indices sharing the graph-defining values of ``sweep_idx``."""
+    ref = exp.getPermutation(sweep_idx)["metaParameters"]
+    indices = []
+    for idx in range(exp.numPermutations()):
+        hypers = exp.getPermutation(idx)["metaParameters"]
+        if all(hypers.get(k) == ref.get(k) for k in keys):
+            indices.append(idx)
+    return indices
+
+
+def batched(indices, batch_size):
+    """Split ``indices`` into equal batches, padding the last one.
+
+    Every batch has exactly ``batch_size`` entries so all of them reuse the
+    same compiled executable. Yields ``(batch, num_valid)``; padded entries
+    repeat the last index and their outputs should be discarded.
+    """
+    for start in range(0, len(indices), batch_size):
+        batch = list(indices[start : start + batch_size])
+        num_valid = len(batch)
+        batch += [batch[-1]] * (batch_size - num_valid)
+        yield batch, num_valid
+
+
+# files a finished run leaves in its save context (see save_outputs)
+COMPLETE_FILES = ("returns.npy", "completed.npy")
+
+
+def is_complete(file_context):
+    """Whether a sweep permutation's dense outputs have been saved."""
+    return all(file_context.exists(name) for name in COMPLETE_FILES)
+
+
+def lane_id(rng, hypers):
+    """Id of a lane: the rng of its seed folded with its traced hyperparameters.
+
+    Seeds that share a config, and configs that share a seed, get different
+    ids, so the host callbacks can tell the lanes of a vmapped train apart.
+    """
+    key = rng
+    for name in sorted(hypers):
+        value = jnp.asarray(hypers[name], dtype=jnp.float32)
+        key = jax.random.fold_in(key, jax.lax.bitcast_convert_type(value, jnp.uint32))
+    return key
+
+
+def pack_lane_id(key):
+    """A lane id (or an array of them) as the uint64 written to the logs."""
+    key = np.asarray(key).astype(np.uint64)
+    return (key[..., 0] << np.uint64(32)) | key[..., 1]
+
+
+def lane_ids(rngs, hypers):
+    """The packed lane ids of the seeds ``rngs`` run with one ``hypers``.
+
+    ``lane_ids(rngs, hypers).tolist().index(lane)`` is the seed index of a
+    logged lane.
+    """
+    return pack_lane_id(jax.vmap(lane_id, in_axes=(0, None))(rngs, hypers))
+
+
+def make_sweep_train(train):
+    """Vmap ``train(rng, hypers)`` over a batch of configurations x seeds.
+
+    The returned function takes ``rngs`` of shape [seeds, 2] and a dict of
+    hyperparameter arrays of shape [configs] and returns outputs with leading
+    axes [configs, seeds].
+    """
+    over_seeds = jax.vmap(train, in_axes=(0, None))
+    return jax.vmap(over_seeds, in_axes=(None, 0))
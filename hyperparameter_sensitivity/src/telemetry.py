@@ -0,0 +1,114 @@
+import atexit
+import json
+import queue
+import threading
+import numpy as np
+import jax
+import jax.numpy as jnp
+import optax
+
+from sweep import pack_lane_id
+
+# per-update diagnostics added to the metrics with TELEMETRY
+TELEMETRY_KEYS = (
+    "actor_loss",
+    "critic_loss",
+    "entropy",
+    "approx_kl",
+    "clip_fraction",
+    "actor_grad_norm",
+    "critic_grad_norm",
+    "advantage_mean",
+    "advantage_std",
+    "advantage_min",
+    "advantage_max",
+)
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def policy_diagnostics(log_ratio, clip_eps):
+    """Approximate KL (the k3 estimator) and clip fraction of one minibatch."""
+    ratio = jnp.exp(log_ratio)
+    return {
+        "approx_kl": ((ratio - 1.0) - log_ratio).mean(),
+        "clip_fraction": (jnp.abs(ratio - 1.0) > clip_eps).mean(),
+    }
+
+
+def grad_norms(actor_grads, critic_grads):
+    """Global norms of the gradients, before clipping."""
+    return {
+        "actor_grad_norm": optax.global_norm(actor_grads),
+        "critic_grad_norm": optax.global_norm(critic_grads),
+    }
+
+
+def advantage_diagnostics(advantages):
+    """Statistics of the raw (unnormalized) advantages of a rollout."""
+    return {
+        "advantage_mean": advantages.mean(),
+        "advantage_std": advantages.std(),
+        "advantage_min": advantages.min(),
+        "advantage_max": advantages.max(),
+    }
+
+
+def reduce_minibatches(diagnostics):
+    """Average the [UPDATE_EPOCHS, NUM_MINIBATCHES] diagnostics of one update."""
+    return jax.tree_util.tree_map(jnp.mean, diagnostics)
+
+
+class TelemetryWriter:
+    """Appends telemetry blocks to a JSON-lines file from a background thread.
+
+    ``push`` is the target of ``jax.debug.callback`` and is called once per
+    lane and block of TELEMETRY_FLUSH_EVERY updates. Under vmap the lanes
+    arrive in no particular order, so every line carries the lane's id
+    (sweep.lane_id, packed; sweep.lane_ids maps it to a seed index), its
+    traced hyperparameters and the index of the block's last update.
+    """
+
+    def __init__(self, path, max_queue=256):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._file = open(path, "a")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def push(self, lane, hypers, update, telemetry):
+        record = {"lane": int(pack_lane_id(lane))}
+        record.update({key: float(np.asarray(value)) for key, value in hypers.items()})
+        record["update"] = int(update)
+        for key, values in telemetry.items():
+            record[key] = np.asarray(values, dtype=np.float64).tolist()
+        self._queue.put(record)
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+        self._file.close()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+def get_telemetry_writer(path):
+    """Process-wide writer for ``path``, flushed and closed at exit."""
+    with _writers_lock:
+        if path not in _writers:
+            writer = TelemetryWriter(path)
+            atexit.register(writer.close)
+            _writers[path] = writer
+        return _writers[path]
+
+
+def read_telemetry_log(path):
+    """The records of a telemetry log; group them by ``lane`` for per-seed series."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,75 @@
+import jax.numpy as jnp
+
+from advantage import ADVN_NORMS, EMA_ADVN_NORMS
+
+# alg_type values of the sweep JSON, in the order of their traced index
+ALG_TYPES = (
+    "lambda_ac",
+    "advn_norm_ema",
+    "advn_norm_max_ema",
+    "advn_norm_mean",
+    "symlog_critic_targets",
+    "symlog_obs",
+    "norm_obs",
+)
+
+# config flags set by variant_config
+VARIANT_KEYS = ("ADVN_NORM", "SYMLOG_CRITIC_TARGETS", "SYMLOG_OBS", "NORMALIZE_OBS")
+
+
+def variant_config(alg_type):
+    """Config flags selecting the algorithm variant ``alg_type``."""
+    config = {
+        "ADVN_NORM": "OFF",
+        "SYMLOG_CRITIC_TARGETS": False,
+        "SYMLOG_OBS": False,
+        "NORMALIZE_OBS": False,
+    }
+    if alg_type == "advn_norm_ema":
+        config["ADVN_NORM"] = "EMA_PERC"
+    elif alg_type == "advn_norm_max_ema":
+        config["ADVN_NORM"] = "MAX_EMA_PERC"
+    elif alg_type == "advn_norm_mean":
+        config["ADVN_NORM"] = "MEAN"
+    elif alg_type == "symlog_critic_targets":
+        config["SYMLOG_CRITIC_TARGETS"] = True
+    elif alg_type == "symlog_obs":
+        config["SYMLOG_OBS"] = True
+    elif alg_type == "norm_obs":
+        config["NORMALIZE_OBS"] = True
+    return config
+
+
+def alg_index(alg_type):
+    return ALG_TYPES.index(alg_type)
+
+
+def traced_variant(alg_idx):
+    """Variant flags of a traced ``alg_type`` index.
+
+    ``ADVN_NORM`` becomes an index into advantage.ADVN_NORMS and the other
+    flags boolean arrays, so a batch of runs can mix variants.
+    """
+    alg_idx = jnp.asarray(alg_idx).astype(jnp.int32)
+    table = [variant_config(alg_type) for alg_type in ALG_TYPES]
+    flags = {
+        key: jnp.asarray([config[key] for config in table])[alg_idx]
+        for key in VARIANT_KEYS
+        if key != "ADVN_NORM"
+    }
+    flags["ADVN_NORM"] = jnp.asarray(
+        [ADVN_NORMS.index(config["ADVN_NORM"]) for config in table]
+    )[alg_idx]
+    return flags
+
+
+def apply_if(flag, fn, x):
+    """``fn(x)`` if ``flag`` (a Python or traced bool) is set, else ``x``."""
+    if isinstance(flag, bool):
+        return fn(x) if flag else x
+    return jnp.where(flag, fn(x), x)
+
+
+def uses_advn_stats(advn_norm):
+    """Whether the ADVN_NORM mode (a name or traced index) reads advn_stats."""
+    return not isinstance(advn_norm, str) or advn_norm in EMA_ADVN_NORMS
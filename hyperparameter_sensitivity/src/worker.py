@@ -0,0 +1,166 @@
+"""Long-lived worker that trains a queue of sweep indices.
+
+Every ``ppo_continuous_action.py --sweep_idx`` run pays for the Python, JAX and
+Brax imports, the Brax env construction and the tracing of its train. The
+worker pays for them once per graph shape. It groups its indices by the
+graph-defining values (sweep.GRAPH_KEYS, or SWITCH_GRAPH_KEYS with
+--alg_switch) and keeps one env stack and jitted train per group, so the
+indices of a group run back to back. Outputs go to the same
+ExperimentDescription.buildSaveContext paths as --sweep_idx runs. Indices whose
+returns.npy and completed.npy already exist are skipped. With --sweep_slice the
+indices of a group run --config_batch at a time under one vmap.
+
+--queue is a text file of sweep indices, separated by whitespace or commas, or
+a directory of such files named ``*.queue``. A worker claims a queue file by
+renaming it to ``*.queue.<host>-<pid>``, which only one worker can do, and
+renames it to ``*.done`` once all its indices are saved, so several workers can
+share a directory. Files of a worker that died keep the claimed name; rename
+them back to ``*.queue`` to requeue them. With --poll SECONDS the worker waits
+for new queue files instead of exiting once the directory is empty. All other
+flags are those of ppo_continuous_action.py.
+
+python worker.py --queue ../queue --num_seeds 5 --compile_cache ../compile_cache
+"""
+import functools
+import json
+import os
+import socket
+import time
+
+if __name__ == "__main__":
+    # before gymnax (imported by ppo_continuous_action) initialises the backend
+    from devices import set_host_device_count_from_argv
+
+    set_host_device_count_from_argv()
+
+import jax
+from PyExpUtils.models.ExperimentDescription import ExperimentDescription
+
+from ppo_continuous_action import (
+    EXP_PATH,
+    build_config,
+    build_parser,
+    apply_run_args,
+    make_batched_train,
+    run_sweep_index,
+    run_sweep_slice,
+)
+from sweep import GRAPH_KEYS, SWITCH_GRAPH_KEYS, batched, is_complete
+from compile_cache import enable_compilation_cache
+
+QUEUE_SUFFIX = ".queue"
+DONE_SUFFIX = ".done"
+
+
+def parse_indices(text):
+    return [int(token) for token in text.replace(",", " ").split()]
+
+
+def claim_queue_file(directory):
+    """Claim the first pending queue file of ``directory``; None if there is none."""
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(QUEUE_SUFFIX):
+            continue
+        path = os.path.join(directory, name)
+        claimed = f"{path}.{socket.gethostname()}-{os.getpid()}"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:  # claimed by another worker first
+            continue
+        return claimed
+    return None
+
+
+def read_queue(queue, poll=0):
+    """Yield ``(indices, finish)`` for a queue file or each file claimed from a directory.
+
+    ``finish()`` marks the claimed file as done.
+    """
+    if not os.path.isdir(queue):
+        with open(queue) as f:
+            yield parse_indices(f.read()), lambda: None
+        return
+    while True:
+        claimed = claim_queue_file(queue)
+        if claimed is None:
+            if not poll:
+                return
+            time.sleep(poll)
+            continue
+        with open(claimed) as f:
+            indices = parse_indices(f.read())
+        done = claimed[: claimed.rindex(QUEUE_SUFFIX)] + DONE_SUFFIX
+        yield indices, functools.partial(os.replace, claimed, done)
+
+
+class Worker:
+    """Trains sweep indices, keeping one compiled train per graph shape."""
+
+    def __init__(self, exp, args):
+        self.exp = exp
+        self.args = args
+        self.keys = SWITCH_GRAPH_KEYS if args.alg_switch else GRAPH_KEYS
+        self.rngs = jax.random.split(jax.random.PRNGKey(args.start_seed), args.num_seeds)
+        # graph key -> (config, run); the env stack lives in run's closure
+        self.runs = {}
+
+    def _hypers(self, idx):
+        return self.exp.getPermutation(idx)["metaParameters"]
+
+    def _get_run(self, key, hypers):
+        if key not in self.runs:
+            config = apply_run_args(build_config(hypers), self.args)
+            run = make_batched_train(
+                config,
+                sweep=self.args.sweep_slice,
+                chunk_updates=self.args.chunk_updates,
+                cache_dir=self.args.compile_cache,
+            )
+            self.runs[key] = (config, run)
+        return self.runs[key]
+
+    def process(self, indices):
+        """Train and save ``indices``, one graph shape after another."""
+        groups = {}
+        for idx in indices:
+            if is_complete(self.exp.buildSaveContext(idx)):
+                print(f"skipping {idx}: already complete")
+                continue
+            hypers = self._hypers(idx)
+            groups.setdefault(tuple(hypers.get(k) for k in self.keys), []).append(idx)
+
+        for key, group in groups.items():
+            config, run = self._get_run(key, self._hypers(group[0]))
+            start = time.perf_counter()
+            if self.args.sweep_slice:
+                for batch, num_valid in batched(group, self.args.config_batch):
+                    run_sweep_slice(
+                        run, self.exp, batch, num_valid, self.rngs, config, self.args
+                    )
+            else:
+                for idx in group:
+                    run_sweep_index(run, self.exp, idx, self.rngs, config, self.args)
+            print(
+                f"{len(group)} indices with {dict(zip(self.keys, key))} "
+                f"in {time.perf_counter() - start:.1f} s"
+            )
+
+
+if __name__ == "__main__":
+
+    parser = build_parser()
+    parser.add_argument("--queue", action="store", required=True, type=str)
+    # > 0 waits this many seconds for new queue files when the directory is empty
+    parser.add_argument("--poll", action="store", default=0, type=float)
+    args = parser.parse_args()
+    assert args.sweep_idx == -1, "the worker takes its indices from --queue"
+
+    if args.compile_cache:
+        enable_compilation_cache(args.compile_cache)
+
+    with open(EXP_PATH, "r") as f:
+        exp = ExperimentDescription(json.load(f))
+    worker = Worker(exp, args)
+    for indices, finish in read_queue(args.queue, args.poll):
+        worker.process(indices)
+        finish()
@@ -1,3 +1,4 @@
+import json
 import jax
 import jax.numpy as jnp
 import chex
@@ -7,6 +8,7 @@ from functools import partial
 from typing import Optional, Tuple, Union, Any
 from gymnax.environments import environment, spaces
 from brax import envs
+from brax.envs.base import Wrapper as BraxWrapper
 from brax.envs.wrappers.training import EpisodeWrapper, AutoResetWrapper
 
 
@@ -70,10 +72,15 @@ class LogEnvState:
 
 
 class LogWrapper(GymnaxWrapper):
-    """Log the episode returns and lengths."""
+    """Log the episode returns and lengths.
 
-    def __init__(self, env: environment.Environment):
+    Lengths and timesteps count physics steps, i.e. ``action_repeat`` per
+    agent step (see BraxGymnaxWrapper).
+    """
+
+    def __init__(self, env: environment.Environment, action_repeat: int = 1):
         super().__init__(env)
+        self.action_repeat = action_repeat
 
     @partial(jax.jit, static_argnums=(0,))
     def reset(
@@ -95,7 +102,7 @@ class LogWrapper(GymnaxWrapper):
             key, state.env_state, action, params
         )
         new_episode_return = state.episode_returns + reward
-        new_episode_length = state.episode_lengths + 1
+        new_episode_length = state.episode_lengths + self.action_repeat
         state = LogEnvState(
             env_state=env_state,
             episode_returns=new_episode_return * (1 - done),
@@ -104,7 +111,7 @@ class LogWrapper(GymnaxWrapper):
             + new_episode_return * done,
             returned_episode_lengths=state.returned_episode_lengths * (1 - done)
             + new_episode_length * done,
-            timestep=state.timestep + 1,
+            timestep=state.timestep + self.action_repeat,
         )
         info["returned_episode_returns"] = state.returned_episode_returns
         info["returned_episode_lengths"] = state.returned_episode_lengths
@@ -113,12 +120,97 @@ class LogWrapper(GymnaxWrapper):
         return obs, state, reward, done, info
 
 
+def default_backend(env_name):
+    """Brax pipeline used for ``env_name`` unless the config sets BACKEND."""
+    return "generalized" if env_name == "swimmer" else "positional"
+
+
+def resolve_backend(env_name, backend=None):
+    """Brax pipeline for ``env_name`` from the config's BACKEND.
+
+    ``backend`` is None (default_backend), a pipeline name, or a dict mapping
+    env names to pipelines such as the table written by bench_envs.py; envs
+    missing from the dict use default_backend.
+    """
+    if isinstance(backend, dict):
+        backend = backend.get(env_name)
+    return backend or default_backend(env_name)
+
+
+def load_backend(value):
+    """``--backend`` flag value: a pipeline name or the path of a JSON table."""
+    if value and value.endswith(".json"):
+        with open(value) as f:
+            return json.load(f)
+    return value
+
+
+class ResetPoolWrapper(BraxWrapper):
+    """Automatically resets Brax envs to one of a pool of reset states.
+
+    Brax's AutoResetWrapper restarts every episode of an env from that env's
+    first reset state. This wrapper instead restarts a finished episode from a
+    state picked at random from a pool of ``pool_size`` reset states, which
+    ``make_pool`` draws from a key and ``step`` takes as an argument. VecEnv
+    draws one pool per batch of envs at reset, so the envs of a seed share
+    ``pool_size`` states of memory and every seed has its own pool. Switching
+    to a new initial state is a gather from the pool, so steps cost about as
+    much as with AutoResetWrapper.
+    """
+
+    def __init__(self, env, pool_size):
+        super().__init__(env)
+        self.pool_size = pool_size
+
+    def make_pool(self, rng):
+        pool = jax.vmap(self.env.reset)(jax.random.split(rng, self.pool_size))
+        return pool.pipeline_state, pool.obs
+
+    def reset(self, rng):
+        rng, reset_rng = jax.random.split(rng)
+        state = self.env.reset(reset_rng)
+        state.info["reset_rng"] = rng
+        return state
+
+    def step(self, state, action, pool):
+        if "steps" in state.info:
+            steps = state.info["steps"]
+            steps = jnp.where(state.done, jnp.zeros_like(steps), steps)
+            state.info.update(steps=steps)
+        state = state.replace(done=jnp.zeros_like(state.done))
+        state = self.env.step(state, action)
+
+        rng, idx_rng = jax.random.split(state.info["reset_rng"])
+        idx = jax.random.randint(idx_rng, (), 0, self.pool_size)
+        pool_pipeline_state, pool_obs = pool
+        where_done = lambda x, y: jnp.where(state.done, x[idx], y)
+        pipeline_state = jax.tree_util.tree_map(
+            where_done, pool_pipeline_state, state.pipeline_state
+        )
+        obs = where_done(pool_obs, state.obs)
+        state.info.update(reset_rng=rng)
+        return state.replace(pipeline_state=pipeline_state, obs=obs)
+
+
 class BraxGymnaxWrapper:
-    def __init__(self, env_name, backend="positional"):
+    def __init__(
+        self,
+        env_name,
+        backend="positional",
+        reset_pool=0,
+        episode_length=1000,
+        action_repeat=1,
+    ):
         env = envs.get_environment(env_name=env_name, backend=backend)
-        env = EpisodeWrapper(env, episode_length=1000, action_repeat=1)
-        env = AutoResetWrapper(env)
+        # each step applies the action for action_repeat physics steps and
+        # returns the summed reward; episode_length counts physics steps
+        env = EpisodeWrapper(env, episode_length=episode_length, action_repeat=action_repeat)
+        if reset_pool:
+            env = ResetPoolWrapper(env, reset_pool)
+        else:
+            env = AutoResetWrapper(env)
         self._env = env
+        self.reset_pool = reset_pool
         self.action_size = env.action_size
         self.observation_size = (env.observation_size,)
 
@@ -126,8 +218,15 @@ class BraxGymnaxWrapper:
         state = self._env.reset(key)
         return state.obs, state
 
+    def make_reset_pool(self, key):
+        """The reset pool drawn from ``key``, to be passed to ``step`` as ``params``."""
+        return self._env.make_pool(key)
+
     def step(self, key, state, action, params=None):
-        next_state = self._env.step(state, action)
+        if self.reset_pool:
+            next_state = self._env.step(state, action, params)
+        else:
+            next_state = self._env.step(state, action)
         return next_state.obs, next_state, next_state.reward, next_state.done > 0.5, {}
 
     def observation_space(self, params):
@@ -158,6 +257,42 @@ class ClipAction(GymnaxWrapper):
         return self._env.step(key, state, action, params)
 
 
+class PadEnv(GymnaxWrapper):
+    """Zero-pad observations and actions to common sizes.
+
+    Envs with different observation and action sizes then share one network
+    shape (see packed.py). Actions arrive padded and only their first entries
+    reach the env; ``action_mask`` is 1 for those and 0 for the padding.
+    """
+
+    def __init__(self, env, observation_size, action_size):
+        super().__init__(env)
+        self._obs_pad = observation_size - env.observation_space(None).shape[0]
+        self._action_size = env.action_space(None).shape[0]
+        self.padded_observation_size = observation_size
+        self.padded_action_size = action_size
+        self.action_mask = (np.arange(action_size) < self._action_size).astype(np.float32)
+
+    def _pad(self, obs):
+        return jnp.pad(obs, (0, self._obs_pad))
+
+    def reset(self, key, params=None):
+        obs, state = self._env.reset(key, params)
+        return self._pad(obs), state
+
+    def step(self, key, state, action, params=None):
+        obs, state, reward, done, info = self._env.step(
+            key, state, action[: self._action_size], params
+        )
+        return self._pad(obs), state, reward, done, info
+
+    def observation_space(self, params):
+        return spaces.Box(low=-jnp.inf, high=jnp.inf, shape=(self.padded_observation_size,))
+
+    def action_space(self, params):
+        return spaces.Box(low=-1.0, high=1.0, shape=(self.padded_action_size,))
+
+
 class TransformObservation(GymnaxWrapper):
     def __init__(self, env, transform_obs):
         super().__init__(env)
@@ -182,11 +317,41 @@ class TransformReward(GymnaxWrapper):
         return obs, state, self.transform_reward(reward), done, info
 
 
+@struct.dataclass
+class ResetPoolVecEnvState:
+    reset_pool: Any
+    env_state: environment.EnvState
+
+
 class VecEnv(GymnaxWrapper):
+    """Vmaps reset and step over a batch of envs.
+
+    With a reset pool (BraxGymnaxWrapper's ``reset_pool``) the batch draws its
+    pool at reset from its own keys and keeps it in its state, so the pool
+    follows the seed; every env of the batch gets it as ``params`` in step.
+    """
+
     def __init__(self, env):
         super().__init__(env)
-        self.reset = jax.vmap(self._env.reset, in_axes=(0, None))
-        self.step = jax.vmap(self._env.step, in_axes=(0, 0, 0, None))
+        self.reset_pool = getattr(env, "reset_pool", 0)
+        self._reset = jax.vmap(self._env.reset, in_axes=(0, None))
+        self._step = jax.vmap(self._env.step, in_axes=(0, 0, 0, None))
+
+    def reset(self, key, params=None):
+        if not self.reset_pool:
+            return self._reset(key, params)
+        # a key of the batch, apart from the keys the envs reset with
+        reset_pool = self._env.make_reset_pool(jax.random.fold_in(key[0], self.reset_pool))
+        obs, env_state = self._reset(key, params)
+        return obs, ResetPoolVecEnvState(reset_pool=reset_pool, env_state=env_state)
+
+    def step(self, key, state, action, params=None):
+        if not self.reset_pool:
+            return self._step(key, state, action, params)
+        obs, env_state, reward, done, info = self._step(
+            key, state.env_state, action, state.reset_pool
+        )
+        return obs, state.replace(env_state=env_state), reward, done, info
 
 
 @struct.dataclass
@@ -201,14 +366,7 @@ class NormalizeVecObservation(GymnaxWrapper):
     def __init__(self, env):
         super().__init__(env)
 
-    def reset(self, key, params=None):
-        obs, state = self._env.reset(key, params)
-        state = NormalizeVecObsEnvState(
-            mean=jnp.zeros_like(obs),
-            var=jnp.ones_like(obs),
-            count=1e-4,
-            env_state=state,
-        )
+    def _update_stats(self, obs, state, env_state):
         batch_mean = jnp.mean(obs, axis=0)
         batch_var = jnp.var(obs, axis=0)
         batch_count = obs.shape[0]
@@ -223,42 +381,34 @@ class NormalizeVecObservation(GymnaxWrapper):
         new_var = M2 / tot_count
         new_count = tot_count
 
-        state = NormalizeVecObsEnvState(
+        return state.replace(
             mean=new_mean,
             var=new_var,
             count=new_count,
-            env_state=state.env_state,
+            env_state=env_state,
         )
 
-        return (obs - state.mean) / jnp.sqrt(state.var + 1e-8), state
+    def _normalize(self, obs, state):
+        return (obs - state.mean) / jnp.sqrt(state.var + 1e-8)
+
+    def reset(self, key, params=None):
+        obs, env_state = self._env.reset(key, params)
+        state = NormalizeVecObsEnvState(
+            mean=jnp.zeros_like(obs),
+            var=jnp.ones_like(obs),
+            count=1e-4,
+            env_state=env_state,
+        )
+        state = self._update_stats(obs, state, env_state)
+        return self._normalize(obs, state), state
 
     def step(self, key, state, action, params=None):
         obs, env_state, reward, done, info = self._env.step(
             key, state.env_state, action, params
         )
-
-        batch_mean = jnp.mean(obs, axis=0)
-        batch_var = jnp.var(obs, axis=0)
-        batch_count = obs.shape[0]
-
-        delta = batch_mean - state.mean
-        tot_count = state.count + batch_count
-
-        new_mean = state.mean + delta * batch_count / tot_count
-        m_a = state.var * state.count
-        m_b = batch_var * batch_count
-        M2 = m_a + m_b + jnp.square(delta) * state.count * batch_count / tot_count
-        new_var = M2 / tot_count
-        new_count = tot_count
-
-        state = NormalizeVecObsEnvState(
-            mean=new_mean,
-            var=new_var,
-            count=new_count,
-            env_state=env_state,
-        )
+        state = self._update_stats(obs, state, env_state)
         return (
-            (obs - state.mean) / jnp.sqrt(state.var + 1e-8),
+            self._normalize(obs, state),
             state,
             reward,
             done,
@@ -266,6 +416,35 @@ class NormalizeVecObservation(GymnaxWrapper):
         )
 
 
+@struct.dataclass
+class SwitchNormalizeVecObsEnvState(NormalizeVecObsEnvState):
+    normalize: jnp.ndarray = True
+
+
+class SwitchNormalizeVecObservation(NormalizeVecObservation):
+    """NormalizeVecObservation that a traced flag can turn off.
+
+    The running statistics are always tracked; ``normalize`` (given at reset)
+    selects normalized or raw observations, so runs with and without
+    observation normalization can share one compiled graph.
+    """
+
+    def _normalize(self, obs, state):
+        return jnp.where(state.normalize, super()._normalize(obs, state), obs)
+
+    def reset(self, key, params=None, normalize=True):
+        obs, env_state = self._env.reset(key, params)
+        state = SwitchNormalizeVecObsEnvState(
+            mean=jnp.zeros_like(obs),
+            var=jnp.ones_like(obs),
+            count=1e-4,
+            env_state=env_state,
+            normalize=jnp.asarray(normalize),
+        )
+        state = self._update_stats(obs, state, env_state)
+        return self._normalize(obs, state), state
+
+
 @struct.dataclass
 class NormalizeVecRewEnvState:
     mean: jnp.ndarray